@@ -0,0 +1,67 @@
+"""Benchmark postcode normalisation on a million-row synthetic postcode column.
+
+Compares `incognita.utility.postcodes.normalise` with the previous chained
+regex / `str.replace` / per-row padding implementation, and checks that both
+give the same results.
+"""
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from incognita.logger import logger
+from incognita.utility import postcodes
+
+ROWS = 1_000_000
+
+
+def synthetic_postcodes(rows: int, seed: int = 42) -> pd.Series:
+    """Random postcodes in mixed formats: case, spacing, shifted digits, padding and missing values."""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("ABCDEFGHIJKLMNOPRSTUWYZabcdefghijklmnoprstuwyz"))
+    digits = np.array(list('0123456789!"£$%^&*()'))
+    spacers = np.array(["", " ", "  ", "-", "\t"])
+
+    def pick(options: np.ndarray) -> np.ndarray:
+        return options[rng.integers(0, options.size, rows)]
+
+    area = pick(letters).astype(object) + np.where(rng.random(rows) < 0.7, pick(letters), "")
+    district = pick(digits).astype(object) + np.where(rng.random(rows) < 0.4, pick(digits), "")
+    inward = pick(digits).astype(object) + pick(letters) + pick(letters)
+    data = pd.Series(area + district + pick(spacers) + inward, dtype=object)
+    data[rng.random(rows) < 0.01] = np.nan
+    return data
+
+
+def regex_postcode_cleaner(postcode: pd.Series) -> pd.Series:
+    """Previous implementation, for comparison."""
+
+    def pad_to_seven(single_postcode):
+        if single_postcode == single_postcode:  # filters out NaNs
+            length = len(single_postcode)
+            if length == 6 or length == 5:
+                single_postcode = single_postcode[:-3] + " " * (7 - length) + single_postcode[-3:]
+        return single_postcode
+
+    postcode = postcode.str.replace(re.compile(r'[\s+]|[^a-zA-Z\d!"£$%^&*()]'), "", regex=True).str.upper().apply(pad_to_seven)
+    for shifted, number in zip('!"£$%^&*()', "1234567890"):
+        postcode = postcode.str.replace(shifted, number, regex=False)
+    return postcode
+
+
+if __name__ == "__main__":
+    data = synthetic_postcodes(ROWS)
+    logger.info(f"Generated {ROWS:,} synthetic postcodes ({data.nunique():,} unique)")
+
+    for label, column in (("object", data), ("categorical", data.astype("category"))):
+        start_time = time.perf_counter()
+        reference = regex_postcode_cleaner(column)
+        reference_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        normalised = postcodes.normalise(column)
+        normalised_time = time.perf_counter() - start_time
+
+        pd.testing.assert_series_equal(normalised, reference.astype(object))
+        logger.info(f"{label} column: regex cleaner {reference_time:.2f}s, vectorised normaliser {normalised_time:.2f}s ({reference_time / normalised_time:.1f}x)")
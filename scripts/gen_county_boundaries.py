@@ -1,14 +1,13 @@
 import random
 import time
 
-import geopandas as gpd
 import matplotlib.cm
 from matplotlib.colors import rgb2hex
 
+from incognita.data import boundary_store
 from incognita.data.scout_census import load_census_data
 from incognita.logger import logger
 from incognita.utility import config
-from incognita.utility import filter
 
 if __name__ == "__main__":
     start_time = time.time()
@@ -16,11 +15,10 @@ if __name__ == "__main__":
 
     county_name = "Central Yorkshire"
 
-    census_data = load_census_data()
-    census_data = filter.filter_records(census_data, "Census_ID", {20})
+    census_data = load_census_data(census_ids={20})
     county_id = census_data.loc[census_data["C_name"] == county_name, "C_ID"].array[0]
 
-    gdf = gpd.read_file(config.SETTINGS.folders.boundaries / "districts-borders-uk.geojson")
+    gdf = boundary_store.load_boundary(config.SETTINGS.folders.boundaries / "districts-borders-uk.geojson")
     gdf = gdf[gdf["C_ID"] == county_id].copy()
 
     # https://matplotlib.org/stable/tutorials/colors/colormaps.html
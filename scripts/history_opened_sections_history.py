@@ -3,7 +3,6 @@ import time
 from incognita.data.scout_census import load_census_data
 from incognita.logger import logger
 from incognita.reports.history_summary import HistorySummary
-from incognita.utility import filter
 from incognita.utility import timing
 
 if __name__ == "__main__":
@@ -12,9 +11,7 @@ if __name__ == "__main__":
 
     census_ids = {15, 16, 17, 18, 19, 20}
 
-    census_data = load_census_data()
-    census_data = filter.filter_records(census_data, "Census_ID", census_ids)
-    census_data = filter.filter_records(census_data, "X_name", {"England", "Scotland", "Wales", "Northern Ireland"})
+    census_data = load_census_data(census_ids=census_ids, countries={"England", "Scotland", "Wales", "Northern Ireland"})
 
     # If filtering on IMD, remove NA values
     # census_data = filter.filter_records(census_data, "imd_decile", ["nan"], exclude_matching=True)
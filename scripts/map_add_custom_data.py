@@ -16,8 +16,7 @@ if __name__ == "__main__":
     la_code = "E08000035"  # Leeds LA code
     census_id = 20
 
-    census_data = load_census_data()
-    census_data = filter.filter_records(census_data, "Census_ID", {census_id})
+    census_data = load_census_data(census_ids={census_id})
     census_data = filter.filter_records(census_data, "oslaua", {la_code})
     census_data = filter.filter_records(census_data, "postcode_is_valid", {True}, exclusion_analysis=True)
 
@@ -21,9 +21,8 @@ if __name__ == "__main__":
 
     census_id = 20
 
-    census_data = load_census_data()
+    census_data = load_census_data(census_ids={census_id})
     census_data = filter.filter_records(census_data, "postcode_is_valid", {True})
-    census_data = filter.filter_records(census_data, "Census_ID", {census_id})
     # Remove Jersey, Guernsey, and Isle of Man as they don't have lat long coordinates in their postcodes
     census_data = filter.filter_records(census_data, "C_name", {"Bailiwick of Guernsey", "Isle of Man", "Jersey"}, exclude_matching=True)
 
@@ -15,22 +15,22 @@ if __name__ == "__main__":
 
     # # % 6-17 LAs uptake from Jan-2020 Scout Census with May 2019 ONS
     #
+    # from incognita.data import ons_pd_coordinates
+    # from incognita.utility import constants
     # from incognita.utility import utility
-    # import pandas as pd
     # import geopandas as gpd
     # from time import time
     # start = time()
     # # a = geofeather.from_geofeather(utility.SETTINGS.ons_pd.minified) # 60-80s
-    # ons_full = pd.read_feather(utility.SETTINGS.ons_pd.minified)
-    # geo_column = gpd.points_from_xy(ons_full.long, ons_full.lat)
-    # reduced_data_with_geo = gpd.GeoDataFrame(ons_full, geometry=geo_column, crs=utility.WGS_84)
+    # ons_full = ons_pd_coordinates.load_minified()  # co-ordinate arrays, points are built in British National Grid below
+    # reduced_data_with_geo = gpd.GeoDataFrame(ons_full, geometry=ons_pd_coordinates.points(ons_full, crs=constants.BNG))
     # print(f"Loading ONS took: {time() - start:.3f}s")
     # start = time()
     # counties = gpd.GeoDataFrame.from_file(utility.SETTINGS.folders.boundaries / "Counties_and_Unitary_Authorities__December_2019__Boundaries_UK_BUC/Counties_and_Unitary_Authorities__December_2019__Boundaries_UK_BUC.shp")
     # counties = counties[['ctyua19cd', 'geometry']]
     # print(f"Loading shapefile took: {time() - start:.3f}s")
     # start = time()
-    # a = gpd.sjoin(reduced_data_with_geo.to_crs(epsg=27700), counties, how="left",  op='within') # 793s - speed up!!
+    # a = gpd.sjoin(reduced_data_with_geo, counties.to_crs(epsg=constants.BNG), how="left",  op='within') # 793s - speed up!!
     # print(f"Spatial join: {time() - start:.3f}s")
     # c = a[['oscty', 'oslaua', 'osward', 'ctry', 'rgn', 'pcon', 'lsoa11', 'msoa11', 'imd', 'imd_decile', 'ctyua19cd']].drop_duplicates()
     # c.to_feather(utility.SETTINGS.ons_pd.reduced.with_suffix(".feather"))
@@ -48,9 +48,7 @@ if __name__ == "__main__":
     census_ids = {19, 20}
 
     # setup data
-    census_data = load_census_data()
-    census_data = filter.filter_records(census_data, "Census_ID", census_ids)
-    census_data = filter.filter_records(census_data, "X_name", country_names)
+    census_data = load_census_data(census_ids=census_ids, countries=country_names)
     # census_data = filter.filter_records(census_data, "C_name", {"Bailiwick of Guernsey", "Isle of Man", "Jersey"}, exclude_matching=True)
     census_data = filter.filter_records(census_data, "type", {"Colony", "Pack", "Troop", "Unit"})
     census_data = filter.filter_records(census_data, "postcode_is_valid", {True}, exclusion_analysis=True)
@@ -22,9 +22,7 @@ if __name__ == "__main__":
     country_codes = {"E92000001", "W92000004"}
 
     # setup data
-    census_data = load_census_data()
-    census_data = filter.filter_records(census_data, "Census_ID", {20})
-    census_data = filter.filter_records(census_data, "X_name", countries)
+    census_data = load_census_data(census_ids={20}, countries=countries)
     census_data = filter.filter_records(census_data, "type", {"Colony", "Pack", "Troop", "Unit"})
     census_data = filter.filter_records(census_data, "ctry", country_codes)
     census_data = filter.filter_records(census_data, "postcode_is_valid", {True}, exclusion_analysis=True)
@@ -22,9 +22,7 @@ if __name__ == "__main__":
     census_id = 20
 
     # setup data
-    census_data = load_census_data()
-    census_data = filter.filter_records(census_data, "Census_ID", {census_id})
-    census_data = filter.filter_records(census_data, "X_name", {"England", "Scotland", "Wales", "Northern Ireland"})
+    census_data = load_census_data(census_ids={census_id}, countries={"England", "Scotland", "Wales", "Northern Ireland"})
     census_data = filter.filter_records(census_data, "C_name", {"Bailiwick of Guernsey", "Isle of Man", "Jersey"}, exclude_matching=True)
     census_data = filter.filter_records(census_data, "type", {"Colony", "Pack", "Troop", "Unit"})
     census_data = filter.filter_records(census_data, "C_name", {county_name})
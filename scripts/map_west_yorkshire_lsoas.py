@@ -14,8 +14,7 @@ if __name__ == "__main__":
     county_name = "Birmingham"
     census_id = 21
 
-    census_data = load_census_data()
-    census_data = filter.filter_records(census_data, "Census_ID", {census_id})  # 16, 17, 18, 19, 20
+    census_data = load_census_data(census_ids={census_id})  # 16, 17, 18, 19, 20
     census_data = filter.filter_records(census_data, "C_name", {county_name})  # "Shropshire", "West Mercia"
     census_data = filter.filter_records(census_data, "postcode_is_valid", {True})
 
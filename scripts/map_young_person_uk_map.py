@@ -14,8 +14,7 @@ if __name__ == "__main__":
     region_name = "South West"
     census_id = 20
 
-    census_data = load_census_data()
-    census_data = filter.filter_records(census_data, "Census_ID", {census_id})
+    census_data = load_census_data(census_ids={census_id})
     census_data = filter.filter_records(census_data, "R_name", {region_name})
     # Remove Jersey, Guernsey, and Isle of Man as they don't have lat long coordinates in their postcodes
     census_data = filter.filter_records(census_data, "C_name", {"Bailiwick of Guernsey", "Isle of Man", "Jersey"}, exclude_matching=True)
@@ -1,17 +1,25 @@
 from __future__ import annotations
 
 from pathlib import Path
+import sys
 from typing import TYPE_CHECKING
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 
+from incognita.data import boundary_store
+from incognita.data import ons_pd_coordinates
 from incognita.logger import logger
+from incognita.utility import cache
+from incognita.utility import config
 from incognita.utility import constants
 
 if TYPE_CHECKING:
     from incognita.utility.config import Boundary
 
+SPATIAL_JOIN_CACHE_BYTES = 1024 * 2**20  # total size of cached `add_shape_data` results
+
 
 def add_shapefile_data(census_data: pd.DataFrame, metadata: Boundary) -> pd.DataFrame:
     logger.info("Adding shapefile data")
@@ -22,31 +30,136 @@ def add_shapefile_data(census_data: pd.DataFrame, metadata: Boundary) -> pd.Data
     return new_data.rename(columns={shapefile_key: metadata.key})
 
 
-def add_shape_data(census_data: pd.DataFrame, shapes_key: str, path: Path = None, gdf: gpd.GeoDataFrame = None) -> tuple[pd.DataFrame, gpd.GeoDataFrame]:
-    if path is not None:
-        uid = Path(f"{hash(census_data.shape)}_{shapes_key}_{path.stem}.feather")
-        if uid.is_file():
-            data = pd.read_feather(uid).set_index("index")
-            assert census_data.equals(data[census_data.columns])
-            return data, gpd.GeoDataFrame()
-    else:
-        uid = None
+def add_shape_data(census_data: pd.DataFrame, shapes_key: str, path: Path = None, gdf: gpd.GeoDataFrame = None, precision: float = 0) -> tuple[pd.DataFrame, gpd.GeoDataFrame]:
+    """Adds the code of the shape each census record's location is within.
+
+    Each distinct location is tested once, in the co-ordinate reference
+    system of the shapes (so the shapes aren't reprojected), with a bulk
+    query of the shapes' spatial index. The results are then broadcast back
+    to the census records.
 
-    idx = pd.Series(census_data.index, name="object_index")
-    points_data = gpd.GeoDataFrame(idx, geometry=gpd.points_from_xy(census_data.long, census_data.lat), crs=constants.WGS_84)
+    Args:
+        census_data: Census data, with "lat" and "long" columns in WGS84
+        shapes_key: Column of the shapes with the code to add
+        path: Path to a shapefile
+        gdf: Shapes, if `path` isn't passed. Without a co-ordinate reference system, shapes are assumed to be in WGS84
+        precision: For shapes from `path`, maximum distance (metres) shape edges may be simplified by (see `boundary_store.load_boundary`)
+
+    Returns:
+        Census data with a `shapes_key` column (missing where a location isn't within any shape), and a point per census record
+
+    """
+    if path is not None:
+        # Results for shapefiles are cached, keyed by the census locations and the shapefile contents
+        join_cache = spatial_join_cache()
+        key = cache.fingerprint(
+            shapes_key,
+            precision,
+            cache.frame_fingerprint(census_data[["long", "lat"]]),
+            [cache.file_fingerprint(file) for file in boundary_store.source_files(path)],
+            cache.code_fingerprint(add_shape_data, [sys.modules[__name__]]),
+        )
+        cached = join_cache.get(key)
+        if cached is not None:
+            return census_data.assign(**{shapes_key: cached[shapes_key].to_numpy()}), gpd.GeoDataFrame()
 
     if path is not None:
-        all_shapes = gpd.read_file(path)
+        all_shapes = boundary_store.load_boundary(path, precision=precision)
     elif gdf is not None:
         all_shapes = gdf
     else:
         raise ValueError("A path to a shapefile or a GeoDataFrame must be passed")
-    shapes = all_shapes[[shapes_key, "geometry"]].to_crs(epsg=constants.WGS_84)
+    shapes = all_shapes[[shapes_key, "geometry"]]
+    if shapes.crs is None:
+        shapes = shapes.set_crs(epsg=constants.WGS_84)
 
-    spatial_merged = gpd.sjoin(points_data, shapes, how="left", op="within").set_index("object_index")
-    merged = census_data.merge(spatial_merged[[shapes_key]], how="left", left_index=True, right_index=True)
-    assert census_data.equals(merged[census_data.columns])
-    if path is not None and uid is not None:
-        merged.reset_index(drop=False).to_feather(uid)
+    codes, unique_points, locations = _location_shape_codes(census_data["long"], census_data["lat"], constants.WGS_84, shapes, shapes_key)
+    merged = census_data.assign(**{shapes_key: codes})
+    if path is not None:
+        join_cache.put(key, pd.DataFrame({shapes_key: codes}))
 
+    points_data = gpd.GeoDataFrame(pd.Series(census_data.index, name="object_index"), geometry=unique_points.array.take(locations, allow_fill=True), crs=constants.WGS_84)
     return merged, points_data
+
+
+def spatial_join_cache() -> cache.BoundedCache:
+    """Cache of `add_shape_data` results, in the configured cache folder."""
+    return cache.BoundedCache(config.SETTINGS.folders.cache / "spatial joins", SPATIAL_JOIN_CACHE_BYTES)
+
+
+def load_boundary_shapes(metadata: Boundary, precision: float = 0) -> gpd.GeoDataFrame:
+    """Loads the shapes of a boundary, with their spatial index built for bulk queries.
+
+    Args:
+        metadata: Boundary with a shapefile
+        precision: Maximum distance (metres) shape edges may be simplified by (see `boundary_store.load_boundary`)
+
+    Returns:
+        The shapefile key and geometry columns, in the British National Grid (see `boundary_store`)
+
+    """
+    shapes = boundary_store.load_boundary(metadata.shapefile.path, crs=constants.BNG, precision=precision)[[metadata.shapefile.key, "geometry"]]
+    shapes.sindex  # builds the STRtree once, so it is shared by later queries
+    return shapes
+
+
+def boundary_codes(data: pd.DataFrame, shapes: gpd.GeoDataFrame, shapes_key: str) -> pd.Series:
+    """Finds the code of the shape each location is within.
+
+    Locations are read from the co-ordinate columns of the shapes' co-ordinate
+    reference system if `data` has them (e.g. oseast1m/osnrth1m for shapes in
+    the British National Grid), so no points or shapes are reprojected.
+    Otherwise they are read from lat/long and projected.
+
+    Args:
+        data: Data with co-ordinate columns (see `ons_pd_coordinates.COORDINATE_COLUMNS`)
+        shapes: Shapes, e.g. from `load_boundary_shapes`
+        shapes_key: Column of the shapes with the code
+
+    Returns:
+        Codes, indexed as `data`, missing where a location isn't within any shape
+
+    """
+    crs = shapes.crs.to_epsg()
+    crs = crs if crs in ons_pd_coordinates.COORDINATE_COLUMNS and set(ons_pd_coordinates.COORDINATE_COLUMNS[crs]) <= set(data.columns) else constants.WGS_84
+    x, y = ons_pd_coordinates.COORDINATE_COLUMNS[crs]
+    codes, _, _ = _location_shape_codes(data[x], data[y], crs, shapes, shapes_key)
+    return pd.Series(codes, index=data.index, name=shapes_key)
+
+
+def _location_shape_codes(x: pd.Series, y: pd.Series, crs: int, shapes: gpd.GeoDataFrame, shapes_key: str) -> tuple[np.ndarray, gpd.GeoSeries, np.ndarray]:
+    """Codes of the shapes containing each location, testing each distinct location once.
+
+    Many census records (and postcodes) share a location, so locations are
+    deduplicated, tested against the shapes in the shapes' co-ordinate
+    reference system, and the results are broadcast back.
+
+    Returns:
+        The code for each location, the distinct points (in `crs`), and the position of each location in the distinct points (-1 if missing)
+
+    """
+    locations, unique_locations = pd.factorize(x.to_numpy(dtype=float) + 1j * y.to_numpy(dtype=float))
+    unique_points = gpd.GeoSeries(gpd.points_from_xy(unique_locations.real, unique_locations.imag), crs=crs)
+    shape_rows = _containing_shapes(unique_points.to_crs(shapes.crs).array, shapes)
+    shape_codes = shapes[shapes_key].reset_index(drop=True).reindex(np.append(shape_rows, -1)).to_numpy()
+    return shape_codes[locations], unique_points, locations
+
+
+def _containing_shapes(points: gpd.array.GeometryArray, shapes: gpd.GeoDataFrame) -> np.ndarray:
+    """Finds the position of the shape each point is within, using a bulk query of the shapes' spatial index (STRtree).
+
+    Args:
+        points: Points, in the co-ordinate reference system of `shapes`
+        shapes: Shapes to test the points against
+
+    Returns:
+        Array of positions in `shapes`, with -1 where the point isn't within any shape. Where shapes overlap, the first is used
+
+    """
+    shape_rows = np.full(len(points), -1, dtype=np.int64)
+    if len(points) == 0 or shapes.empty:
+        return shape_rows
+    point_positions, shape_positions = shapes.sindex.query_bulk(points, predicate="within")
+    point_positions, first_matches = np.unique(point_positions, return_index=True)
+    shape_rows[point_positions] = shape_positions[first_matches]
+    return shape_rows
@@ -0,0 +1,118 @@
+"""Store of boundary shapes as pre-projected GeoParquet files
+
+Parsing ESRI shapefiles (and GeoJSON) is slow, e.g. several seconds for LSOA
+or ward boundaries, and most consumers then reproject the shapes. The
+boundary store converts each boundary file once into GeoParquet files
+(geometries as WKB in Parquet), one per co-ordinate reference system in
+`STORE_CRS`, with invalid geometries repaired. Later loads read the Parquet
+file for the requested co-ordinate reference system, so shapes are never
+parsed or reprojected again.
+
+Each boundary is also stored at several levels of simplification (a
+pyramid, see `SIMPLIFICATION_TOLERANCES`), simplified in the British
+National Grid so that neighbouring areas still share their edges (see
+`incognita.geographies.boundary_simplification`). Consumers pass the
+precision they need, and get the coarsest level that meets it, e.g. a
+national map needs far less detail than a spatial join of postcodes.
+
+Stored files are in the configured cache folder, keyed by the sizes and
+modification times of the source files, so a changed boundary file is
+converted again. Loaded shapes are also memoised within a process.
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+from pathlib import Path
+
+import geopandas as gpd
+
+from incognita.geographies import boundary_simplification
+from incognita.logger import logger
+from incognita.utility import cache
+from incognita.utility import config
+from incognita.utility import constants
+
+STORE_CRS = (constants.WGS_84, constants.BNG)  # co-ordinate reference systems (EPSG codes) shapes are stored in
+SIMPLIFICATION_TOLERANCES = (0, 10, 50, 250, 1000)  # maximum distances (metres) edges move in each level, 0 being the original shapes
+
+
+def load_boundary(path: Path, crs: int = constants.WGS_84, precision: float = 0) -> gpd.GeoDataFrame:
+    """Loads the shapes of a boundary file from the store, converting the file on first use.
+
+    Args:
+        path: Path to the boundary file (e.g. a shapefile or GeoJSON file)
+        crs: Co-ordinate reference system (EPSG code) to load shapes in, one of `STORE_CRS`
+        precision: Maximum distance (metres) edges may be moved by simplification. The coarsest level of the pyramid within this is loaded
+
+    Returns:
+        All columns of the boundary file. A shallow copy, so columns can be added or renamed, but geometries must not be modified in place
+
+    """
+    if crs not in STORE_CRS:
+        raise ValueError(f"Boundaries are stored in {STORE_CRS}, not {crs}")
+    store_paths = _store_paths(Path(path))
+    if not all(store_path.is_file() for store_path in store_paths.values()):
+        logger.info(f"Converting {path} to the boundary store")
+        save_boundary(gpd.read_file(path), Path(path))
+    tolerance = max(tolerance for tolerance in SIMPLIFICATION_TOLERANCES if tolerance <= precision)
+    return _read_store(store_paths[crs, tolerance]).copy(deep=False)
+
+
+def save_boundary(shapes: gpd.GeoDataFrame, path: Path) -> None:
+    """Saves shapes to the store, as the contents of the boundary file at `path`.
+
+    Invalid geometries are repaired, and shapes without a co-ordinate
+    reference system are assumed to be in WGS84. Each level of the
+    simplification pyramid is saved in each of `STORE_CRS`.
+
+    Args:
+        shapes: Shapes read from the boundary file
+        path: Path to the boundary file
+
+    """
+    if shapes.crs is None:
+        shapes = shapes.set_crs(epsg=constants.WGS_84)
+    invalid = ~shapes.is_valid
+    if invalid.any():
+        logger.info(f"Repairing {invalid.sum()} invalid shapes in {path.name}")
+        shapes = shapes.copy()
+        shapes.loc[invalid, shapes.geometry.name] = shapes.geometry[invalid].make_valid()
+
+    store_paths = _store_paths(path)
+    directory = store_paths[constants.WGS_84, 0].parent
+    directory.mkdir(parents=True, exist_ok=True)
+    for stale_path in directory.glob("*.parquet"):  # from earlier versions of the boundary file
+        if stale_path not in store_paths.values():
+            stale_path.unlink(missing_ok=True)
+
+    bng_shapes = shapes.to_crs(epsg=constants.BNG)
+    is_polygonal = bng_shapes.geom_type.isin({"Polygon", "MultiPolygon"}).all()
+    for tolerance in SIMPLIFICATION_TOLERANCES:
+        level = bng_shapes
+        if tolerance and is_polygonal:
+            simplified = boundary_simplification.simplify_coverage(bng_shapes.geometry.array.data, tolerance)
+            level = bng_shapes.set_geometry(gpd.GeoSeries(simplified, index=bng_shapes.index, crs=constants.BNG))
+        for crs in STORE_CRS:
+            store_path = store_paths[crs, tolerance]
+            temporary_path = store_path.with_name(f"{store_path.name}.tmp")
+            (level if crs == constants.BNG else level.to_crs(epsg=crs)).to_parquet(temporary_path)
+            os.replace(temporary_path, store_path)  # atomic, so readers never see a partial file
+
+
+def source_files(path: Path) -> list[Path]:
+    """The files of a boundary file: all files of a shapefile (.shp, .dbf, .prj etc.), or the file itself for single file formats."""
+    return sorted(path.parent.glob(f"{path.stem}.*")) if path.suffix == ".shp" else [path]
+
+
+def _store_paths(path: Path) -> dict[tuple[int, int], Path]:
+    """Stored file for each co-ordinate reference system and simplification tolerance, in a folder for the boundary file, named by the sizes and modification times of the source files."""
+    directory = config.SETTINGS.folders.cache / "boundaries" / f"{path.stem}-{cache.fingerprint(str(path.resolve()))[:8]}"
+    key = cache.fingerprint([(file.name, file.stat().st_size, file.stat().st_mtime_ns) for file in source_files(path)])[:16]
+    return {(crs, tolerance): directory / f"{key}-{crs}-{tolerance}.parquet" for crs in STORE_CRS for tolerance in SIMPLIFICATION_TOLERANCES}
+
+
+@functools.lru_cache(maxsize=16)
+def _read_store(store_path: Path) -> gpd.GeoDataFrame:
+    return gpd.read_parquet(store_path)
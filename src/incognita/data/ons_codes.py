@@ -0,0 +1,219 @@
+"""Shared dictionary of ONS geography codes
+
+Every ONS geography code (e.g. "E01000001") has a compact integer ID in a
+single project-wide dictionary. Tables store code columns as pandas
+categorical columns with the dictionary's categories, so the categorical codes
+are the IDs: joins, filters and group-bys between tables compare integers, and
+each code string is held once, in the dictionary. Strings are only needed for
+output, where categorical columns are written as their categories.
+
+IDs are stable. The dictionary is versioned and append-only: codes new in a
+release (or codes file) are appended with the next IDs, and the version is
+incremented, so data encoded with an earlier version decodes unchanged.
+
+ID 0 is `scout_census.DEFAULT_VALUE`, used for census records without a valid
+postcode. -1 is used for missing values, as in pandas categorical codes.
+
+The dictionary is built by `setup_reduce_onspd`, which also stores the reduced
+ONS Postcode Directory with its code columns encoded (see `save_encoded`).
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pyarrow import feather
+import pyarrow as pa
+
+from incognita.data import scout_census
+from incognita.logger import logger
+from incognita.utility import config
+
+_ID_TYPE = np.dtype(np.int32)
+_METADATA_KEY = b"incognita.ons_codes"
+
+
+class ONSCodeDictionary:
+    """Versioned, append-only mapping of ONS codes to integer IDs."""
+
+    def __init__(self, codes: pd.Index, version: int = 1, releases: tuple[str, ...] = ()):
+        """Creates a code dictionary.
+
+        Args:
+            codes: Codes in ID order (the ID of a code is its position)
+            version: Dictionary version, incremented each time codes are added
+            releases: Releases (e.g. ONS Postcode Directory publication dates) codes were added from
+
+        """
+        self.codes = pd.Index(codes, dtype=object)
+        self.version = version
+        self.releases = tuple(releases)
+        self.dtype = pd.CategoricalDtype(self.codes)  # shared by every encoded column
+
+    def __len__(self) -> int:
+        return self.codes.size
+
+    @classmethod
+    def empty(cls) -> ONSCodeDictionary:
+        """Dictionary with only the default value (ID 0), as version 0."""
+        return cls(pd.Index([scout_census.DEFAULT_VALUE]), version=0)
+
+    def extended(self, codes: pd.Series | pd.Index | np.ndarray, release: str) -> ONSCodeDictionary:
+        """Adds codes not already in the dictionary, as a new version.
+
+        Existing codes keep their IDs. If there are no new codes, the
+        dictionary is returned unchanged.
+
+        Args:
+            codes: Codes to add, missing values are ignored
+            release: Name of the release the codes are from
+
+        """
+        new_codes = pd.Index(pd.unique(np.asarray(codes, dtype=object))).dropna().difference(self.codes, sort=False)
+        if new_codes.empty:
+            return self
+        logger.info(f"Adding {new_codes.size:,} codes from {release} to the ONS code dictionary (version {self.version + 1})")
+        return ONSCodeDictionary(self.codes.append(new_codes.sort_values()), self.version + 1, self.releases + (release,))
+
+    def encode(self, values: pd.Series | pd.Index | np.ndarray) -> np.ndarray:
+        """Integer IDs of codes, -1 for missing values and codes not in the dictionary."""
+        if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+            # categorical columns: only encode the categories
+            category_ids = np.append(self.codes.get_indexer(values.categories if isinstance(values, pd.Categorical) else values.cat.categories), -1)
+            codes = values.codes if isinstance(values, pd.Categorical) else values.cat.codes.to_numpy()
+            return category_ids[codes].astype(_ID_TYPE)
+        return self.codes.get_indexer(np.asarray(values, dtype=object)).astype(_ID_TYPE)
+
+    def decode(self, ids: np.ndarray) -> np.ndarray:
+        """Codes of integer IDs, NaN for -1."""
+        ids = np.asarray(ids)
+        return np.where(ids == -1, np.nan, self.codes.to_numpy()[ids])
+
+    def categorical(self, values: pd.Series) -> pd.Series:
+        """Converts a column of codes to the shared categorical type.
+
+        If any codes are not in the dictionary (e.g. a names and codes file
+        newer than the dictionary), the column is returned unchanged.
+
+        Args:
+            values: Codes (object or categorical)
+
+        """
+        ids = self.encode(values)
+        unknown = (ids == -1) & values.notna().to_numpy()
+        if unknown.any():
+            logger.warning(f"{unknown.sum():,} values of {values.name} are not in the ONS code dictionary (e.g. {list(pd.unique(values[unknown])[:3])}), so are not encoded")
+            return values
+        return self.from_ids(ids, values.index, values.name)
+
+    def is_encoded(self, values: pd.Series) -> bool:
+        """If `values` are of the shared categorical type, so their categorical codes are IDs in this dictionary."""
+        return isinstance(values.dtype, pd.CategoricalDtype) and values.dtype.categories.is_(self.dtype.categories)
+
+    def from_ids(self, ids: np.ndarray, index: pd.Index = None, name: str = None) -> pd.Series:
+        """Column of the shared categorical type from integer IDs, without copying the IDs."""
+        return pd.Series(pd.Categorical.from_codes(ids, dtype=self.dtype), index=index, name=name)
+
+    def save(self, path: Path = None) -> None:
+        """Saves the dictionary, defaults to the path in the config file."""
+        table = pa.table({"code": pa.array(self.codes.to_numpy(), pa.string())})
+        table = table.replace_schema_metadata({_METADATA_KEY: json.dumps({"version": self.version, "releases": self.releases})})
+        feather.write_feather(table, path or config.SETTINGS.ons_pd.codes, compression="uncompressed")
+        _load_dictionary.cache_clear()
+
+
+def load_dictionary(path: Path = None) -> ONSCodeDictionary:
+    """Loads the code dictionary, defaults to the path in the config file.
+
+    The dictionary is loaded once per process (and path), so every table
+    shares the same categorical type.
+    """
+    return _load_dictionary(Path(path or config.SETTINGS.ons_pd.codes))
+
+
+@functools.lru_cache
+def _load_dictionary(path: Path) -> ONSCodeDictionary:
+    if not path.is_file():
+        return ONSCodeDictionary.empty()
+    table = feather.read_table(path)
+    metadata = json.loads(table.schema.metadata[_METADATA_KEY])
+    return ONSCodeDictionary(pd.Index(table["code"].to_pandas(), dtype=object), metadata["version"], tuple(metadata["releases"]))
+
+
+def save_encoded(data: pd.DataFrame, path: Path, code_columns: list[str], dictionary: ONSCodeDictionary) -> None:
+    """Saves a feather file with code columns stored as integer IDs (see `encode_table`).
+
+    The file is uncompressed and in one record batch, so columns can be
+    memory-mapped and used without copying.
+
+    Args:
+        data: Data to save
+        path: Path to the feather file
+        code_columns: Columns of ONS codes
+        dictionary: Code dictionary, which must hold every code in `code_columns`
+
+    """
+    table = encode_table(data, code_columns, dictionary)
+    feather.write_feather(table, path, compression="uncompressed", chunksize=max(table.num_rows, 1))
+
+
+def encode_table(data: pd.DataFrame, code_columns: list[str], dictionary: ONSCodeDictionary) -> pa.Table:
+    """Converts data to an Arrow table with code columns stored as integer IDs.
+
+    Missing codes are stored as -1, as in categorical codes. The dictionary
+    version and code columns are stored in the table's metadata, for
+    `code_columns` and `load_encoded`.
+
+    Args:
+        data: Data to convert
+        code_columns: Columns of ONS codes
+        dictionary: Code dictionary, which must hold every code in `code_columns`
+
+    """
+    encoded = {}
+    for col in code_columns:
+        encoded[col] = dictionary.encode(data[col])
+        if ((encoded[col] == -1) & data[col].notna().to_numpy()).any():
+            raise ValueError(f"Column {col} has codes which are not in the ONS code dictionary")
+    table = pa.Table.from_pandas(data.assign(**encoded), preserve_index=False)
+    metadata = {_METADATA_KEY: json.dumps({"version": dictionary.version, "code_columns": code_columns})}
+    return table.replace_schema_metadata(table.schema.metadata | metadata)
+
+
+def code_columns(schema: pa.Schema, dictionary: ONSCodeDictionary) -> list[str]:
+    """Columns of a file saved by `save_encoded` which are stored as IDs in the code dictionary.
+
+    Files saved without encoded columns (e.g. by `pd.DataFrame.to_feather`) have none.
+
+    Raises:
+        ValueError: If the file was encoded with a later version of the dictionary
+
+    """
+    metadata = json.loads((schema.metadata or {}).get(_METADATA_KEY, b'{"version": 0, "code_columns": []}'))
+    if metadata["version"] > dictionary.version:
+        raise ValueError(f"Encoded with version {metadata['version']} of the ONS code dictionary, but version {dictionary.version} is loaded")
+    return [col for col in schema.names if col in metadata["code_columns"]]
+
+
+def load_encoded(path: Path, columns: list[str] = None, dictionary: ONSCodeDictionary = None) -> pd.DataFrame:
+    """Loads a feather file saved by `save_encoded`, with code columns of the shared categorical type.
+
+    Files saved without encoded columns are loaded as they are.
+
+    Args:
+        path: Path to the feather file
+        columns: Columns to load, defaults to all
+        dictionary: Code dictionary, defaults to the project dictionary
+
+    """
+    dictionary = dictionary or load_dictionary()
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    encoded_columns = code_columns(table.schema, dictionary)
+    data = table.drop(encoded_columns).to_pandas()
+    for col in encoded_columns:
+        data[col] = dictionary.from_ids(table[col].to_numpy().astype(_ID_TYPE, copy=False), data.index)
+    return data[table.column_names]
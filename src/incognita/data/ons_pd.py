@@ -29,6 +29,8 @@ ONS_POSTCODE_DIRECTORY_MAY_20 = ONSPostcodeDirectory(
         "msoa11": "category",
         "lat": "float32",
         "long": "float32",
+        "oseast1m": "float32",  # British National Grid co-ordinates, in the minified file only
+        "osnrth1m": "float32",
         "imd": "UInt16",  # should be uint16 but not atm because the NaN thing
         "imd_decile": "UInt8",  # should be uint8 but not atm because the NaN thing
     },  # Int capitalised as this ignores NaNs
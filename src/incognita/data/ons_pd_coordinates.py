@@ -0,0 +1,61 @@
+"""Minified ONS Postcode Directory, with postcode co-ordinates as arrays
+
+The minified file holds the unique combinations of ONS Postcode Directory
+fields and postcode co-ordinates. Co-ordinates are plain float32 columns, for
+both WGS 84 (lat/long) and the British National Grid (oseast1m/osnrth1m),
+and the file is uncompressed feather, so loading it is a memory-mapped array
+read rather than decoding a geometry per postcode.
+
+Point geometries are only built on demand, by `points`.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+from pyarrow import feather
+
+from incognita.utility import config
+from incognita.utility import constants
+
+# (x, y) co-ordinate columns for each coordinate reference system
+COORDINATE_COLUMNS: dict[int, tuple[str, str]] = {constants.WGS_84: ("long", "lat"), constants.BNG: ("oseast1m", "osnrth1m")}
+
+
+def load_minified(columns: list[str] = None, path: Path = None) -> pd.DataFrame:
+    """Loads the minified ONS Postcode Directory.
+
+    Args:
+        columns: Columns to load, defaults to all
+        path: Path to the minified file, defaults to the path in the config file
+
+    """
+    return feather.read_table(path or config.SETTINGS.ons_pd.minified, columns=columns, memory_map=True).to_pandas()
+
+
+def save_minified(data: pd.DataFrame, path: Path = None) -> None:
+    """Saves the minified ONS Postcode Directory as uncompressed feather.
+
+    Args:
+        data: ONS Postcode Directory fields with co-ordinate columns (see `COORDINATE_COLUMNS`)
+        path: Path to the minified file, defaults to the path in the config file
+
+    """
+    data.to_feather(path or config.SETTINGS.ons_pd.minified, compression="uncompressed")
+
+
+def points(data: pd.DataFrame, crs: int = constants.WGS_84) -> gpd.GeoSeries:
+    """Builds point geometries from co-ordinate columns.
+
+    Args:
+        data: Data with the co-ordinate columns for `crs`
+        crs: Coordinate reference system (EPSG code) to build points in, WGS 84 or British National Grid
+
+    Returns:
+        Points, indexed as `data`
+
+    """
+    x, y = COORDINATE_COLUMNS[crs]
+    return gpd.GeoSeries(gpd.points_from_xy(data[x], data[y]), index=data.index, crs=crs)
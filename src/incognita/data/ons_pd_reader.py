@@ -0,0 +1,112 @@
+"""Bounded-memory readers for the full ONS Postcode Directory csv file.
+
+The full directory has ~2.6M rows and many more columns than we use, so it is
+parsed in blocks by PyArrow's streaming CSV reader. Only the requested columns
+are converted, and categorical columns are dictionary encoded as they are
+read.
+
+The csv file can be read from within the release zip archive (see
+`incognita.utility.archives`), in which case it is decompressed as each block
+is parsed, so the archive does not need to be extracted first.
+
+Peak memory of a streaming pass is one parsed block (`BLOCK_SIZE` bytes of the
+csv file, plus its pandas conversion) and whatever the caller keeps from each
+chunk. It does not grow with the size of the file.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import pandas as pd
+from pyarrow import csv
+import pyarrow as pa
+
+from incognita.utility import archives
+from incognita.utility import categoricals
+from incognita.utility import config
+from incognita.utility import deciles
+
+if TYPE_CHECKING:
+    from incognita.data.ons_pd import ONSPostcodeDirectory
+
+BLOCK_SIZE = 64 * 2**20  # 64MiB of csv per chunk, roughly 250,000 rows of the full directory
+
+# pandas data types in ONSPostcodeDirectory.data_types -> Arrow types to parse as
+_ARROW_TYPES = {
+    "category": pa.dictionary(pa.int32(), pa.string()),
+    "float32": pa.float32(),
+    "UInt16": pa.uint16(),
+    "UInt8": pa.uint8(),
+}
+# Arrow types -> pandas nullable types, so missing values don't widen integers to floats
+_PANDAS_TYPES = {pa.uint16(): pd.UInt16Dtype(), pa.uint8(): pd.UInt8Dtype()}
+IMD_DECILE = "imd_decile"  # derived from imd and ctry, not a column in the csv file
+
+
+def stream_postcode_directory(ons_pd: ONSPostcodeDirectory, columns: list[str], path: Path = None, block_size: int = BLOCK_SIZE) -> Iterator[pd.DataFrame]:
+    """Reads the full ONS Postcode Directory chunk by chunk.
+
+    Each chunk is indexed by row number within the whole file. If `columns`
+    includes "imd_decile", it is calculated for each chunk.
+
+    Args:
+        ons_pd: Metadata for the ONS Postcode Directory release
+        columns: Columns to keep. All other columns are skipped by the parser
+        path: Path to the csv file (which may be within a zip archive), defaults to the path in the config file
+        block_size: Number of bytes of the csv file parsed per chunk
+
+    """
+    read_columns = _read_columns(columns)
+    offset = 0
+    for batch in _open_csv(ons_pd, read_columns, path, block_size):
+        chunk = batch.to_pandas(types_mapper=_PANDAS_TYPES.get)
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk.index))
+        offset += len(chunk.index)
+        yield _finalise_columns(chunk, columns, ons_pd)
+
+
+def read_postcode_directory(ons_pd: ONSPostcodeDirectory, columns: list[str], path: Path = None, block_size: int = BLOCK_SIZE) -> pd.DataFrame:
+    """Reads the given columns of the full ONS Postcode Directory.
+
+    Chunks are kept as compact Arrow record batches and converted to pandas
+    once, after the dictionaries of categorical columns have been unified
+    across all chunks. Categories are sorted, as with `pd.read_csv`.
+
+    Args:
+        ons_pd: Metadata for the ONS Postcode Directory release
+        columns: Columns to keep. All other columns are skipped by the parser
+        path: Path to the csv file (which may be within a zip archive), defaults to the path in the config file
+        block_size: Number of bytes of the csv file parsed per chunk
+
+    """
+    read_columns = _read_columns(columns)
+    table = pa.Table.from_batches(list(_open_csv(ons_pd, read_columns, path, block_size))).unify_dictionaries()
+    data = table.to_pandas(types_mapper=_PANDAS_TYPES.get, self_destruct=True)
+    del table
+    return categoricals.sort_categories(_finalise_columns(data, columns, ons_pd))
+
+
+def _open_csv(ons_pd: ONSPostcodeDirectory, columns: list[str], path: Path = None, block_size: int = BLOCK_SIZE) -> csv.CSVStreamingReader:
+    column_types = {col: _ARROW_TYPES[dtype] for col, dtype in ons_pd.data_types.items() if col in columns and dtype in _ARROW_TYPES}
+    path = path or config.SETTINGS.ons_pd.full
+    return csv.open_csv(
+        path if Path(path).is_file() else archives.open_file(path),  # files on disk are read natively by Arrow
+        read_options=csv.ReadOptions(block_size=block_size, encoding="utf-8"),
+        convert_options=csv.ConvertOptions(include_columns=columns, column_types=column_types, strings_can_be_null=True),
+    )
+
+
+def _read_columns(columns: list[str]) -> list[str]:
+    """Columns to read from the csv file to produce `columns`."""
+    if IMD_DECILE not in columns:
+        return list(columns)
+    return [col for col in columns if col != IMD_DECILE] + [col for col in ("imd", "ctry") if col not in columns]
+
+
+def _finalise_columns(data: pd.DataFrame, columns: list[str], ons_pd: ONSPostcodeDirectory) -> pd.DataFrame:
+    if IMD_DECILE in columns:
+        data[IMD_DECILE] = deciles.calc_imd_decile(data["imd"], data["ctry"], ons_pd).astype("UInt8")
+    return data[list(columns)]
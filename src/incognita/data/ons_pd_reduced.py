@@ -0,0 +1,192 @@
+"""Process-wide access to the reduced ONS Postcode Directory
+
+Reports, geographies and maps look up area codes in the reduced ONS Postcode
+Directory (see `setup_reduce_onspd`), often several times in one script. The
+reduced file is memory-mapped once per process by `reduced_ons_pd`, and each
+column is converted to pandas the first time it is used, then kept for later
+calls. Columns are kept up to a total size (`MAX_CACHED_BYTES`), beyond which
+the least recently used columns are released.
+
+The reduced file is partitioned by country and region (`PARTITION_COLUMNS`):
+rows are sorted by partition, and each partition is a separate record batch
+of the file (see `save_reduced`). Filters on partition columns select record
+batches, so only the pages of the file holding the matching partitions are
+read, e.g. about 5% of the file for Wales.
+
+Code columns (IDs in the shared code dictionary, see `incognita.data.ons_codes`)
+and integer columns without missing values read from a single partition are
+zero-copy views of the memory map, so are read-only: copy them before
+modifying them.
+"""
+
+from __future__ import annotations
+
+import collections
+from collections.abc import Collection
+import functools
+import json
+from pathlib import Path
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from incognita.data import ons_codes
+from incognita.logger import logger
+from incognita.utility import config
+
+MAX_CACHED_BYTES = 256 * 2**20  # total size of columns kept in memory
+PARTITION_COLUMNS = ("ctry", "rgn")
+_METADATA_KEY = b"incognita.partitions"
+_PANDAS_TYPES = {pa.uint16(): pd.UInt16Dtype(), pa.uint8(): pd.UInt8Dtype(), pa.int32(): pd.Int32Dtype()}  # keep missing values in integer columns
+
+
+def save_reduced(data: pd.DataFrame, path: Path, code_columns: list[str], dictionary: ons_codes.ONSCodeDictionary, partition_by: tuple[str, ...] = PARTITION_COLUMNS) -> None:
+    """Saves the reduced ONS Postcode Directory, partitioned by the given code columns.
+
+    The file is an uncompressed Arrow IPC (feather) file with code columns
+    stored as IDs (see `ons_codes.encode_table`), with a record batch per
+    partition.
+
+    Args:
+        data: Reduced ONS Postcode Directory data
+        path: Path to the feather file
+        code_columns: Columns of ONS codes
+        dictionary: Code dictionary, which must hold every code in `code_columns`
+        partition_by: Code columns to partition by, e.g. ("ctry",) for countries only
+
+    """
+    if not set(partition_by) <= set(code_columns):
+        raise ValueError(f"Partition columns must be code columns, not {sorted(set(partition_by) - set(code_columns))}")
+    table = ons_codes.encode_table(data, code_columns, dictionary)
+    partition_ids = np.column_stack([table[col].to_numpy() for col in partition_by]).reshape(table.num_rows, len(partition_by))
+    table = table.take(np.lexsort(partition_ids.T[::-1]))  # stable, so rows keep their order within partitions
+
+    partitions, starts = np.unique(partition_ids[np.lexsort(partition_ids.T[::-1])], axis=0, return_index=True)
+    bounds = [*starts.tolist(), table.num_rows]
+    metadata = {"partition_by": list(partition_by), "partitions": partitions.tolist()}
+    table = table.replace_schema_metadata(table.schema.metadata | {_METADATA_KEY: json.dumps(metadata)})
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            writer.write_table(table.slice(start, stop - start), max_chunksize=max(stop - start, 1))
+    logger.info(f"Saved {table.num_rows:,} rows in {len(partitions)} partitions by {', '.join(partition_by)}")
+
+
+class ReducedONSPD:
+    """Lazily loaded, memoised columns of the reduced ONS Postcode Directory."""
+
+    def __init__(self, path: Path = None, max_cached_bytes: int = MAX_CACHED_BYTES):
+        """Memory-maps the reduced ONS Postcode Directory file. Columns are loaded by `columns`.
+
+        Args:
+            path: Path to the reduced file, defaults to the path in the config file
+            max_cached_bytes: Total size of columns kept in memory
+
+        """
+        self.path = Path(path or config.SETTINGS.ons_pd.reduced)
+        self.max_cached_bytes = max_cached_bytes
+        with pa.ipc.open_file(pa.memory_map(str(self.path))) as reader:
+            self._schema = reader.schema
+            self._batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]  # zero-copy, buffers point into the memory map
+        self._dictionary = ons_codes.load_dictionary()
+        self._code_columns = set(ons_codes.code_columns(self._schema, self._dictionary))
+
+        # ID of each partition column in each record batch. Files saved without partitions have no partition columns
+        metadata = json.loads((self._schema.metadata or {}).get(_METADATA_KEY, b'{"partition_by": [], "partitions": []}'))
+        self.partition_by: list[str] = metadata["partition_by"]
+        self._partitions = pd.DataFrame(metadata["partitions"], columns=self.partition_by, dtype=np.int64)
+        self._cached: collections.OrderedDict[tuple[str, tuple[int, ...]], pd.Series] = collections.OrderedDict()  # least recently used first
+        self._lock = threading.Lock()
+
+    @property
+    def column_names(self) -> list[str]:
+        """All columns of the reduced ONS Postcode Directory."""
+        return self._schema.names
+
+    @property
+    def cached_bytes(self) -> int:
+        """Total size of the columns kept in memory. The categories of code columns are the shared code dictionary, so aren't counted."""
+        return sum(series.cat.codes.nbytes if series.name in self._code_columns else series.memory_usage(index=False) for series in self._cached.values())
+
+    def columns(self, names: list[str], where: dict[str, Collection] = None) -> pd.DataFrame:
+        """Gets columns of the reduced ONS Postcode Directory, loading them on first use.
+
+        Args:
+            names: Columns to get
+            where: Only get rows where each of these columns has one of the given values. Conditions on partition
+                columns only read the matching partitions
+
+        Returns:
+            DataFrame of the columns, sharing memory with the kept columns where possible
+
+        Raises:
+            KeyError: If a column isn't in the reduced ONS Postcode Directory
+
+        """
+        where = where or {}
+        missing = [name for name in [*names, *where] if name not in self.column_names]
+        if missing:
+            raise KeyError(f"{missing} not in the reduced ONS Postcode Directory. Valid columns are: {self.column_names}")
+
+        batches = self._select_batches({col: values for col, values in where.items() if col in self.partition_by})
+        row_filters = {col: values for col, values in where.items() if col not in self.partition_by}
+        with self._lock:
+            columns = {name: self._column(name, batches) for name in [*names, *row_filters]}
+            self._evict(keep={(name, batches) for name in columns})
+        data = pd.DataFrame(columns, copy=False)
+        if row_filters:
+            data = data.loc[np.logical_and.reduce([data[col].isin(values).to_numpy() for col, values in row_filters.items()]), names].reset_index(drop=True)
+        return data
+
+    def _select_batches(self, partition_filters: dict[str, Collection]) -> tuple[int, ...]:
+        """Record batches (partitions) matching the filters on partition columns."""
+        selected = np.ones(len(self._batches), dtype=bool)
+        for col, values in partition_filters.items():
+            ids = self._dictionary.encode(np.array([*values], dtype=object))
+            selected &= self._partitions[col].isin(ids[ids != -1]).to_numpy()
+        if partition_filters:
+            logger.debug(f"Reading {selected.sum()} of {selected.size} partitions of the reduced ONS Postcode Directory")
+        return tuple(np.flatnonzero(selected).tolist())
+
+    def _column(self, name: str, batches: tuple[int, ...]) -> pd.Series:
+        key = (name, batches)
+        if key in self._cached:
+            self._cached.move_to_end(key)
+            return self._cached[key]
+        logger.debug(f"Loading {name} from the reduced ONS Postcode Directory")
+        field = self._schema.field(name)
+        arrays = [self._batches[batch].column(name) for batch in batches]
+        if name in self._code_columns:
+            ids = arrays[0].to_numpy() if len(arrays) == 1 else np.concatenate([array.to_numpy() for array in arrays] or [np.empty(0, np.int32)])
+            series = self._dictionary.from_ids(ids, name=name)
+        elif pa.types.is_integer(field.type) and not any(array.null_count for array in arrays):
+            values = arrays[0].to_numpy() if len(arrays) == 1 else np.concatenate([array.to_numpy() for array in arrays] or [np.empty(0, field.type.to_pandas_dtype())])
+            series = pd.Series(values, name=name, copy=False)
+        else:
+            series = pa.table({name: pa.chunked_array(arrays, field.type)}).to_pandas(types_mapper=_PANDAS_TYPES.get)[name]
+        self._cached[key] = series
+        return series
+
+    def _evict(self, keep: set[tuple[str, tuple[int, ...]]]) -> None:
+        """Releases the least recently used columns (other than `keep`) until the total size is within the bound."""
+        for key in list(self._cached):
+            if self.cached_bytes <= self.max_cached_bytes:
+                return
+            if key not in keep:
+                del self._cached[key]
+
+
+def reduced_ons_pd(path: Path = None) -> ReducedONSPD:
+    """The reduced ONS Postcode Directory, opened once per process (and path).
+
+    Args:
+        path: Path to the reduced file, defaults to the path in the config file
+
+    """
+    return _reduced_ons_pd(Path(path or config.SETTINGS.ons_pd.reduced))
+
+
+@functools.lru_cache
+def _reduced_ons_pd(path: Path) -> ReducedONSPD:
+    return ReducedONSPD(path)
@@ -0,0 +1,295 @@
+"""Persistent postcode index for ONS Postcode Directory lookups
+
+The index file is an uncompressed Arrow IPC file, with one row per postcode
+sorted by postcode. Postcodes are stored as packed integer keys (see
+`incognita.utility.postcodes.encode`), next to the ONS Postcode Directory
+fields for each postcode.
+
+The file is memory-mapped, so opening the index doesn't read the file. Only
+the pages of the file touched by lookups are read, and they are shared
+between processes by the OS page cache. Lookups are vectorised binary
+searches over the sorted integer keys:
+- `is_valid` checks if postcodes are in the ONS Postcode Directory
+- `rows` finds the row number of each postcode
+- `attributes` gets fields for row numbers, optionally with default values
+  for missing rows
+- `lookup` combines `rows` and `attributes`
+
+`diff_indexes` compares the indexes of two ONS Postcode Directory releases,
+to find postcodes which were added, removed or had fields changed.
+
+The index is built by `setup_reduce_onspd` from the full directory, and
+records the publication date of the release it was built from.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from incognita.utility import config
+from incognita.utility import postcodes
+
+KEY_COLUMN = "pcd"
+PUBLICATION_DATE_KEY = b"incognita.publication_date"  # schema metadata key of the release's publication date
+DIFF_STATUSES = ("added", "removed", "changed")  # statuses of postcodes in `diff_indexes`
+_PANDAS_TYPES = {pa.uint16(): pd.UInt16Dtype(), pa.uint8(): pd.UInt8Dtype(), pa.int32(): pd.Int32Dtype()}  # keep missing values in integer columns
+
+
+class PostcodeIndex:
+    """Memory-mapped index of the ONS Postcode Directory, keyed by postcode."""
+
+    def __init__(self, path: Path = None):
+        """Opens (memory-maps) a postcode index file.
+
+        Args:
+            path: Path to the index file, defaults to the path in the config file
+
+        """
+        self.path = Path(path or config.SETTINGS.ons_pd.index)
+        with pa.ipc.open_file(pa.memory_map(str(self.path))) as reader:
+            table = reader.read_all()  # zero-copy, buffers point into the memory map
+
+        self._keys = table[KEY_COLUMN].combine_chunks().to_numpy()  # zero-copy, as keys are never missing
+        self._table = table.drop([KEY_COLUMN])
+        publication_date = (table.schema.metadata or {}).get(PUBLICATION_DATE_KEY)
+        self.publication_date = publication_date.decode() if publication_date is not None else None  # of the release, e.g. "May 2020", if recorded when built
+
+    def __len__(self) -> int:
+        return self._keys.size
+
+    @property
+    def columns(self) -> list[str]:
+        """Fields held for each postcode."""
+        return self._table.column_names
+
+    def rows(self, postcodes: pd.Series | np.ndarray) -> np.ndarray:
+        """Finds the row of each postcode in the index.
+
+        Args:
+            postcodes: Normalised postcodes (see `incognita.utility.postcodes.normalise`), or postcode keys (see `incognita.utility.postcodes.encode`)
+
+        Returns:
+            Array of row numbers, with -1 where the postcode isn't in the index
+
+        """
+        keys = _to_keys(postcodes)
+        positions = np.searchsorted(self._keys, keys)
+        positions[positions == self._keys.size] = 0  # past the last key, so not in the index
+        found = self._keys[positions] == keys if self._keys.size else np.zeros(keys.size, dtype=bool)  # INVALID_KEY is never in the index
+        return np.where(found, positions, -1)
+
+    def is_valid(self, postcodes: pd.Series | np.ndarray) -> np.ndarray:
+        """Checks if each postcode is in the ONS Postcode Directory.
+
+        Args:
+            postcodes: Normalised postcodes (see `incognita.utility.postcodes.normalise`), or postcode keys
+
+        Returns:
+            Boolean array, True where the postcode is valid
+
+        """
+        return self.rows(postcodes) != -1
+
+    def attributes(self, rows: np.ndarray, columns: list[str] = None, fill_values: dict[str, object] = None) -> pd.DataFrame:
+        """Gets the ONS Postcode Directory fields for rows of the index.
+
+        Args:
+            rows: Row numbers, -1 for missing rows (e.g. from `rows`)
+            columns: Fields to return, defaults to all fields
+            fill_values: Values for fields in missing rows, by field. Other fields are missing in missing rows
+
+        Returns:
+            DataFrame with one row per passed row
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        missing = rows == -1
+        table = self._table.select(columns if columns is not None else self.columns)
+        table = table.take(pa.array(rows, mask=missing))
+        if fill_values and missing.any():
+            is_missing = pa.array(missing)
+            for field, value in fill_values.items():
+                position = table.schema.get_field_index(field)
+                if position != -1:
+                    table = table.set_column(position, field, _fill_rows(table[field].combine_chunks(), is_missing, value))
+        return table.to_pandas(types_mapper=_PANDAS_TYPES.get)
+
+    def lookup(self, postcodes: pd.Series, columns: list[str] = None, fill_values: dict[str, object] = None) -> pd.DataFrame:
+        """Gets the ONS Postcode Directory fields for each postcode.
+
+        Args:
+            postcodes: Normalised postcodes (see `incognita.utility.postcodes.normalise`)
+            columns: Fields to return, defaults to all fields
+            fill_values: Values for fields where the postcode isn't valid, by field
+
+        Returns:
+            DataFrame indexed as `postcodes`, with missing values (or `fill_values`) where the postcode isn't valid
+
+        """
+        return self.attributes(self.rows(postcodes), columns, fill_values).set_axis(postcodes.index)
+
+
+def build_postcode_index(ons_pd_data: pd.DataFrame, path: Path = None, publication_date: str = None) -> None:
+    """Writes a postcode index file.
+
+    Args:
+        ons_pd_data: ONS Postcode Directory data, indexed by postcode (seven character format)
+        path: Path to the index file, defaults to the path in the config file
+        publication_date: Publication date of the ONS Postcode Directory release, e.g. "May 2020", recorded in the file
+
+    """
+    _write_index(_index_table(ons_pd_data), path, publication_date)
+
+
+class PostcodeIndexBuilder:
+    """Builds a postcode index file from chunks of the ONS Postcode Directory, without keeping the chunks in memory.
+
+    Each chunk is sorted by postcode and written to a temporary run file as it
+    is added. `build` memory-maps the runs and writes them to the index file in
+    postcode order, one column at a time, so only the sorted index is held in
+    memory, not the chunks it was built from. As with `build_postcode_index`,
+    the first row of each postcode is kept.
+    """
+
+    def __init__(self):
+        self._directory = tempfile.TemporaryDirectory(prefix="postcode index runs ")
+        self._run_paths: list[Path] = []
+
+    def add(self, ons_pd_data: pd.DataFrame) -> None:
+        """Adds a chunk of ONS Postcode Directory data, indexed by postcode (seven character format)."""
+        run = _index_table(ons_pd_data)
+        run_path = Path(self._directory.name) / f"run {len(self._run_paths)}.arrow"
+        with pa.OSFile(str(run_path), "wb") as sink, pa.ipc.new_file(sink, run.schema) as writer:
+            writer.write_table(run)
+        self._run_paths.append(run_path)
+
+    def build(self, path: Path = None, publication_date: str = None) -> None:
+        """Writes the index file from the chunks added, then removes the run files.
+
+        Args:
+            path: Path to the index file, defaults to the path in the config file
+            publication_date: Publication date of the ONS Postcode Directory release, e.g. "May 2020", recorded in the file
+
+        """
+        try:
+            runs = []
+            for run_path in self._run_paths:
+                with pa.ipc.open_file(pa.memory_map(str(run_path))) as reader:
+                    runs.append(reader.read_all())  # zero-copy, buffers point into the memory map
+            runs = pa.concat_tables(runs)
+            keys = runs[KEY_COLUMN].to_numpy()
+            order = np.argsort(keys, kind="stable")  # runs are in the order added, so the first row of each postcode stays first
+            order = order[np.diff(keys[order], prepend=postcodes.INVALID_KEY) != 0]  # INVALID_KEY is never in the index
+            columns = {}
+            for name in runs.column_names:
+                column = pa.table({name: runs[name]}).unify_dictionaries()[name].take(order).combine_chunks()
+                columns[name] = _sort_dictionary(column) if pa.types.is_dictionary(column.type) else column
+            del runs
+            _write_index(pa.table(columns), path, publication_date)
+        finally:
+            self._directory.cleanup()
+
+
+def _index_table(ons_pd_data: pd.DataFrame) -> pa.Table:
+    """ONS Postcode Directory data as an index table: sorted by postcode key, with a row per postcode and categorical fields dictionary encoded with 32-bit indices."""
+    ons_pd_data = ons_pd_data.loc[ons_pd_data.index.notna()]
+    ons_pd_data = ons_pd_data.loc[~ons_pd_data.index.duplicated()]
+    keys = postcodes.encode(ons_pd_data.index)
+    if (keys == postcodes.INVALID_KEY).any():
+        raise ValueError(f"Postcodes must be normalised (seven characters), e.g. {list(ons_pd_data.index[keys == postcodes.INVALID_KEY][:5])}")
+
+    order = np.argsort(keys, kind="stable")
+    table = pa.Table.from_pandas(ons_pd_data.iloc[order].reset_index(drop=True), preserve_index=False)
+    # The same index type in every chunk, so tables of chunks (whose categories differ) can be concatenated
+    fields = [pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type) else field for field in table.schema]
+    table = table.cast(pa.schema(fields)).replace_schema_metadata(None)
+    return table.add_column(0, KEY_COLUMN, pa.array(keys[order], type=pa.uint64()))
+
+
+def _sort_dictionary(array: pa.DictionaryArray) -> pa.DictionaryArray:
+    """Dictionary encoded array with its dictionary sorted, as categories of chunks concatenated with `categoricals.concat` are."""
+    order = pc.array_sort_indices(array.dictionary)
+    ranks = np.empty(len(order), dtype=np.int32)
+    ranks[order.to_numpy()] = np.arange(len(order), dtype=np.int32)
+    return pa.DictionaryArray.from_arrays(pc.take(pa.array(ranks), array.indices), pc.take(array.dictionary, order))
+
+
+def _write_index(table: pa.Table, path: Path = None, publication_date: str = None) -> None:
+    if publication_date is not None:
+        table = table.replace_schema_metadata({PUBLICATION_DATE_KEY: publication_date.encode()})
+    with pa.OSFile(str(path or config.SETTINGS.ons_pd.index), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table.combine_chunks(), max_chunksize=max(table.num_rows, 1))  # one record batch, so the keys are contiguous
+
+
+def diff_indexes(previous: PostcodeIndex, current: PostcodeIndex, columns: list[str] = None) -> pd.DataFrame:
+    """Finds the postcodes that differ between two postcode indexes (e.g. of successive ONS Postcode Directory releases).
+
+    Postcodes in both indexes are compared field by field, where missing
+    values equal each other. Categorical fields are compared by their
+    positions in the current index's categories, not as strings.
+
+    Args:
+        previous: Index of the earlier release
+        current: Index of the later release
+        columns: Fields to compare, defaults to the fields in both indexes
+
+    Returns:
+        DataFrame indexed by postcode key (see `incognita.utility.postcodes.encode`), sorted, with a row for each postcode
+        added, removed or with changed fields. Has a "status" column (from `DIFF_STATUSES`) and a boolean column for each
+        field, True where the field changed (always True for added and removed postcodes)
+
+    """
+    columns = columns if columns is not None else [col for col in current.columns if col in previous.columns]
+    common, previous_rows, current_rows = np.intersect1d(previous._keys, current._keys, assume_unique=True, return_indices=True)
+    changed = pd.DataFrame(
+        {col: ~_equal_values(previous._table[col].take(previous_rows).combine_chunks(), current._table[col].take(current_rows).combine_chunks()) for col in columns},
+        index=common,
+    )
+    changed = changed.loc[changed.any(axis=1)].assign(status="changed")
+
+    added = pd.DataFrame(True, index=np.setdiff1d(current._keys, previous._keys, assume_unique=True), columns=columns).assign(status="added")
+    removed = pd.DataFrame(True, index=np.setdiff1d(previous._keys, current._keys, assume_unique=True), columns=columns).assign(status="removed")
+    diff = pd.concat([added, removed, changed]).sort_index()
+    diff["status"] = pd.Categorical(diff["status"], categories=DIFF_STATUSES)
+    return diff.rename_axis(KEY_COLUMN)
+
+
+def _equal_values(left: pa.Array, right: pa.Array) -> np.ndarray:
+    """Element-wise equality of two arrays, where missing values equal each other."""
+    both_missing = pc.and_(left.is_null(), right.is_null())
+    if pa.types.is_dictionary(left.type) and pa.types.is_dictionary(right.type):
+        # positions of the left values in the right dictionary (missing if not in it), so only integers are compared
+        left = pc.take(pc.index_in(left.dictionary, value_set=right.dictionary), left.indices).cast(pa.int64())
+        right = right.indices.cast(pa.int64())
+    equal = pc.fill_null(pc.equal(left, right), False)
+    return pc.or_(equal, both_missing).to_numpy(zero_copy_only=False)
+
+
+def _to_keys(values: pd.Series | np.ndarray) -> np.ndarray:
+    """Postcode keys of normalised postcodes, or the values if they are already keys."""
+    if isinstance(values, np.ndarray) and values.dtype == postcodes.KEY_TYPE:
+        return values
+    return postcodes.encode(values)
+
+
+def _fill_rows(array: pa.Array, rows: pa.BooleanArray, value: object) -> pa.Array:
+    """Sets `value` in the selected rows of `array`.
+
+    For dictionary (categorical) arrays, `value` is added to the dictionary
+    once if needed, and only the indices are changed.
+    """
+    if not pa.types.is_dictionary(array.type):
+        return pc.if_else(rows, pa.scalar(value, array.type), array)
+    dictionary = array.dictionary
+    position = pc.index(dictionary, pa.scalar(value, dictionary.type)).as_py()
+    if position == -1:
+        dictionary = pa.concat_arrays([dictionary, pa.array([value], dictionary.type)])
+        position = len(dictionary) - 1
+    indices = pc.if_else(rows, pa.scalar(position, array.indices.type), array.indices)
+    return pa.DictionaryArray.from_arrays(indices, dictionary)
@@ -1,19 +1,221 @@
+from __future__ import annotations
+
+from collections.abc import Collection
+import functools
+import operator
+from pathlib import Path
+import shutil
 import time
 from typing import Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import pydantic
-from pyarrow import feather
 
 from incognita.logger import logger
+from incognita.utility import categoricals
 from incognita.utility import config
 
+_NULLABLE_INTEGER_TYPES = {"Int8", "Int16", "Int32", "Int64", "UInt8", "UInt16", "UInt32", "UInt64"}
+
+
+def load_census_data(census_ids: Collection[int] = None, countries: Collection[str] = None, columns: list[str] = None, memory_map: bool = False) -> pd.DataFrame:
+    """Loads Scout Census Data from disk.
+
+    The merged census data is a Parquet dataset partitioned by census ID (and
+    optionally Scout country), see `save_census_data`. Filters on census ID
+    and country skip whole partitions (or row groups, if the dataset isn't
+    partitioned by country), and only the requested columns are decoded.
+
+    Records are returned grouped by census ID (ascending), and within that in
+    the order they were saved. Categorical columns only have the categories
+    present in the loaded records.
+
+    With `memory_map`, the uncompressed Arrow copy of the census data is
+    memory-mapped instead (see `load_memory_mapped_census_data`).
+
+    Args:
+        census_ids: Census IDs to load, defaults to all
+        countries: Scout countries (X_name) to load, defaults to all
+        columns: Columns to load, defaults to all
+        memory_map: Memory-map the Arrow copy of the census data instead of reading the Parquet dataset
+
+    """
+    if memory_map:
+        return load_memory_mapped_census_data(census_ids, countries, columns)
 
-def load_census_data():
-    # Loads Scout Census Data from disk.
     start_time = time.time()
-    census_data = feather.read_feather(config.SETTINGS.census_extract.merged) if load_census_data else pd.DataFrame()
+    census_id_label = column_labels.CENSUS_ID
+    dataset = ds.dataset(config.SETTINGS.census_extract.merged, format="parquet", partitioning="hive")
+
+    filters = []
+    if census_ids is not None:
+        filters.append(ds.field(census_id_label).isin(list(census_ids)))
+    if countries is not None:
+        filters.append(ds.field(column_labels.name.COUNTRY).isin(list(countries)))
+    filter_expression = functools.reduce(operator.and_, filters) if filters else None
+
+    # Column order as saved, as partition columns are moved to the end of the dataset schema
+    saved_columns = [col["name"] for col in dataset.schema.pandas_metadata["columns"]]
+    columns = [col for col in saved_columns if col in dataset.schema.names] if columns is None else list(columns)
+    read_columns = columns if census_id_label in columns else columns + [census_id_label]  # needed to order records
+
+    census_data = dataset.to_table(columns=read_columns, filter=filter_expression).to_pandas()
+    census_data = census_data.sort_values(census_id_label, kind="stable", ignore_index=True)[columns]
+    census_data = _restore_partition_types(census_data, dataset.partitioning.schema, dataset.schema.pandas_metadata)
     logger.info(f"Loaded Scout Census data, {time.time() - start_time:.2f} seconds elapsed.")
+    return categoricals.tidy_categories(census_data)
+
+
+def save_census_data(data: pd.DataFrame, path: Path, partition_by_country: bool = False) -> None:
+    """Saves census data as a Parquet dataset, partitioned by census ID.
+
+    Any existing dataset at `path` is replaced. The dataset is written to a
+    sibling directory first and then swapped in, so the existing dataset is
+    kept if writing fails.
+
+    Args:
+        data: Census data
+        path: Directory for the dataset
+        partition_by_country: If True, also partition by Scout country (X_name)
+
+    Raises:
+        ValueError: If `path` exists and isn't a census dataset
+
+    """
+    path = Path(path)
+    if path.exists() and not _is_census_dataset(path):
+        raise ValueError(f"{path} isn't a census dataset, so won't be replaced")
+
+    partition_cols = [column_labels.CENSUS_ID] + ([column_labels.name.COUNTRY] if partition_by_country else [])
+    temporary_path, previous_path = path.with_name(f"{path.name}.tmp"), path.with_name(f"{path.name}.old")
+    shutil.rmtree(temporary_path, ignore_errors=True)  # left by an interrupted save
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    ds.write_dataset(table, temporary_path, format="parquet", partitioning=partition_cols, partitioning_flavor="hive")
+
+    shutil.rmtree(previous_path, ignore_errors=True)
+    if path.exists():
+        path.rename(previous_path)
+    temporary_path.rename(path)
+    shutil.rmtree(previous_path, ignore_errors=True)
+
+
+def _is_census_dataset(path: Path) -> bool:
+    """Whether `path` is a directory that can be replaced by a census dataset: empty, or with Parquet metadata or data files."""
+    return path.is_dir() and (not any(path.iterdir()) or (path / "_common_metadata").exists() or any(path.rglob("*.parquet")))
+
+
+def load_memory_mapped_census_data(census_ids: Collection[int] = None, countries: Collection[str] = None, columns: list[str] = None) -> pd.DataFrame:
+    """Memory-maps the Arrow copy of the census data, see `save_memory_mapped_census_data`.
+
+    Nothing is read from the file when it is opened. Columns are numpy views
+    onto the memory-mapped pages where possible (numbers, booleans and the
+    codes of categorical columns), so the pages are shared with every other
+    process using the file through the OS page cache, and only the pages
+    used are read. Unlike `load_census_data`, these columns are read-only:
+    copy the data before modifying values in place.
+
+    Records are sorted by census ID, so filtering by census ID slices the
+    file without copying. Filtering by country copies the matching records.
+    Categorical columns keep all categories in the file, as removing unused
+    categories would copy the codes.
+
+    Args:
+        census_ids: Census IDs to load, defaults to all
+        countries: Scout countries (X_name) to load, defaults to all
+        columns: Columns to load, defaults to all
+
+    """
+    start_time = time.time()
+    table = pa.ipc.open_file(pa.memory_map(str(config.SETTINGS.census_extract.memory_mapped))).read_all()  # zero-copy
+
+    if census_ids is not None:
+        census_id_values = table[column_labels.CENSUS_ID].to_numpy()
+        selected = sorted(set(census_ids))
+        starts, ends = np.searchsorted(census_id_values, selected, side="left"), np.searchsorted(census_id_values, selected, side="right")
+        table = pa.concat_tables([table.slice(start, end - start) for start, end in _merge_ranges(starts, ends)] or [table.slice(0, 0)])
+    if countries is not None:
+        table = table.filter(pc.is_in(table[column_labels.name.COUNTRY], value_set=pa.array(list(countries), pa.string())))
+    if columns is not None:
+        table = table.select(columns)
+
+    census_data = _to_pandas_views(table)
+    logger.info(f"Memory-mapped Scout Census data, {time.time() - start_time:.2f} seconds elapsed.")
+    return census_data
+
+
+def save_memory_mapped_census_data(data: pd.DataFrame, path: Path) -> None:
+    """Saves census data as one uncompressed Arrow record batch, sorted by census ID.
+
+    Args:
+        data: Census data
+        path: Path to the Arrow (IPC) file
+
+    """
+    data = data.sort_values(column_labels.CENSUS_ID, kind="stable", ignore_index=True)
+    table = pa.Table.from_pandas(data, preserve_index=False).combine_chunks()
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=max(table.num_rows, 1))  # one record batch, so columns convert without copying
+
+
+def _to_pandas_views(table: pa.Table) -> pd.DataFrame:
+    """Converts to pandas, keeping columns as views of the Arrow data where possible.
+
+    Columns are converted one by one and joined without consolidating them,
+    as consolidation copies. pandas copies nullable integer columns when
+    converting from Arrow, so these are built from the Arrow buffers here.
+    """
+    integer_types = {col["name"] for col in table.schema.pandas_metadata["columns"] if col["numpy_type"] in _NULLABLE_INTEGER_TYPES}
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if name in integer_types and column.num_chunks == 1:
+            columns.append(pd.DataFrame({name: _integer_view(column.chunk(0))}, copy=False))
+        else:
+            columns.append(table.select([name]).to_pandas())
+    return pd.concat(columns, axis=1, copy=False) if columns else pd.DataFrame(index=pd.RangeIndex(table.num_rows))
+
+
+def _integer_view(array: pa.Array) -> pd.arrays.IntegerArray:
+    """Nullable integer array viewing the values of an Arrow integer array."""
+    dtype = array.type.to_pandas_dtype()
+    values = np.frombuffer(array.buffers()[1], dtype=dtype, count=len(array), offset=array.offset * np.dtype(dtype).itemsize)
+    # without nulls the mask is all False, which np.zeros allocates lazily so it isn't resident
+    mask = array.is_null().to_numpy(zero_copy_only=False) if array.null_count else np.zeros(len(array), dtype=bool)
+    return pd.arrays.IntegerArray(values, mask)
+
+
+def _merge_ranges(starts: np.ndarray, ends: np.ndarray) -> list[tuple[int, int]]:
+    """Merges adjacent row ranges, so consecutive census IDs are one slice."""
+    ranges: list[tuple[int, int]] = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if start == end:
+            continue
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def _restore_partition_types(census_data: pd.DataFrame, partition_schema: pa.Schema, pandas_metadata: dict) -> pd.DataFrame:
+    """Partition columns are read with types inferred from the directory names (e.g. int32 or strings), so the saved types are restored.
+
+    Args:
+        census_data: Loaded census data
+        partition_schema: Schema of the partition columns of the dataset
+        pandas_metadata: pandas metadata of the dataset, with the type of each saved column
+
+    """
+    saved_types = {col["name"]: "category" if col["pandas_type"] == "categorical" else col["numpy_type"] for col in pandas_metadata["columns"]}
+    for field in partition_schema:
+        if field.name not in census_data.columns:
+            continue
+        dtype = saved_types.get(field.name, "category" if pa.types.is_string(field.type) else None)
+        if dtype is not None and census_data[field.name].dtype != dtype:
+            census_data[field.name] = census_data[field.name].astype(dtype)
     return census_data
 
 
@@ -0,0 +1,203 @@
+"""Topology-preserving simplification of boundary coverages
+
+Simplifying each area of a boundary (e.g. LSOAs) on its own moves the two
+copies of an edge shared by neighbouring areas differently, leaving gaps and
+overlapping slivers. Instead, `simplify_coverage` splits the rings of all
+areas into arcs between junctions (vertices where more than two edges meet,
+or where rings stop sharing edges), so each shared edge is one arc. It then
+simplifies each distinct arc once with Douglas-Peucker (keeping its end
+points), and rebuilds every ring from its simplified arcs. Neighbouring
+areas therefore still share identical edges. Shared edges must have the
+same vertices in each area, as in boundary coverages such as ONS boundaries.
+
+Rings that would collapse (e.g. small islands) keep their original arcs.
+Simplified arcs can also cross other arcs (or themselves), e.g. a coarse
+tolerance straightening an arc across a nearby island. Any arc which meets
+another arc other than at their shared end points is simplified again with
+half the tolerance, falling back to its original vertices, until no arcs
+cross. Arcs can also pass a whole ring without touching it, e.g. moving an
+enclave to the other side of an edge, so the arcs of any rebuilt area that
+is invalid or overlaps a neighbour are simplified less in the same way.
+Empty and missing geometries are kept as they are.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pygeos
+
+
+def simplify_coverage(geometries: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplifies (multi)polygons that share edges, keeping shared edges shared.
+
+    Args:
+        geometries: Array of pygeos polygons or multipolygons, in a projected co-ordinate reference system. Empty and missing geometries are kept as they are
+        tolerance: Maximum distance simplified edges may move, in the units of the co-ordinate reference system
+
+    Returns:
+        Array of simplified geometries, in the same order as `geometries`
+
+    """
+    simplified_geometries = np.array(geometries, dtype=object, copy=True)
+    has_shape = ~pygeos.is_missing(simplified_geometries) & ~pygeos.is_empty(simplified_geometries)
+    if not has_shape.any():
+        return simplified_geometries
+    geometries = simplified_geometries[has_shape]
+
+    parts, part_geometry = pygeos.get_parts(geometries, return_index=True)
+    non_empty = ~pygeos.is_empty(parts)  # e.g. empty polygons within multipolygons
+    parts, part_geometry = parts[non_empty], np.unique(part_geometry[non_empty], return_inverse=True)[1]
+    rings, ring_part = pygeos.get_rings(parts, return_index=True)
+    coordinates, coordinate_ring = pygeos.get_coordinates(rings, return_index=True)
+
+    # Drops the closing coordinate of each ring, and identifies vertices by their exact co-ordinates
+    ring_ends = np.flatnonzero(np.diff(coordinate_ring, append=coordinate_ring.size))
+    is_open = np.ones(coordinate_ring.size, dtype=bool)
+    is_open[ring_ends] = False
+    coordinates, coordinate_ring = coordinates[is_open], coordinate_ring[is_open]
+    vertices, unique_vertices = pd.factorize(coordinates[:, 0] + 1j * coordinates[:, 1])
+    ring_starts = np.searchsorted(coordinate_ring, np.arange(rings.size))
+    ring_stops = np.append(ring_starts[1:], coordinate_ring.size)
+
+    is_junction = _junctions(vertices, coordinate_ring, unique_vertices.size)
+    ring_arcs, arc_vertices = _split_rings(vertices, is_junction, ring_starts, ring_stops)
+
+    # Simplifies each distinct arc once. Arcs of rings that would collapse keep their original vertices
+    arc_coordinates = [np.column_stack([unique_vertices[arc].real, unique_vertices[arc].imag]) for arc in arc_vertices]
+    arc_tolerances = np.full(len(arc_coordinates), float(tolerance))
+    simplified = _simplify_arcs(arc_coordinates, arc_tolerances)
+    collapsed = [ring for ring, arcs in enumerate(ring_arcs) if sum(len(simplified[arc]) - 1 for arc, _ in arcs) < 3]
+    for ring in collapsed:
+        for arc, _ in ring_arcs[ring]:
+            simplified[arc] = arc_coordinates[arc]
+            arc_tolerances[arc] = 0
+
+    # Arcs that cross other arcs, or leave areas invalid or overlapping their neighbours (e.g. by passing an island), are simplified less until none do.
+    # Original arcs of a coverage never do
+    ring_geometry = part_geometry[ring_part]
+    is_polygon = pygeos.get_type_id(geometries) == pygeos.GeometryType.POLYGON
+    while True:
+        affected = _crossing_arcs(simplified, arc_tolerances)
+        if not affected.size:
+            rebuilt = _rebuild(simplified, ring_arcs, ring_part, part_geometry, is_polygon)
+            affected_arcs = [arc for ring in np.flatnonzero(np.isin(ring_geometry, _overlapping_areas(rebuilt))) for arc, _ in ring_arcs[ring]]
+            affected = np.unique(np.array(affected_arcs, dtype=int))
+            affected = affected[arc_tolerances[affected] > 0]
+            if not affected.size:
+                break
+        arc_tolerances[affected] = np.where(arc_tolerances[affected] > tolerance / 8, arc_tolerances[affected] / 2, 0)
+        for arc, coordinates in zip(affected, _simplify_arcs([arc_coordinates[arc] for arc in affected], arc_tolerances[affected])):
+            simplified[arc] = coordinates
+
+    # As a last resort, e.g. if shared edges don't have the same vertices in each area, invalid areas are repaired
+    invalid = ~pygeos.is_valid(rebuilt)
+    rebuilt[invalid] = pygeos.make_valid(rebuilt[invalid])
+    simplified_geometries[has_shape] = rebuilt
+    return simplified_geometries
+
+
+def _rebuild(simplified: list[np.ndarray], ring_arcs: list[list[tuple[int, bool]]], ring_part: np.ndarray, part_geometry: np.ndarray, is_polygon: np.ndarray) -> np.ndarray:
+    """Rebuilds (multi)polygons from their simplified arcs."""
+    ring_coordinates = [_join_arcs([simplified[arc][::-1] if reverse else simplified[arc] for arc, reverse in arcs]) for arcs in ring_arcs]
+    rebuilt_rings = pygeos.linearrings(np.concatenate(ring_coordinates), indices=np.repeat(np.arange(len(ring_arcs)), [len(ring) for ring in ring_coordinates]))
+    rebuilt_parts = pygeos.polygons(rebuilt_rings, indices=ring_part)  # the first ring of each part is its shell
+    rebuilt = pygeos.multipolygons(rebuilt_parts, indices=part_geometry)
+    rebuilt[is_polygon] = pygeos.get_geometry(rebuilt[is_polygon], 0)  # polygons stay polygons
+    return rebuilt
+
+
+def _overlapping_areas(areas: np.ndarray) -> np.ndarray:
+    """Areas which are invalid, or whose interiors intersect another area's."""
+    valid = pygeos.is_valid(areas)
+    first, second = pygeos.STRtree(areas).query_bulk(areas, predicate="intersects")
+    pairs = (first < second) & valid[first] & valid[second]  # relationships of invalid areas are undefined
+    first, second = first[pairs], second[pairs]
+    overlaps = pygeos.relate_pattern(areas[first], areas[second], "T********")
+    return np.union1d(np.flatnonzero(~valid), np.concatenate([first[overlaps], second[overlaps]]))
+
+
+def _junctions(vertices: np.ndarray, coordinate_ring: np.ndarray, n_vertices: int) -> np.ndarray:
+    """Whether each vertex is a junction: a vertex with more than two distinct neighbouring vertices in any rings."""
+    previous_vertices, next_vertices = _ring_neighbours(vertices, coordinate_ring)
+    edges = pd.DataFrame({"vertex": np.concatenate([vertices, vertices]), "neighbour": np.concatenate([previous_vertices, next_vertices])}).drop_duplicates()
+    neighbour_counts = np.bincount(edges["vertex"].to_numpy(), minlength=n_vertices)
+    return neighbour_counts > 2
+
+
+def _ring_neighbours(vertices: np.ndarray, coordinate_ring: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """The previous and next vertex of each vertex in its (closed) ring."""
+    ring_starts = np.flatnonzero(np.diff(coordinate_ring, prepend=-1))
+    ring_stops = np.append(ring_starts[1:], vertices.size)
+    positions = np.arange(vertices.size)
+    start = np.repeat(ring_starts, ring_stops - ring_starts)
+    length = np.repeat(ring_stops - ring_starts, ring_stops - ring_starts)
+    previous_vertices = vertices[start + (positions - start - 1) % length]
+    next_vertices = vertices[start + (positions - start + 1) % length]
+    return previous_vertices, next_vertices
+
+
+def _split_rings(vertices: np.ndarray, is_junction: np.ndarray, ring_starts: np.ndarray, ring_stops: np.ndarray) -> tuple[list[list[tuple[int, bool]]], list[np.ndarray]]:
+    """Splits rings into arcs between junctions, shared between rings.
+
+    Arcs are stored in a canonical direction, so an edge shared by two rings
+    (traversed in opposite directions) is one arc. Rings without junctions
+    are one closed arc, starting at their lowest vertex, so identical rings
+    (e.g. an enclave and the hole around it) are also one arc.
+
+    Returns:
+        For each ring, its arcs in order as (arc number, whether the arc is reversed in the ring), and the vertices of each arc
+
+    """
+    arc_numbers: dict[tuple[int, ...], int] = {}
+    arc_vertices: list[np.ndarray] = []
+    ring_arcs: list[list[tuple[int, bool]]] = []
+    for start, stop in zip(ring_starts, ring_stops):
+        ring = vertices[start:stop]
+        junctions = np.flatnonzero(is_junction[ring])
+        first = junctions[0] if junctions.size else int(np.argmin(ring))
+        ring = np.roll(ring, -first)
+        bounds = [*(junctions - first).tolist(), ring.size] if junctions.size else [0, ring.size]
+        ring = np.append(ring, ring[0])  # closed, so the last arc ends at the first junction
+
+        arcs = []
+        for arc_start, arc_stop in zip(bounds[:-1], bounds[1:]):
+            arc = ring[arc_start : arc_stop + 1]
+            forward, backward = tuple(arc.tolist()), tuple(arc[::-1].tolist())
+            reverse = backward < forward  # closed arcs both start at their lowest vertex, so run towards their lower neighbour
+            key = backward if reverse else forward
+            if key not in arc_numbers:
+                arc_numbers[key] = len(arc_vertices)
+                arc_vertices.append(np.array(key))
+            arcs.append((arc_numbers[key], reverse))
+        ring_arcs.append(arcs)
+    return ring_arcs, arc_vertices
+
+
+def _simplify_arcs(arc_coordinates: list[np.ndarray], tolerances: np.ndarray) -> list[np.ndarray]:
+    """Simplifies arcs with Douglas-Peucker, which keeps the end points of each arc. Arcs with a tolerance of 0 are kept as they are."""
+    simplified_coordinates, arc_index = pygeos.get_coordinates(pygeos.simplify(_arc_lines(arc_coordinates), tolerances, preserve_topology=False), return_index=True)
+    simplified = np.split(simplified_coordinates, np.searchsorted(arc_index, np.arange(1, len(arc_coordinates))))
+    return [arc if arc_tolerance == 0 else simplified_arc for arc, arc_tolerance, simplified_arc in zip(arc_coordinates, tolerances, simplified)]
+
+
+def _crossing_arcs(arc_coordinates: list[np.ndarray], tolerances: np.ndarray) -> np.ndarray:
+    """Simplified arcs (with a tolerance above 0) which intersect themselves, or another arc other than at end points they share."""
+    lines = _arc_lines(arc_coordinates)
+    first, second = pygeos.STRtree(lines).query_bulk(lines, predicate="intersects")
+    first, second = first[first < second], second[first < second]
+    end_points = pygeos.multipoints(pygeos.get_point(lines, [[0], [-1]]).T)
+    shared_ends = pygeos.intersection(end_points[first], end_points[second])
+    crosses = pygeos.is_empty(shared_ends)  # predicates are undefined for empty geometries
+    crosses[~crosses] = ~pygeos.covered_by(pygeos.intersection(lines[first[~crosses]], lines[second[~crosses]]), shared_ends[~crosses])
+    crossing = np.union1d(np.flatnonzero(~pygeos.is_simple(lines)), np.concatenate([first[crosses], second[crosses]]))
+    return crossing[tolerances[crossing] > 0]
+
+
+def _arc_lines(arc_coordinates: list[np.ndarray]) -> np.ndarray:
+    return pygeos.linestrings(np.concatenate(arc_coordinates), indices=np.repeat(np.arange(len(arc_coordinates)), [len(arc) for arc in arc_coordinates]))
+
+
+def _join_arcs(arcs: list[np.ndarray]) -> np.ndarray:
+    """Joins consecutive arcs of a ring into the ring's closed co-ordinates, dropping repeated junctions."""
+    return np.concatenate([arcs[0], *(arc[1:] for arc in arcs[1:])])
@@ -3,11 +3,14 @@ from __future__ import annotations
 import time
 from typing import TYPE_CHECKING
 
+import numpy as np
 import pandas as pd
-import pyarrow
 
+from incognita.data import ons_codes
+from incognita.data import ons_pd_reduced
 from incognita.data import scout_census
 from incognita.logger import logger
+from incognita.utility import archives
 from incognita.utility import config
 from incognita.utility import root
 
@@ -45,12 +48,15 @@ class Geography:
 
         # Load Names & Codes file
         start_time = time.time()
-        codes_map = pd.read_csv(root.DATA_ROOT / codes.path, dtype={codes.key: codes.key_type, codes.name: "string"})
+        # only the code and name columns are parsed (not extras e.g. welsh names). The file may be in the ONS Postcode Directory archive
+        with archives.open_file(root.DATA_ROOT / codes.path) as codes_file:
+            codes_map = pd.read_csv(codes_file, usecols=[codes.key, codes.name], dtype={codes.key: codes.key_type, codes.name: "string"})
         logger.debug(f"Loaded {geography_name} codes map, {time.time() - start_time:.2f} seconds elapsed")
         # Normalise codes columns
-        codes_map.columns = codes_map.columns.map({codes.key: "codes", codes.name: "names"})
-        # drop extras e.g. welsh names
-        codes_map = codes_map.drop(columns=[col for col in codes_map.columns if col not in {"codes", "names"}])
+        codes_map = codes_map.rename(columns={codes.key: "codes", codes.name: "names"})[["codes", "names"]]
+        if geography_name in config.SETTINGS.ons2020:
+            # ONS codes are IDs in the shared code dictionary, so filtering and joining compare integers
+            codes_map["codes"] = ons_codes.load_dictionary().categorical(codes_map["codes"])
 
         self.boundary_codes: pd.DataFrame = codes_map
         self.metadata = metadata  # used in Reports
@@ -74,17 +80,19 @@ class Geography:
         # 'field' is the start geography and 'metadata.key' is the target geography
         logger.info(f"Filtering {len(self.boundary_codes)} {self.metadata.key} boundaries by {field} being in {values}")
         logger.debug(f"Loading ONS postcode data.")
-        try:
-            ons_pd_data = pd.read_feather(config.SETTINGS.ons_pd.reduced, columns=[self.metadata.key, field])
-        except pyarrow.ArrowInvalid:
-            # read in the full file to get valid columns
-            valid_cols = pd.read_feather(config.SETTINGS.ons_pd.reduced).columns.to_list()
-            raise KeyError(f"{self.metadata.key} not in ONS PD dataframe. Valid values are: {valid_cols}") from None
         # Finds records in the ONS PD where the given `field` matches with
-        # `values`, and constructs a set of the corresponding `metadata.key` codes.
+        # `values` (only reading matching partitions if `field` is a partition
+        # column, e.g. ctry), and the corresponding `metadata.key` codes.
         # Then uses those codes to filter the `boundary_codes` table.
-        matching_codes = set(ons_pd_data[self.metadata.key][ons_pd_data[field].isin(values)].array)
-        self.boundary_codes = self.boundary_codes.loc[self.boundary_codes["codes"].isin(matching_codes)]
+        matching_codes = ons_pd_reduced.reduced_ons_pd().columns([self.metadata.key], where={field: values})[self.metadata.key]
+        boundary_codes = self.boundary_codes["codes"]
+        code_dictionary = ons_codes.load_dictionary()
+        if code_dictionary.is_encoded(boundary_codes) and code_dictionary.is_encoded(matching_codes):
+            # compare IDs in the shared code dictionary
+            is_match = np.isin(boundary_codes.cat.codes.to_numpy(), np.unique(matching_codes.cat.codes.to_numpy()))
+        else:
+            is_match = boundary_codes.isin(set(matching_codes.dropna().array)).to_numpy()
+        self.boundary_codes = self.boundary_codes.loc[is_match]
         logger.info(f"Leaving {len(self.boundary_codes.index)} boundaries after filtering")
 
         return self.boundary_codes
@@ -111,8 +119,8 @@ class Geography:
         # Gets associated ons code column from filtered records
         # Removes original ons-census merge errors
         ons_boundary_records = census_data[ons_boundary].dropna()
-        ons_codes = set(ons_boundary_records[census_data[column].isin(values)].array)
-        ons_codes.discard(scout_census.DEFAULT_VALUE)
-        logger.debug(f"Found {len(ons_codes)} clean {ons_boundary}s that match {column} in {values}")
+        region_codes = set(ons_boundary_records[census_data[column].isin(values)].array)
+        region_codes.discard(scout_census.DEFAULT_VALUE)
+        logger.debug(f"Found {len(region_codes)} clean {ons_boundary}s that match {column} in {values}")
 
-        return self.filter_ons_boundaries(ons_boundary, ons_codes)
+        return self.filter_ons_boundaries(ons_boundary, region_codes)
@@ -11,10 +11,15 @@ import geopandas as gpd
 import numpy as np
 import pandas as pd
 
+from incognita.data import boundary_store
 from incognita.data import scout_census
+from incognita.data.postcode_index import PostcodeIndex
 from incognita.logger import logger
 from incognita.utility import config
 from incognita.utility import constants
+from incognita.utility import postcodes
+
+MAP_PRECISION = 50  # metres, the default maximum simplification of boundary shapes on maps (see `boundary_store.load_boundary`)
 
 
 class Map:
@@ -188,7 +193,8 @@ class Map:
             # Areas outside the region_of_colour have markers coloured grey
             sections.loc[~sections[coloured_region_key].isin(coloured_region), "marker_colour"] = "gray"
 
-        sections["postcode"] = sections[scout_census.column_labels.POSTCODE]
+        # Packed postcode keys, so sorting and grouping by postcode compare integers
+        sections["postcode"] = postcodes.encode(sections["clean_postcode"])
         sections["c_name"] = sections[scout_census.column_labels.name.COUNTY]
         sections["d_name"] = sections[scout_census.column_labels.name.DISTRICT]
         sections["g_name"] = sections[scout_census.column_labels.name.GROUP].astype(str).fillna("District")
@@ -196,11 +202,12 @@ class Map:
         sections_info_cols = ["postcode", "lat", "long", "marker_colour", "c_name", "d_name", "g_name", "sect_overview"]
         if "awards" in marker_data:
             sections_info_cols += ["awards_info"]
-        sections_info_table = sections[sections_info_cols].dropna(subset=["d_name"]).dropna(subset=["postcode"])
-
-        # else the final marker would not be added
-        last_row = pd.Series(sections_info_table.iloc[0].to_dict() | {"postcode": "~ FINAL"}, name=0)
-        sections_info_table = sections_info_table.append(last_row)
+        # Records whose postcode couldn't be cleaned all have INVALID_KEY, so are left out rather than merged into one marker
+        has_postcode = sections[scout_census.column_labels.POSTCODE].notna() & (sections["postcode"] != postcodes.INVALID_KEY)
+        sections_info_table = sections[sections_info_cols].loc[has_postcode].dropna(subset=["d_name"])
+        if sections_info_table.empty:
+            logger.warning(f"No sections with valid postcodes to add to the {layer_name} layer")
+            return
 
         # set and sort index
         sections_info_table = sections_info_table.set_index(["postcode", "d_name", "g_name"], drop=True).sort_index(level=[0, 1, 2])
@@ -250,6 +257,7 @@ class Map:
                 awards_info = "<br>".join(sub_table["awards_info"])
                 html += "<br>" + awards_info
             html += "</p>"
+        out.append({"lat": lat, "lon": long, "col": marker_colour, "html": html})  # the final marker
         # TODO marker cluster/feature group
         self.map[layer_name] = _output_marker_layer(layer_name, out)
 
@@ -312,9 +320,9 @@ class Map:
 
         if location_cols == "Postcodes":
             # Merge with ONS Postcode Directory to obtain dataframe with lat/long
-            logger.debug(f"Loading ONS postcode data.")
-            ons_pd_data = pd.read_feather(config.SETTINGS.ons_pd.reduced)
-            custom_data = pd.merge(custom_data, ons_pd_data, how="left", left_on=location_cols, right_index=True, sort=False)
+            logger.debug(f"Looking up postcodes in the ONS postcode index.")
+            clean_postcodes = postcodes.normalise(custom_data[location_cols])
+            custom_data = pd.concat([custom_data, PostcodeIndex().lookup(clean_postcodes, ["lat", "long"])], axis=1)
             location_cols = {"crs": constants.WGS_84, "x": "long", "y": "lat"}
 
         # Create geo data frame with points generated from lat/long or OS
@@ -324,7 +332,7 @@ class Map:
         if location_cols["crs"] != constants.WGS_84:
             custom_data = custom_data.to_crs(epsg=constants.WGS_84)
 
-        if layer_name in self.map._children:  # NoQA
+        if layer_name in self.map:
             raise ValueError("Layer already used!")
 
         # Plot marker and include marker_data in the popup for every item in custom_data
@@ -337,7 +345,7 @@ class Map:
                         "lat": round(row.geometry.y, 4),
                         "lon": round(row.geometry.x, 4),
                         "col": "green",
-                        "html": "".join(f'<p align="center">{row[marker_col]}</p>' for marker_col in marker_data),
+                        "html": "".join(f'<p align="center">{getattr(row, marker_col)}</p>' for marker_col in marker_data),
                     }
                 )
         else:
@@ -357,16 +365,16 @@ class Map:
         webbrowser.open(self.out_file.as_uri())
 
 
-def _load_boundary(boundary_report: pd.DataFrame, boundary_metadata: config.Boundary) -> gpd.GeoDataFrame:
+def _load_boundary(boundary_report: pd.DataFrame, boundary_metadata: config.Boundary, precision: float = MAP_PRECISION) -> gpd.GeoDataFrame:
     """Loads a given boundary from a boundary report and metadata.
 
-    Loads shapefile from path into GeoPandas dataframe
+    Loads shapes from the boundary store, in WGS84 as Leaflet doesn't understand BNG
     Filters out unneeded shapes within all shapes loaded
-    Converts from British National Grid to WGS84, as Leaflet doesn't understand BNG
 
     Args:
         boundary_report: A DataFrame object with boundary report data
         boundary_metadata: This contains shapefile paths, and labels for region codes and names
+        precision: Maximum distance (metres) shape edges may be simplified by, the coarsest stored level within this is used
 
     Returns:
         GeoDataFrame with filtered and CRS transformed shapes
@@ -375,11 +383,11 @@ def _load_boundary(boundary_report: pd.DataFrame, boundary_metadata: config.Boun
     metadata = boundary_metadata
     data = boundary_report
 
-    # Read a shape file. shapefile_path is the path to ESRI shapefile with region information
+    # Read a shape file (from the boundary store). shapefile_path is the path to ESRI shapefile with region information
     logger.info("Loading Shapefile data")
     logger.debug(f"Shapefile path: {metadata.shapefile.path}")
     start_time = time.time()
-    all_shapes = gpd.read_file(metadata.shapefile.path)
+    all_shapes = boundary_store.load_boundary(metadata.shapefile.path, precision=precision)  # stored in WGS84
     logger.info(f"Loading Shapefile data finished, {time.time() - start_time:.2f} seconds elapsed")
     if metadata.shapefile.key not in all_shapes.columns:
         raise KeyError(f"{metadata.shapefile.key} not present in shapefile. Valid columns are: {all_shapes.columns}")
@@ -392,7 +400,7 @@ def _load_boundary(boundary_report: pd.DataFrame, boundary_metadata: config.Boun
     logger.info(f"Filtering {len(all_shapes.index)} shapes by shape_codes being in the codes column of the map_data")
     all_codes = set(data["codes"])
     logger.debug(f"All codes list: {all_codes}")
-    geo_data = all_shapes.loc[all_shapes["shape_codes"].isin(all_codes), ["geometry", "shape_codes", "shape_names"]].to_crs(epsg=constants.WGS_84)
+    geo_data = all_shapes.loc[all_shapes["shape_codes"].isin(all_codes), ["geometry", "shape_codes", "shape_names"]]
     logger.info(f"Loaded {len(geo_data.index):,} boundary shapes. Columns now in data: {[*data.columns]}.")
     return geo_data
 
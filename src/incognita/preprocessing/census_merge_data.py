@@ -7,33 +7,61 @@ The output fields are those in the census and ONS data, and the additional
 fields 'postcode_is_valid' and 'clean_postcode'.
 """
 
-import re
+from __future__ import annotations
 
+from typing import TYPE_CHECKING
+
+import numpy as np
 import pandas as pd
+import pydantic
 
 from incognita.data import scout_census
 from incognita.logger import logger
+from incognita.utility import postcodes
+
+if TYPE_CHECKING:
+    from incognita.data.postcode_index import PostcodeIndex
 
 CLEAN_POSTCODE_LABEL = "clean_postcode"
 
+# Postcode repair tiers, in the order they are applied. Values are:
+# - where postcodes are filled from (for log messages)
+# - entity types to fix (e.g. Colony, Group, Network, District)
+# - ID column records must share with the record they are filled from
+REPAIR_TIERS: dict[str, tuple[str, set[str], str]] = {
+    "section": ("latest Census", scout_census.TYPES_GROUP | scout_census.TYPES_DISTRICT, scout_census.column_labels.id.COMPASS),
+    "group-section": ("same group", scout_census.TYPES_GROUP, scout_census.column_labels.id.GROUP),
+    "district-section": ("same district", scout_census.TYPES_DISTRICT, scout_census.column_labels.id.DISTRICT),
+    "pre 2017": ("same entity", {"Group", "District"}, scout_census.column_labels.id.COMPASS),
+}
+
+
+class PostcodeRepairSummary(pydantic.BaseModel):
+    """Counts of valid and repaired postcodes from `_try_fix_invalid_postcodes`."""
 
-def merge_with_postcode_directory(census_data: pd.DataFrame, ons_pd_data: pd.DataFrame, ons_fields_data_types: dict[str, list[str]]) -> pd.DataFrame:
+    valid_before: int = 0  # records with valid postcodes before repair
+    repaired: dict[str, int] = {}  # records repaired in each tier of REPAIR_TIERS
+    valid_after: int = 0  # records with valid postcodes after repair
+
+
+def merge_with_postcode_directory(
+    census_data: pd.DataFrame, postcode_index: PostcodeIndex, ons_fields_data_types: dict[str, list[str]]
+) -> tuple[pd.DataFrame, PostcodeRepairSummary]:
     logger.info("Cleaning the postcodes")
     _clean_and_verify_postcode(census_data)
 
     # attempt to fix invalid postcodes
     logger.info("Adding ONS postcode directory data to Census and outputting")
-    data = _try_fix_invalid_postcodes(census_data, ons_pd_data.index)
+    data, repair_summary = _try_fix_invalid_postcodes(census_data, postcode_index)
 
-    # fully merge the data
+    # fully merge the data, looking up ONS fields by postcode in the index
     logger.info("Merging data")
-    data = pd.merge(data, ons_pd_data, how="left", left_on="clean_postcode", right_index=True, sort=False)
-
-    # fill unmerged rows with default values
-    logger.info("filling unmerged rows")
-    data = _fill_unmerged_rows(data, ons_fields_data_types)
+    # unmerged rows are filled with default values as they are looked up, see `_unmerged_fill_values`
+    fields = [field for data_type_fields in ons_fields_data_types.values() for field in data_type_fields if field in postcode_index.columns]
+    ons_data = postcode_index.lookup(data[CLEAN_POSTCODE_LABEL], fields, fill_values=_unmerged_fill_values(ons_fields_data_types))
+    data = pd.concat([data, ons_data], axis=1)
 
-    return data
+    return data, repair_summary
 
 
 def _clean_and_verify_postcode(census_data: pd.DataFrame) -> None:
@@ -57,64 +85,14 @@ def _clean_and_verify_postcode(census_data: pd.DataFrame) -> None:
     valid_postcode_label = scout_census.column_labels.VALID_POSTCODE
 
     logger.info("Cleaning postcodes")
-    cleaned_postcode_column = _postcode_cleaner(census_data[postcode_column])
+    cleaned_postcode_column = postcodes.normalise(census_data[postcode_column])
 
     logger.info("Inserting columns")
     census_data.insert(cleaned_postcode_index, CLEAN_POSTCODE_LABEL, cleaned_postcode_column)
     census_data.insert(valid_postcode_index, valid_postcode_label, float("NaN"))
 
 
-def _postcode_cleaner(postcode: pd.Series) -> pd.Series:
-    """Cleans postcode to ONS postcode directory format.
-
-    Args:
-        postcode: pandas series of postcodes
-
-    Returns:
-        Cleaned postcode
-
-    """
-
-    # Regular expression to remove whitespace, non-alphanumeric (keep shifted numbers)
-    regex_clean = re.compile(r'[\s+]|[^a-zA-Z\d!"£$%^&*()]')
-
-    # Remove any whitespace and most non-alphanumeric chars
-    # Convert input to uppercase (ONS Postcode Directory uses upper case)
-    # Pads length as we use the 7 long version from the Postcode Directory
-    postcode = postcode.str.replace(regex_clean, "").str.upper().apply(lambda single_postcode: _pad_to_seven(single_postcode))
-
-    # Replaces shifted numbers with their number equivalents
-    postcode = (
-        postcode.str.replace("!", "1", regex=False)
-        .str.replace('"', "2", regex=False)
-        .str.replace("£", "3", regex=False)
-        .str.replace("$", "4", regex=False)
-        .str.replace("%", "5", regex=False)
-        .str.replace("^", "6", regex=False)
-        .str.replace("&", "7", regex=False)
-        .str.replace("*", "8", regex=False)
-        .str.replace("(", "9", regex=False)
-        .str.replace(")", "0", regex=False)
-    )
-    # TODO: add macOS shift -> numbers conversion
-
-    return postcode
-
-
-def _pad_to_seven(single_postcode):  # r'(.*?(?=.{3}$))(.{3}$)' (potential regex)
-    """Pad postcode strings
-
-    If length of postcode is 6 or 5 then insert 1 or 2 spaces.
-    6 first as more common to speed up execution
-    """
-    if single_postcode == single_postcode:  # filters out NaNs
-        length = len(single_postcode)
-        if length == 6 or length == 5:
-            single_postcode = single_postcode[:-3] + " " * (7 - length) + single_postcode[-3:]
-    return single_postcode
-
-
-def _try_fix_invalid_postcodes(census_data: pd.DataFrame, all_valid_postcodes: pd.Index) -> pd.DataFrame:
+def _try_fix_invalid_postcodes(census_data: pd.DataFrame, postcode_index: PostcodeIndex) -> tuple[pd.DataFrame, PostcodeRepairSummary]:
     """Uses various methods attempting to provide every record with a valid postcode
 
     Currently only implemented for sections with youth membership.
@@ -125,126 +103,146 @@ def _try_fix_invalid_postcodes(census_data: pd.DataFrame, all_valid_postcodes: p
     - If section has no valid postcodes, use most common (mode) postcode from sections in group in that year, then try successive years
     - If group or district has no valid postcode in 2010-2016, use following years (e.g. if 2010 not valid, try 2011, 12, 13 etc.)
 
+    The tiers of `REPAIR_TIERS` are applied in order, so records repaired in
+    one tier are sources for later tiers. Records are sorted once (district,
+    group, section, then census ID newest first), and each tier takes the
+    first valid postcode in that order for each entity. Validity is only
+    checked against the postcode index once, as repaired records always take
+    a valid postcode.
+    TODO change to use modal result instead of first (If section has no valid postcodes, use most common
+        (modal) postcode from sections in group in that year, then try successive years)
+
     Args:
         census_data: Dataframe of census data including invalid postcodes
-        all_valid_postcodes: All valid postcodes from the ONS Postcode Directory
+        postcode_index: Index of all valid postcodes in the ONS Postcode Directory
 
     Returns:
-        modified data table with more correct postcodes
+        modified data table with more correct postcodes, and the number of postcodes repaired in each tier
 
     """
 
     logger.info("filling postcodes in sections with invalid postcodes")
-
-    # Helper variables to store field headings for often used fields
-    section_id_label = scout_census.column_labels.id.COMPASS
-    group_id_label = scout_census.column_labels.id.GROUP
-    district_id_label = scout_census.column_labels.id.DISTRICT
-
-    # Lists of entity types to match against in constructing section records tables
-    group_section_types = scout_census.TYPES_GROUP
-    district_section_types = scout_census.TYPES_DISTRICT
-    section_types = group_section_types | district_section_types
-    pre_2017_types = {"Group", "District"}
-
-    # Columns to use in constructing the MultiIndex. Larger groups go first towards smaller
-    index_cols = [district_id_label, group_id_label, section_id_label, scout_census.column_labels.CENSUS_ID]
-
-    # Find which postcodes are valid
-    census_data[scout_census.column_labels.VALID_POSTCODE] = census_data[CLEAN_POSTCODE_LABEL].isin(all_valid_postcodes)
-
-    # Sets a MultiIndex on the data table to enable fast searching and querying for data
-    census_data = census_data.set_index(index_cols, drop=False)
-
-    census_data = _run_postcode_fix_step(census_data, all_valid_postcodes, "section", "latest Census", section_types, section_id_label, 2)
-    census_data = _run_postcode_fix_step(census_data, all_valid_postcodes, "group-section", "same group", group_section_types, group_id_label, 1)
-    census_data = _run_postcode_fix_step(census_data, all_valid_postcodes, "district-section", "same district", district_section_types, district_id_label, 0)
-    census_data = _run_postcode_fix_step(census_data, all_valid_postcodes, "pre 2017", "same entity", pre_2017_types, section_id_label, 2)
-
-    # Undo the changes made in this method by removing the MultiIndex and
-    # removing the merge test column
     census_data = census_data.reset_index(drop=True)
-    return census_data
-
 
-def _fill_unmerged_rows(census_data: pd.DataFrame, fields_data_types: dict) -> pd.DataFrame:
-    """Fills rows that have not merged with default values
-
-    Fills all passed fields in rows where there has been no data merged
-    Fills categorical fields with scout_census.DEFAULT_VALUE and numerical fields with 0
+    # Find which postcodes are valid
+    clean_postcodes = census_data[CLEAN_POSTCODE_LABEL].to_numpy(dtype=object, copy=True)
+    valid = postcode_index.is_valid(clean_postcodes)
+    summary = PostcodeRepairSummary(valid_before=valid.sum())
+
+    # Record order for picking postcodes. Larger groups go first towards smaller, newest census first
+    id_labels = [scout_census.column_labels.id.DISTRICT, scout_census.column_labels.id.GROUP, scout_census.column_labels.id.COMPASS]
+    sort_keys = [_sort_codes(census_data[label]) for label in id_labels] + [_sort_codes(census_data[scout_census.column_labels.CENSUS_ID], ascending=False)]
+    order = np.lexsort(sort_keys[::-1])  # np.lexsort sorts by the last key first
+    entity_types = census_data[scout_census.column_labels.UNIT_TYPE]
+
+    for tier, (fill_from, tier_types, id_label) in REPAIR_TIERS.items():
+        logger.info(f"Fill invalid {tier} postcodes with valid section postcodes from {fill_from}")
+        in_tier = entity_types.isin(tier_types).to_numpy()
+        ids, id_values = pd.factorize(census_data[id_label])
+
+        # First valid record in sort order for each ID (-1 where no records of the ID are valid)
+        sources = order[in_tier[order] & valid[order] & (ids[order] != -1)]
+        source_ids, first_positions = np.unique(ids[sources], return_index=True)
+        first_source = np.full(id_values.size, -1)
+        first_source[source_ids] = sources[first_positions]
+
+        # Fill invalid postcodes from the first valid record with the same ID
+        to_fix = np.flatnonzero(in_tier & ~valid & (ids != -1))
+        fill_from_rows = first_source[ids[to_fix]]
+        fixed = to_fix[fill_from_rows != -1]
+        clean_postcodes[fixed] = clean_postcodes[fill_from_rows[fill_from_rows != -1]]
+        valid[fixed] = True
+        summary.repaired[tier] = fixed.size
+
+    census_data[CLEAN_POSTCODE_LABEL] = clean_postcodes
+    census_data[scout_census.column_labels.VALID_POSTCODE] = valid
+    summary.valid_after = valid.sum()
+    return census_data, summary
+
+
+def _sort_codes(values: pd.Series, ascending: bool = True) -> np.ndarray:
+    """Integer codes which sort as the values would in a (Multi)Index, missing values last."""
+    codes = values.cat.codes.to_numpy() if isinstance(values.dtype, pd.CategoricalDtype) else pd.factorize(values, sort=True)[0]
+    codes = codes if ascending else codes.max(initial=0) - codes
+    return np.where(values.isna().to_numpy(), codes.max(initial=0) + 1, codes)
+
+
+def rows_linked_by_entity(census_data: pd.DataFrame, new_census_data: pd.DataFrame, postcode_index: PostcodeIndex) -> pd.Series:
+    """Finds records whose postcode fixing could depend on, or affect, new records.
+
+    `_try_fix_invalid_postcodes` fills invalid postcodes in each tier of
+    `REPAIR_TIERS` from records of the tier's entity types with the same ID,
+    and only records with invalid postcodes change. New records can be sources
+    for existing invalid records sharing a tier ID, and those can in turn be
+    sources for invalid records sharing their IDs in later tiers. Records with
+    valid postcodes never change, so are only linked if they share a tier ID
+    with one of these invalid records (existing or new), as they may be its
+    source. This finds all records in `census_data` linked to any record in
+    `new_census_data`, so that fixing postcodes for just these and the new
+    records gives the same result as for all records.
 
     Args:
-        census_data: DataFrame with census data
-        fields_data_types: dict of data types containing lists of fields
+        census_data: Existing census data
+        new_census_data: New census records
+        postcode_index: Index of all valid postcodes in the ONS Postcode Directory
 
     Returns:
-        dataframe with filled values
+        Boolean Series over `census_data`, True where the record is linked to a new record
 
     """
-    row_has_merged = scout_census.column_labels.VALID_POSTCODE  # column label for column with booleans of if the merge was successful
-    for field in fields_data_types["categorical"]:
-        if scout_census.DEFAULT_VALUE not in census_data[field].cat.categories:
-            census_data[field] = census_data[field].cat.add_categories([scout_census.DEFAULT_VALUE])
-        census_data.loc[~census_data[row_has_merged], field] = scout_census.DEFAULT_VALUE
-    for field in fields_data_types["numeric"]:
-        census_data.loc[~census_data[row_has_merged], field] = 0
-
-    return census_data
-
-
-def _run_postcode_fix_step(
-    data: pd.DataFrame, all_valid_postcodes: pd.Index, invalid_type: str, fill_from: str, entity_types: set[str], column_label: str, index_level: int
-) -> pd.DataFrame:
-    """Runs postcode fixer for given data and parameters.
-
-    Method:
-    Gets all records with ID from given column and index level, then clears the indexing
-    Returns the first row's postcode. As the index is sorted, this will return the earliest correct year.
-    TODO change to use modal result instead of first (If section has no valid postcodes, use most common
-        (modal) postcode from sections in group in that year, then try successive years)
+    existing_count = len(census_data.index)
+    columns = [scout_census.column_labels.UNIT_TYPE, *{id_label for _, _, id_label in REPAIR_TIERS.values()}]
+    records = pd.concat([census_data[columns], new_census_data[columns]], ignore_index=True)
+    tier_codes = _tier_codes(records)
+    record_postcodes = pd.concat([census_data[scout_census.column_labels.POSTCODE], new_census_data[scout_census.column_labels.POSTCODE]], ignore_index=True)
+    invalid = ~postcode_index.is_valid(postcodes.normalise(record_postcodes))
+    is_new = np.arange(len(records.index)) >= existing_count
+
+    # Records that could be fixed differently (or be fixed from): new records, then invalid records sharing tier IDs with these
+    changed = is_new
+    while True:
+        now_changed = is_new | (invalid & _shares_ids(tier_codes, changed))
+        if now_changed.sum() == changed.sum():
+            break
+        changed = now_changed
+
+    # Invalid records that may be fixed differently, and records they may be fixed from
+    linked = _shares_ids(tier_codes, invalid & changed)
+    return pd.Series(linked[:existing_count], index=census_data.index)
+
+
+def _tier_codes(census_data: pd.DataFrame) -> dict[str, np.ndarray]:
+    """Integer codes of the ID each record shares with its sources in each tier of `REPAIR_TIERS`, -1 where missing or the tier doesn't include the record's type."""
+    entity_types = census_data[scout_census.column_labels.UNIT_TYPE]
+    tier_codes = {}
+    for tier, (_, tier_types, id_label) in REPAIR_TIERS.items():
+        codes = pd.factorize(census_data[id_label])[0]
+        tier_codes[tier] = np.where(entity_types.isin(tier_types).to_numpy(), codes, -1)
+    return tier_codes
+
+
+def _shares_ids(tier_codes: dict[str, np.ndarray], selected: np.ndarray) -> np.ndarray:
+    """Whether each record shares an ID in any tier with any of the selected records."""
+    shares = np.zeros(selected.size, dtype=bool)
+    for codes in tier_codes.values():
+        has_id = np.zeros(codes.max(initial=-1) + 2, dtype=bool)  # shifted by one, so missing IDs (-1) are never shared
+        has_id[codes[selected] + 1] = True
+        has_id[0] = False
+        shares |= has_id[codes + 1]
+    return shares
+
+
+def _unmerged_fill_values(fields_data_types: dict[str, list[str]]) -> dict[str, object]:
+    """Default values for rows that have not merged
+
+    Categorical fields are filled with scout_census.DEFAULT_VALUE (added to the
+    field's categories) and numerical fields with 0.
 
     Args:
-        data: Census data
-        all_valid_postcodes: Index of all valid postcodes in the ONS postcode directory
-        invalid_type: Which type of issue are we fixing (for log message)
-        fill_from: Where are we pulling valid postcodes from (for log message)
-        entity_types: Entity types to filter the fixing on (e.g. Colony, Group, Network, District)
-        column_label: Name of the index level being used
-        index_level: Level of the MultiIndex to filter on
+        fields_data_types: dict of data types containing lists of fields
 
     Returns:
-        Updated census data
+        Mapping of field to default value
 
     """
-    # Index level: 0=District; 1=Group; 2=Section; 3=Census_ID
-
-    logger.info(f"Fill invalid {invalid_type} postcodes with valid section postcodes from {fill_from}")
-
-    entity_type_label = scout_census.column_labels.UNIT_TYPE
-    valid_postcode_label = scout_census.column_labels.VALID_POSTCODE
-
-    # Gets all entity records matching the given criteria, and returns a
-    # minimal set of fields for memory optimisation
-    records = data.loc[data[entity_type_label].isin(entity_types), [valid_postcode_label, column_label, CLEAN_POSTCODE_LABEL]]
-
-    valid_postcodes_start = data[valid_postcode_label].to_numpy().sum()
-
-    # Get all valid clean postcodes from the filtered records. Then sort the
-    # index with census IDs high -> low. Then group the data by the passed
-    # index level. As the census IDs are sorted descending, the first item will
-    # be the newest possible clean postcode, indexed by the passed level.
-    firsts = records.loc[records[valid_postcode_label], CLEAN_POSTCODE_LABEL].sort_index(ascending=(True, True, True, False)).groupby(level=index_level).first()
-
-    # Map invalid postcodes to valid postcodes by the given ID type/field
-    clean_postcodes = records.loc[~records[valid_postcode_label], column_label].map(firsts)
-
-    # Merge in the changed postcodes and overwrite pre-existing postcodes in the Clean Postcode column
-    clean_postcodes_not_na = clean_postcodes.loc[clean_postcodes.notna()]  # .update(*) uses not_na filter
-    data.loc[clean_postcodes_not_na.index, CLEAN_POSTCODE_LABEL] = clean_postcodes_not_na
-
-    # Update valid postcode status
-    data[valid_postcode_label] = data[CLEAN_POSTCODE_LABEL].isin(all_valid_postcodes)
-
-    logger.info(f"change in valid postcodes is: {data[valid_postcode_label].to_numpy().sum() - valid_postcodes_start}")
-
-    return data
+    return {field: scout_census.DEFAULT_VALUE for field in fields_data_types["categorical"]} | {field: 0 for field in fields_data_types["numeric"]}
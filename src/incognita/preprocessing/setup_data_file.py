@@ -3,22 +3,59 @@
 This script joins a .csv file with a postcode column with the ONS Postcode
 Directory.
 
-This script has no command line options.
+By default the whole census extract is processed. To add a single new census
+year to an existing merged extract, pass the path to an extract holding only
+the new year's records with `--append`. Only the new records, and existing
+records of the same sections, groups and districts, are re-processed.
+
+To update an existing merged extract to a new ONS Postcode Directory release,
+pass the postcode index of the release it was merged with to
+`--previous-index`. The two releases are compared by postcode, and only
+records whose postcodes changed (and records linked to them) are merged again.
+
+The merged extract is saved as a Parquet dataset partitioned by census ID, and
+by Scout country too with `--partition-by-country`. It is also saved as an
+uncompressed Arrow file, which scripts can memory-map. Outputs are written
+concurrently; choose which with `--formats`. With `--defer-csv` the csv copy
+is written last, in the background, once the other outputs are available.
+
+The output of each stage of processing the whole extract (loading, merging,
+IMD deciles and data types) is cached, keyed by a fingerprint of the stage's
+inputs and code. Reruns only repeat stages whose inputs or code have changed;
+pass `--no-cache` to repeat every stage.
 """
 from __future__ import annotations
 
+import argparse
+from collections.abc import Callable
+from collections.abc import Collection
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from pathlib import Path
+import sys
 import time
 from typing import TYPE_CHECKING
 
+import numpy as np
 import pandas as pd
+from pyarrow import csv
+import pyarrow as pa
+import pyarrow.compute as pc
 
+from incognita.data import postcode_index as postcode_index_module
 from incognita.data import scout_census
 from incognita.data.ons_pd import ONS_POSTCODE_DIRECTORY_MAY_20 as ONS_PD
+from incognita.data.postcode_index import PostcodeIndex
 from incognita.logger import logger
 from incognita.logger import set_up_logger
 from incognita.preprocessing import census_merge_data
+from incognita.utility import cache
+from incognita.utility import categoricals
 from incognita.utility import config
 from incognita.utility import deciles
+from incognita.utility import dtype_planner
+from incognita.utility import postcodes
 
 if TYPE_CHECKING:
     from incognita.data.ons_pd import ONSPostcodeDirectory
@@ -38,66 +75,333 @@ cols_int_32 = ["Object_ID", "G_ID", "D_ID", "C_ID", "R_ID", "X_ID", "imd"]
 cols_categorical = ["compass", "type", "name", "G_name", "D_name", "C_name", "R_name", "X_name", "postcode", "clean_postcode", "Young_Leader_Unit"]
 # fmt: on
 
+# Arrow types applied by the CSV reader as it parses, so that no second cast is needed.
+# Youth membership columns are typed as they are summed into the section totals on load.
+_youth_cols = [col for section_name, section_model in scout_census.column_labels.sections for col in section_model.youth_cols]
+census_column_types: dict[str, pa.DataType] = (
+    {key: pa.int16() for key in _youth_cols}
+    | {key: pa.bool_() for key in cols_bool}
+    | {key: pa.int16() for key in cols_int_16}
+    | {key: pa.int32() for key in cols_int_32}
+    | {key: pa.dictionary(pa.int32(), pa.string()) for key in cols_categorical}
+)
+# Arrow -> pandas mapping so nullable integer columns keep their width
+_pandas_types = {pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype()}
+
+# Outputs written by `save_merged_data`
+OUTPUT_FORMATS = ("errors", "csv", "parquet", "arrow")
+
+# Custom boundaries added to the ONS Postcode Directory by `setup_reduce_onspd` (e.g. nys_districts), other than census columns
+custom_boundary_fields = [
+    boundary.key
+    for boundary in config.SETTINGS.custom_boundaries.values()
+    if boundary.shapefile is not None and boundary.codes.key_type == "string" and boundary.key not in census_column_types
+]
+
+# Fields added from the ONS Postcode Directory
+ons_fields_data_types = {
+    "categorical": ["lsoa11", "msoa11", "oslaua", "osward", "pcon", "oscty", "ctry", "rgn", *custom_boundary_fields],
+    "numeric": ["oseast1m", "osnrth1m", "lat", "long", "imd"],
+}
+
+
+def process_census_extract(partition_by_country: bool = False, use_cache: bool = True, output_formats: Collection[str] = OUTPUT_FORMATS, defer_csv: bool = False) -> Future | None:
+    """Merges the whole census extract with the ONS PD and saves it.
+
+    Args:
+        partition_by_country: If True, partition the saved dataset by Scout country as well as census ID
+        use_cache: If False, don't reuse (or save) cached stage outputs
+        output_formats: Outputs to write, see `save_merged_data`
+        defer_csv: If True, write the csv file in the background
+
+    Returns:
+        Future for the background csv write if `defer_csv`, otherwise None
+
+    """
+    stage_cache = cache.StageCache(config.SETTINGS.folders.cache, enabled=use_cache)
+    merged_stage = census_stages(stage_cache, config.SETTINGS.census_extract.original, config.SETTINGS.ons_pd.index)
+    merged_data = merged_stage()
+    logger.info(stage_cache.report())
+
+    # Save the processed extract
+    return save_merged_data(merged_data, _release_date(PostcodeIndex()), partition_by_country, output_formats, defer_csv)
+
+
+def census_stages(stage_cache: cache.StageCache, extract_path: Path, postcode_index_path: Path) -> cache.Stage:
+    """Defines the stages of merging the raw census extract with the ONS PD.
+
+    Stages are load -> merge with the ONS PD -> IMD deciles -> data types, and
+    each stage is keyed by the fingerprints of its inputs, e.g. the extract
+    file, the postcode index file and the column lists in this module. Stages
+    whose functions use helpers or column lists in this module (or the census
+    column labels) are also keyed by the source code of those modules.
+
+    Args:
+        stage_cache: Cache for the output of each stage
+        extract_path: Path to the raw census extract
+        postcode_index_path: Path to the ONS Postcode Directory postcode index
+
+    Returns:
+        The last stage, call it to get the merged census data
+
+    """
+    this_module = sys.modules[__name__]  # helpers such as `_set_column` and the column lists
+    postcode_index = PostcodeIndex(postcode_index_path)
+    loaded = stage_cache.stage(
+        "census load",
+        functools.partial(load_census_data, extract_path),
+        inputs=[cache.file_fingerprint(extract_path), census_column_types],
+        code=[this_module, scout_census],
+    )
+    merged = stage_cache.stage(
+        "ONS PD merge",
+        functools.partial(merge_ons_postcode_directory, postcode_index=postcode_index),
+        loaded,
+        inputs=[cache.file_fingerprint(postcode_index_path), _release_date(postcode_index), ons_fields_data_types],
+        code=[this_module, census_merge_data, postcode_index_module, postcodes],
+    )
+    with_deciles = stage_cache.stage(
+        "IMD deciles",
+        functools.partial(create_imd_deciles, ons_pd=ONS_PD),
+        merged,
+        inputs=[ONS_PD.IMD_MAX, ONS_PD.COUNTRY_CODES],
+        code=[deciles],
+    )
+    return stage_cache.stage(
+        "data types",
+        coerce_data_types,
+        with_deciles,
+        inputs=[cols_categorical, dtype_planner.CATEGORY_MAX_RATIO],
+        code=[this_module, categoricals, dtype_planner],
+    )
+
+
+def append_census_extract(new_extract_path: Path, partition_by_country: bool = False, output_formats: Collection[str] = OUTPUT_FORMATS, defer_csv: bool = False) -> Future | None:
+    """Adds a new census year to the existing merged extract.
 
-def process_census_extract() -> None:
-    census_data = load_census_data()
-    ons_pd_data = load_postcode_directory(ONS_PD)
+    Args:
+        new_extract_path: Path to a raw census extract containing only the new year's records
+        partition_by_country: If True, partition the saved dataset by Scout country as well as census ID
+        output_formats: Outputs to write, see `save_merged_data`
+        defer_csv: If True, write the csv file in the background
+
+    Returns:
+        Future for the background csv write if `defer_csv`, otherwise None
+
+    """
+    merged_data = scout_census.load_census_data()
+    new_census_data = load_census_data(new_extract_path)
+    postcode_index = PostcodeIndex()
+
+    merged_data = append_census_data(merged_data, new_census_data, postcode_index)
+
+    # Save the processed extract
+    return save_merged_data(merged_data, _release_date(postcode_index), partition_by_country, output_formats, defer_csv)
+
+
+def update_census_extract(
+    previous_index_path: Path,
+    partition_by_country: bool = False,
+    output_formats: Collection[str] = OUTPUT_FORMATS,
+    defer_csv: bool = False,
+    publication_date: str = None,
+) -> Future | None:
+    """Updates the existing merged extract to the current ONS Postcode Directory release.
+
+    The postcode indexes of the previous and current releases are compared,
+    the changes are written to a report in the output folder, and only the
+    affected records are merged again (see `update_census_data`).
+
+    Args:
+        previous_index_path: Path to the postcode index of the release the existing extract was merged with
+        partition_by_country: If True, partition the saved dataset by Scout country as well as census ID
+        output_formats: Outputs to write, see `save_merged_data`
+        defer_csv: If True, write the csv file in the background
+        publication_date: Publication date of the current release, e.g. "May 2021", which labels the outputs. Defaults to the date recorded in its postcode index
+
+    Returns:
+        Future for the background csv write if `defer_csv`, otherwise None
 
+    """
+    merged_data = scout_census.load_census_data()
+    postcode_index = PostcodeIndex()
+    publication_date = publication_date or postcode_index.publication_date
+    if publication_date is None:
+        raise ValueError(f"{postcode_index.path} doesn't record its release's publication date, so it must be given to label the outputs")
+
+    ons_fields = [field for data_type_fields in ons_fields_data_types.values() for field in data_type_fields if field in merged_data.columns]
+    release_diff = postcode_index_module.diff_indexes(PostcodeIndex(previous_index_path), postcode_index, ons_fields)
+    logger.info(f"Postcodes changed in the {publication_date} release: {release_diff['status'].value_counts().to_dict()}")
+    logger.info(f"Changed fields: {release_diff.loc[release_diff['status'] == 'changed', ons_fields].sum().to_dict()}")
+    diff_report = release_diff.set_axis(pd.Index(postcodes.decode(release_diff.index.to_numpy()), name=postcode_index_module.KEY_COLUMN)).reset_index()
+    _write_csv(diff_report, config.SETTINGS.folders.output / f"ONS PD changes in {publication_date}.csv")
+
+    merged_data = update_census_data(merged_data, release_diff, postcode_index)
+
+    # Save the processed extract
+    return save_merged_data(merged_data, publication_date, partition_by_country, output_formats, defer_csv)
+
+
+def merge_census_data(census_data: pd.DataFrame, postcode_index: PostcodeIndex) -> pd.DataFrame:
+    """Merges the raw census extract with the ONS PD, adds IMD deciles and sets data types."""
     # merge the census extract and ONS postcode directory
-    merged_data = merge_ons_postcode_directory(census_data, ons_pd_data)
+    merged_data = merge_ons_postcode_directory(census_data, postcode_index)
 
     # Add IMD deciles
     merged_data = create_imd_deciles(merged_data, ONS_PD)
 
     # Set data types
-    merged_data = coerce_data_types(merged_data)
+    return coerce_data_types(merged_data)
 
-    # Save the processed extract
-    save_merged_data(merged_data, ONS_PD.PUBLICATION_DATE)
 
+def append_census_data(merged_data: pd.DataFrame, new_census_data: pd.DataFrame, postcode_index: PostcodeIndex) -> pd.DataFrame:
+    """Adds new census records to merged census data, as if the whole extract had been merged.
+
+    Postcode cleaning, fixing invalid postcodes, merging with the ONS PD and
+    IMD deciles only run on the new records and the existing records that
+    invalid postcodes could be fixed from or to (invalid records which share a
+    section, group or district with the new records, and records which share
+    one with an invalid record, see `census_merge_data.rows_linked_by_entity`).
+    All other existing records are kept as they are.
+
+    The result is identical to running `merge_census_data` on the combined
+    raw extract, with the new records after the existing records.
+
+    Args:
+        merged_data: Existing merged census data
+        new_census_data: Raw census records to add (e.g. from `load_census_data`)
+        postcode_index: ONS Postcode Directory postcode index
+
+    """
+    merged_data = merged_data.reset_index(drop=True)
+    linked = census_merge_data.rows_linked_by_entity(merged_data, new_census_data, postcode_index)
+    logger.info(f"Re-processing {linked.sum():,} existing records linked to the {len(new_census_data.index):,} new records")
+
+    # Existing records are returned to their unmerged state, so they are cleaned and fixed alongside the new records
+    new_census_data = new_census_data.set_axis(pd.RangeIndex(len(merged_data.index), len(merged_data.index) + len(new_census_data.index)))
+    processed_data = _reprocess_records(categoricals.concat([_unmerged(merged_data.loc[linked]), new_census_data]), postcode_index)
+
+    combined = categoricals.concat([merged_data.loc[~linked], processed_data], sort_categories=True).sort_index().reset_index(drop=True)
+    return coerce_data_types(combined)  # planned types depend on the values of all records
+
+
+def update_census_data(merged_data: pd.DataFrame, release_diff: pd.DataFrame, postcode_index: PostcodeIndex) -> pd.DataFrame:
+    """Updates merged census data to a new ONS Postcode Directory release, as if the whole extract had been merged with it.
+
+    Only records affected by the changes between releases are rewritten:
+    - records whose own postcode was added or removed in the new release
+      change validity, so postcode fixing may change for them and all
+      records linked to them (see `census_merge_data.rows_linked_by_entity`).
+      These are fully re-processed
+    - other records whose (fixed) postcode has changed fields keep their
+      postcode, and only have the ONS fields and IMD decile looked up again
+
+    All other records are kept as they are.
+
+    Args:
+        merged_data: Census data merged with the previous release
+        release_diff: Postcodes that differ between the previous and new release (see `postcode_index.diff_indexes`)
+        postcode_index: ONS Postcode Directory postcode index of the new release
+
+    """
+    merged_data = merged_data.reset_index(drop=True)
+    statuses = release_diff["status"]
+    own_keys = postcodes.encode(postcodes.normalise(merged_data[scout_census.column_labels.POSTCODE]))
+    validity_changed = np.isin(own_keys, release_diff.index[statuses != "changed"])
+    linked = census_merge_data.rows_linked_by_entity(merged_data, merged_data.loc[validity_changed], postcode_index).to_numpy() | validity_changed
+
+    fixed_keys = postcodes.encode(merged_data[census_merge_data.CLEAN_POSTCODE_LABEL])
+    fields_changed = ~linked & np.isin(fixed_keys, release_diff.index[statuses == "changed"])
+    logger.info(f"Re-processing {linked.sum():,} records whose postcode fixing may change, and updating ONS fields of {fields_changed.sum():,} records")
+
+    changed_data = []
+    if linked.any():
+        changed_data.append(_reprocess_records(_unmerged(merged_data.loc[linked]), postcode_index))
+    if fields_changed.any():
+        updated_data = merged_data.loc[fields_changed]
+        ons_fields = [field for data_type_fields in ons_fields_data_types.values() for field in data_type_fields if field in merged_data.columns]
+        updated_data = updated_data.drop(columns=ons_fields).join(postcode_index.lookup(updated_data[census_merge_data.CLEAN_POSTCODE_LABEL], ons_fields))
+        changed_data.append(create_imd_deciles(updated_data[merged_data.columns], ONS_PD))
+
+    unchanged = ~linked & ~fields_changed
+    frames = [frame for frame in (merged_data.loc[unchanged], *changed_data) if len(frame.index)]  # empty frames can change concatenated types
+    combined = categoricals.concat(frames, sort_categories=True).sort_index().reset_index(drop=True)
+    return coerce_data_types(combined)
+
+
+def _unmerged(merged_data: pd.DataFrame) -> pd.DataFrame:
+    """Merged census records without the fields added by merging, as raw records."""
+    derived_fields = {
+        census_merge_data.CLEAN_POSTCODE_LABEL,
+        scout_census.column_labels.VALID_POSTCODE,
+        "imd_decile",
+        *ons_fields_data_types["categorical"],
+        *ons_fields_data_types["numeric"],
+    }
+    return merged_data.drop(columns=[col for col in merged_data.columns if col in derived_fields])
+
+
+def _reprocess_records(census_data: pd.DataFrame, postcode_index: PostcodeIndex) -> pd.DataFrame:
+    """Merges raw census records, keeping their index."""
+    # Row order is preserved through merging, so the original index can be restored
+    return merge_census_data(census_data.reset_index(drop=True), postcode_index).set_axis(census_data.index)
+
+
+def load_census_data(extract_path: Path = None) -> pd.DataFrame:
+    """Loads the raw census extract with the PyArrow multi-threaded CSV reader.
+
+    Column types from `census_column_types` are applied as the file is parsed,
+    so integer columns land directly as nullable Int16/Int32 columns and
+    categorical columns as dictionary encoded (category) columns.
+
+    Args:
+        extract_path: Path to the raw extract, defaults to the path in the config file
+
+    """
+    name_label = scout_census.column_labels.name.ITEM
+    column_types = census_column_types | {name_label: pa.string()}  # name is dictionary encoded after cleaning
 
-def load_census_data() -> pd.DataFrame:
     # load raw census extract
-    # TODO potentially use PyArrow CSV reader - 7.5s (pandas) -> 1.2s (pyarrow)
-    dtypes = {key: "bool" for key in cols_bool} | {key: "Int16" for key in cols_int_16} | {key: "Int32" for key in cols_int_32} | {key: "category" for key in cols_categorical}
-    census_data = pd.read_csv(config.SETTINGS.census_extract.original, dtype=dtypes, encoding="utf-8")
+    census_table = csv.read_csv(
+        extract_path or config.SETTINGS.census_extract.original,
+        read_options=csv.ReadOptions(use_threads=True, encoding="utf-8"),
+        convert_options=csv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+    )
 
     # combine all youth membership columns into a single total
     for section_name, section_model in scout_census.column_labels.sections:
-        census_data[f"{section_name}_total"] = census_data[section_model.youth_cols].sum(axis=1).astype("Int16")
+        youth_counts = [pc.fill_null(census_table[col].cast(pa.int32()), 0) for col in section_model.youth_cols]
+        census_table = _set_column(census_table, section_model.total, functools.reduce(pc.add, youth_counts).cast(pa.int16()))
 
     # backticks (`) break folium's output as it uses ES2015 template literals in the output file.
     # TODO can we remove this?
-    census_data[scout_census.column_labels.name.ITEM] = census_data[scout_census.column_labels.name.ITEM].str.replace("`", "")
+    names = pc.replace_substring(census_table[name_label], pattern="`", replacement="")
+    census_table = _set_column(census_table, name_label, names.dictionary_encode())
+
+    census_data = census_table.to_pandas(types_mapper=_pandas_types.get)
+    census_data[scout_census.column_labels.DATE] = pd.to_datetime(census_data[scout_census.column_labels.DATE], format="%d/%m/%Y").astype(str)  # ISO format
 
     return census_data
 
 
-def load_postcode_directory(ons_pd: ONSPostcodeDirectory) -> pd.DataFrame:
-    logger.info(f"Loading ONS postcode data.")
-    return pd.read_csv(
-        config.SETTINGS.ons_pd.full,
-        index_col=ons_pd.index_column,
-        dtype=ons_pd.data_types,
-        usecols=[f for f in ons_pd.fields if f != "imd_decile"],  # imd_decile isn't defined in the raw file
-        encoding="utf-8",
-    )
+def _set_column(table: pa.Table, name: str, column: pa.ChunkedArray) -> pa.Table:
+    """Replaces column `name` in `table`, or appends it if not present."""
+    index = table.schema.get_field_index(name)
+    if index == -1:
+        return table.append_column(name, column)
+    return table.set_column(index, name, column)
 
 
-def merge_ons_postcode_directory(data: pd.DataFrame, ons_pd_data: pd.DataFrame) -> pd.DataFrame:
+def merge_ons_postcode_directory(data: pd.DataFrame, postcode_index: PostcodeIndex) -> pd.DataFrame:
     """Merges census extract data with ONS data
 
     Args:
         data: Census data
-        ons_pd_data: ONS Postcode Directory data
+        postcode_index: ONS Postcode Directory postcode index
 
     """
-    ons_fields_data_types = {
-        "categorical": ["lsoa11", "msoa11", "oslaua", "osward", "pcon", "oscty", "ctry", "rgn"],
-        "numeric": ["oseast1m", "osnrth1m", "lat", "long", "imd"],
-    }
-
-    data = census_merge_data.merge_with_postcode_directory(data, ons_pd_data, ons_fields_data_types)
+    data, repair_summary = census_merge_data.merge_with_postcode_directory(data, postcode_index, ons_fields_data_types)
+    logger.info(f"Postcodes repaired: {repair_summary.repaired}, valid postcodes {repair_summary.valid_before:,} -> {repair_summary.valid_after:,}")
 
     # Filter to useful columns
     # fmt: off
@@ -109,7 +413,8 @@ def merge_ons_postcode_directory(data: pd.DataFrame, ons_pd_data: pd.DataFrame)
         "Chief_Scout_Bronze_Awards", "Chief_Scout_Silver_Awards", "Chief_Scout_Gold_Awards", "Chief_Scout_Platinum_Awards", "Chief_Scout_Diamond_Awards",
         "Duke_Of_Edinburghs_Bronze", "Duke_Of_Edinburghs_Silver", "Duke_Of_Edinburghs_Gold", "Young_Leader_Belts", "Explorer_Belts", "ScoutsOfTheWorldAward", "Queens_Scout_Awards",
         "Eligible4Bronze", "Eligible4Silver", "Eligible4Gold", "Eligible4Diamond", "Eligible4QSA", "Eligible4SOWA",
-        "oscty", "oslaua", "osward", "ctry", "rgn", "pcon", "lsoa11", "msoa11", "lat", "long", "imd"
+        "oscty", "oslaua", "osward", "ctry", "rgn", "pcon", "lsoa11", "msoa11", "lat", "long", "imd",
+        *[field for field in custom_boundary_fields if field in data.columns],
     ]]
     # fmt: on
     # discarded columns:
@@ -128,34 +433,59 @@ def create_imd_deciles(census_data: pd.DataFrame, ons_pd: ONSPostcodeDirectory):
 
 
 def coerce_data_types(data: pd.DataFrame) -> pd.DataFrame:
-    # Set correct types
-    data[cols_bool] = data[cols_bool].astype(bool)
-    data[cols_int_16] = data[cols_int_16].astype("Int16")
-    data[cols_int_32] = data[cols_int_32].astype("Int32")
+    """Sets each column to the narrowest data type holding its values.
+
+    Columns of `cols_categorical` are always categorical. Types of other
+    columns are planned from their values by `dtype_planner`, e.g. counts
+    without missing values which fit in a byte are stored as int8 and the
+    census date as a date.
+
+    Args:
+        data: Merged census data
+
+    """
     data[cols_categorical] = data[cols_categorical].astype("category")
-    data["Census Date"] = pd.to_datetime(data["Census Date"], format="%d/%m/%Y").astype(str)  # ISO format
+    before = data.copy(deep=False)
+    data = dtype_planner.apply_data_types(data, dtype_planner.plan_data_types(data))
+
+    report = dtype_planner.memory_report(before, data)
+    logger.info(f"Data types set, memory {report.loc['Total', 'bytes before'] / 2**20:.1f}MiB -> {report.loc['Total', 'bytes after'] / 2**20:.1f}MiB")
+    logger.debug(f"Memory by column:\n{report.to_string()}")
 
     # # Fix ONS errors (https://github.com/mysociety/mapit/issues/341)
     # data["osward"] = data["osward"].replace("E05006336", "E05012387")
 
-    # Tidy categories
-    for field, dtype in data.dtypes.items():
-        if str(dtype) == "category":
-            data[field] = data[field].cat.remove_unused_categories()
-
-    return data
+    return categoricals.tidy_categories(data)
 
 
-def save_merged_data(data: pd.DataFrame, ons_pd_publication_date: str) -> None:
-    """Save passed dataframe to csv file.
+def save_merged_data(
+    data: pd.DataFrame, ons_pd_publication_date: str, partition_by_country: bool = False, output_formats: Collection[str] = OUTPUT_FORMATS, defer_csv: bool = False
+) -> Future | None:
+    """Save passed dataframe to csv file, a Parquet dataset and an uncompressed Arrow file.
 
+    The Arrow file can be memory-mapped by `scout_census.load_census_data`.
     Also output list of errors in the merge process to a text file
 
+    The outputs are written concurrently, each by a thread of a thread pool.
+    With `defer_csv`, the csv file (which is the slowest to write) is written
+    in the background once the other outputs exist, and this returns without
+    waiting for it.
+
     Args:
         data: Census data
         ons_pd_publication_date: Refers to the ONS Postcode Directory's publication date
+        partition_by_country: If True, partition the dataset by Scout country as well as census ID
+        output_formats: Outputs to write, from `OUTPUT_FORMATS`
+        defer_csv: If True, write the csv file in the background
+
+    Returns:
+        Future for the background csv write if `defer_csv`, otherwise None
 
     """
+    unknown_formats = set(output_formats) - set(OUTPUT_FORMATS)
+    if unknown_formats:
+        raise ValueError(f"Unknown output formats {sorted(unknown_formats)}, choose from {OUTPUT_FORMATS}")
+
     raw_extract_path = config.SETTINGS.census_extract.original
     output_path = raw_extract_path.parent / f"{raw_extract_path.stem} with {ons_pd_publication_date} fields"
     error_output_path = config.SETTINGS.folders.output / "error_file.csv"
@@ -167,12 +497,50 @@ def save_merged_data(data: pd.DataFrame, ons_pd_publication_date: str) -> None:
 
     # The errors file contains all the postcodes that failed to be looked up in the ONS Postcode Directory
     error_output_fields = [postcode_merge_column, original_postcode_label, compass_id_label, "type", "name", "G_name", "D_name", "C_name", "R_name", "X_name", "Census Date"]
-    data.loc[~data[valid_postcode_label], error_output_fields].to_csv(error_output_path, index=False, encoding="utf-8-sig")
 
-    # Write the new data to a csv file (utf-8-sig only to force excel to use UTF-8)
+    # Writers only read `data`, so they can safely run at the same time
+    writers = {
+        "errors": lambda: _write_csv(data.loc[~data[valid_postcode_label], error_output_fields], error_output_path),
+        "csv": lambda: _write_csv(data, output_path.with_suffix(".csv")),
+        "parquet": lambda: scout_census.save_census_data(data, output_path, partition_by_country),
+        "arrow": lambda: scout_census.save_memory_mapped_census_data(data, output_path.with_name(f"{output_path.name}.arrow")),
+    }
+    to_write = [output_format for output_format in OUTPUT_FORMATS if output_format in output_formats]
+
+    deferred = defer_csv and "csv" in to_write
+    if deferred:
+        to_write.remove("csv")
+
     logger.info("Writing merged data")
-    data.to_csv(output_path.with_suffix(".csv"), index=False, encoding="utf-8-sig")
-    data.to_feather(output_path.with_suffix(".feather"))
+    if to_write:
+        with ThreadPoolExecutor(max_workers=len(to_write), thread_name_prefix="census-writer") as executor:
+            futures = [executor.submit(_run_writer, output_format, writers[output_format]) for output_format in to_write]
+        for future in futures:
+            future.result()  # re-raise any errors from writing
+
+    if not deferred:
+        return None
+    # Started after the other outputs are written, so it doesn't compete with them
+    background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="csv-writer")
+    deferred_csv = background.submit(_run_writer, "csv", writers["csv"])
+    background.shutdown(wait=False)  # the write continues, and the interpreter waits for it before exiting
+    return deferred_csv
+
+
+def _write_csv(data: pd.DataFrame, path: Path) -> None:
+    """Writes a csv file, with utf-8-sig only to force excel to use UTF-8."""
+    data.to_csv(path, index=False, encoding="utf-8-sig")
+
+
+def _release_date(postcode_index: PostcodeIndex) -> str:
+    """Publication date of the ONS Postcode Directory release of a postcode index, for indexes built before dates were recorded the configured release's."""
+    return postcode_index.publication_date or ONS_PD.PUBLICATION_DATE
+
+
+def _run_writer(output_format: str, writer: Callable[[], None]) -> None:
+    start_time = time.time()
+    writer()
+    logger.info(f"Written {output_format} output, {time.time() - start_time:.2f} seconds elapsed.")
 
 
 if __name__ == "__main__":
@@ -182,6 +550,26 @@ if __name__ == "__main__":
     logger.info(f"Starting at {time.strftime('%H:%M:%S', time.localtime())}")
     start_time = time.time()
 
-    process_census_extract()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--append", type=Path, help="raw census extract with a new census year to add to the existing merged extract")
+    parser.add_argument("--previous-index", type=Path, help="postcode index of the ONS PD release the existing merged extract was merged with, to update it to the current release")
+    parser.add_argument(
+        "--publication-date", help="publication date of the current ONS PD release (e.g. 'May 2021') to label updated outputs, if not recorded in its postcode index"
+    )
+    parser.add_argument("--partition-by-country", action="store_true", help="partition the merged dataset by Scout country (X_name) as well as census ID")
+    parser.add_argument("--no-cache", action="store_true", help="repeat every processing stage, ignoring cached stage outputs")
+    parser.add_argument("--formats", nargs="+", choices=OUTPUT_FORMATS, default=OUTPUT_FORMATS, help="outputs to write (default: all)")
+    parser.add_argument("--defer-csv", action="store_true", help="write the csv copy in the background, after the other outputs are available")
+    args = parser.parse_args()
+
+    if args.append:
+        csv_write = append_census_extract(args.append, args.partition_by_country, args.formats, args.defer_csv)
+    elif args.previous_index:
+        csv_write = update_census_extract(args.previous_index, args.partition_by_country, args.formats, args.defer_csv, args.publication_date)
+    else:
+        csv_write = process_census_extract(args.partition_by_country, not args.no_cache, args.formats, args.defer_csv)
 
     logger.info(f"Script finished, {time.time() - start_time:.2f} seconds elapsed.")
+    if csv_write is not None:
+        logger.info("Waiting for the csv copy to be written")
+        csv_write.result()
@@ -14,8 +14,7 @@ if __name__ == "__main__":
     start_time = time.time()
     logger.info(f"Starting at {time.strftime('%H:%M:%S', time.localtime(start_time))}")
 
-    census_data = load_census_data()
-    census_data = filter.filter_records(census_data, "Census_ID", {20})
+    census_data = load_census_data(census_ids={20})
     # Remove Jersey, Guernsey, and Isle of Man as they have invalid lat/long coordinates for their postcodes
     census_data = filter.filter_records(census_data, "C_name", {"Bailiwick of Guernsey", "Isle of Man", "Jersey"}, exclude_matching=True)
 
@@ -1,51 +1,222 @@
+"""Reduce the full ONS Postcode Directory
+
+Creates the minified (with co-ordinates, see `incognita.data.ons_pd_coordinates`)
+and reduced (without) ONS Postcode Directory files, and the postcode index (see `incognita.data.postcode_index`),
+which are used for lookups instead of the full directory.
+
+The outputs are produced in one streaming pass over the full directory (which
+can be read from the release zip archive without extracting it), with unused
+columns skipped by the parser and IMD deciles calculated per chunk.
+Duplicate rows are dropped as chunks are read, by keeping 64-bit hashes of
+the rows seen so far, and the rows packed into integers to compare rows with
+equal hashes exactly (see `UniqueRows`), and unique reduced rows are appended
+to the reduced csv file as they are found.
+
+The postcode index has a row per postcode, so each chunk's index rows are
+sorted and written to a temporary run file instead of being kept (see
+`incognita.data.postcode_index.PostcodeIndexBuilder`), and the index is
+written from the memory-mapped runs after the pass. During the pass, peak
+memory is one chunk (see `incognita.data.ons_pd_reader`), the packed rows and
+the unique rows of the outputs, which are far fewer than the rows of the
+full directory. Writing the index then holds the sorted index, only of the
+(dictionary encoded) fields in the ONS Postcode Directory metadata.
+
+Codes new in this release (from the reduced directory and the ONS names and
+codes files) are added to the shared ONS code dictionary (see
+`incognita.data.ons_codes`), and the reduced directory is saved with its code
+columns as integer IDs in that dictionary, partitioned by country and region
+(see `incognita.data.ons_pd_reduced`).
+
+Custom boundaries with shapes that aren't ONS Postcode Directory fields (e.g.
+North Yorkshire districts) are assigned to every postcode as the directory is
+streamed, and saved as extra fields of the reduced and minified directories
+and the postcode index. Reports and geographies then use them like ONS
+fields, with no spatial join at report time.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 
+from incognita.data import add_shape_data
+from incognita.data import ons_codes
+from incognita.data import ons_pd_coordinates
+from incognita.data import ons_pd_reader
+from incognita.data import ons_pd_reduced
+from incognita.data import postcode_index
 from incognita.data.ons_pd import ONS_POSTCODE_DIRECTORY_MAY_20 as ONS_PD
 from incognita.logger import logger
 from incognita.logger import set_up_logger
+from incognita.utility import archives
+from incognita.utility import categoricals
 from incognita.utility import config
-from incognita.utility import constants
-from incognita.utility import deciles
+
+if TYPE_CHECKING:
+    from incognita.utility.config import Boundary
+
+
+class UniqueRows:
+    """Filters chunks of rows to rows not seen before, in this or earlier chunks.
+
+    Rows are found by a 64-bit hash of their values (for categorical columns,
+    the hash of the category, so chunks with different categories match), and
+    rows with equal hashes are then compared exactly, so a hash collision
+    never drops a distinct row. For the exact comparison each row is packed
+    into 64-bit words: categorical and text values as their position in the
+    column's values seen so far, and numbers by their bits, with a bit per
+    column flagging missing values. Only the packed rows seen (sorted by hash)
+    and the distinct categorical and text values are kept.
+    """
+
+    def __init__(self):
+        self._hashes = np.empty(0, dtype=np.uint64)  # sorted
+        self._keys: np.ndarray = None  # packed rows, in the order of `_hashes`
+        self._values: dict[str, pd.Index] = {}  # categorical and text values seen, by column
+
+    def __call__(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        keys = self._row_keys(chunk)
+        if self._keys is None:
+            self._keys = keys[:0]
+
+        # Rows seen in earlier chunks, where the first row seen with the same hash is the same row
+        positions = np.searchsorted(self._hashes, hashes)
+        in_range = positions < self._hashes.size
+        same_hash = np.zeros(hashes.size, dtype=bool)
+        same_hash[in_range] = self._hashes[positions[in_range]] == hashes[in_range]
+        seen = same_hash.copy()
+        seen[same_hash] = self._keys[positions[same_hash]] == keys[same_hash]
+        # Rows repeated in this chunk, where the first row in the chunk with the same hash is the same row
+        first_rows = pd.Series(np.arange(hashes.size)).groupby(hashes).transform("min").to_numpy()
+        hash_repeated = first_rows != np.arange(hashes.size)
+        repeated = hash_repeated & (keys[first_rows] == keys)
+
+        # Hash collisions (equal hashes, different rows) are checked against every row with the same hash
+        for row in np.flatnonzero(same_hash & ~seen):
+            seen[row] = keys[row] in self._keys[positions[row] : np.searchsorted(self._hashes, hashes[row], side="right")]
+        for row in np.flatnonzero(hash_repeated & ~repeated):
+            earlier = np.flatnonzero(hashes[:row] == hashes[row])
+            repeated[row] = keys[row] in keys[earlier]
+
+        is_new = ~seen & ~repeated
+        hashes, keys = np.concatenate([self._hashes, hashes[is_new]]), np.concatenate([self._keys, keys[is_new]])
+        order = np.argsort(hashes, kind="stable")
+        self._hashes, self._keys = hashes[order], keys[order]
+        return chunk.loc[is_new]
+
+    def _row_keys(self, chunk: pd.DataFrame) -> np.ndarray:
+        """Each row's values packed into one (void) value, equal only for equal rows."""
+        flag_words = (len(chunk.columns) + 63) // 64
+        words = np.zeros((len(chunk.index), len(chunk.columns) + flag_words), dtype=np.uint64)
+        for i, col in enumerate(chunk.columns):
+            series = chunk[col]
+            words[:, i] = self._value_words(col, series)
+            words[:, len(chunk.columns) + i // 64] |= series.isna().to_numpy().astype(np.uint64) << np.uint64(i % 64)
+        return words.view(np.dtype((np.void, words.shape[1] * 8))).ravel()
+
+    def _value_words(self, col: str, series: pd.Series) -> np.ndarray:
+        """Values of a column as 64-bit words, with missing values as 0 (flagged separately)."""
+        if pd.api.types.is_float_dtype(series.dtype):
+            return series.to_numpy(dtype=np.float64, na_value=0).view(np.uint64)
+        if pd.api.types.is_integer_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+            return series.to_numpy(dtype=np.int64, na_value=0).view(np.uint64)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series)
+        values = self._values.get(col, pd.Index([]))
+        values = self._values[col] = values.append(uniques[~uniques.isin(values)])
+        return np.where(codes != -1, values.get_indexer(uniques)[codes], 0).astype(np.uint64)
+
+
+def load_custom_boundaries() -> dict[str, tuple[Boundary, gpd.GeoDataFrame]]:
+    """Loads the shapes of custom boundaries that aren't ONS Postcode Directory fields, by boundary key."""
+    custom_shapes = {}
+    for boundary in config.SETTINGS.custom_boundaries.values():
+        if boundary.shapefile is None or boundary.key in ONS_PD.fields:
+            continue
+        if not boundary.shapefile.path.is_file():
+            logger.warning(f"Shapefile {boundary.shapefile.path} not found, {boundary.key} is not added to the ONS Postcode Directory")
+            continue
+        custom_shapes[boundary.key] = boundary, add_shape_data.load_boundary_shapes(boundary)
+    logger.info(f"Adding custom boundaries {list(custom_shapes)}")
+    return custom_shapes
+
+
+def add_custom_boundaries(chunk: pd.DataFrame, custom_shapes: dict[str, tuple[Boundary, gpd.GeoDataFrame]]) -> pd.DataFrame:
+    """Adds a column of the custom boundary each postcode is within, for each custom boundary.
+
+    Args:
+        chunk: ONS Postcode Directory rows, with co-ordinate columns
+        custom_shapes: Boundaries and their shapes, by boundary key (see `load_custom_boundaries`)
+
+    Returns:
+        Chunk with a column per custom boundary, typed as the boundary's codes (string codes as categorical)
+
+    """
+    for key, (boundary, shapes) in custom_shapes.items():
+        codes = add_shape_data.boundary_codes(chunk, shapes, boundary.shapefile.key)
+        chunk[key] = codes.astype("category" if boundary.codes.key_type == "string" else boundary.codes.key_type)
+    return chunk
+
 
 if __name__ == "__main__":
     set_up_logger()
 
     logger.info("Starting")
     to_keep = ("oscty", "oslaua", "osward", "ctry", "rgn", "pcon", "lsoa11", "msoa11", "imd", "imd_decile")  # 'lat', 'long', 'nys_districts', 'pcd'
-    fields = [f for f in to_keep if f in ONS_PD.fields]
-
-    # Load Full ONS Postcode Directory
-    data = pd.read_csv(config.SETTINGS.ons_pd.full, dtype=ONS_PD.data_types, encoding="utf-8")
-    logger.info("Loaded data")
+    ons_fields = [f for f in to_keep if f in ONS_PD.fields]
+    custom_shapes = load_custom_boundaries()
+    fields = ons_fields + list(custom_shapes)
 
-    orig = data.copy()
-    logger.info("DEBUG - copied original data")
+    # Stream the full ONS Postcode Directory (IMD Deciles and custom boundaries are added per chunk),
+    # keeping only rows not seen before, and appending new reduced rows to the csv file
+    index_fields = sorted(ONS_PD.fields - {ONS_PD.index_column}) + list(custom_shapes)
+    coordinate_columns = [col for xy in ons_pd_coordinates.COORDINATE_COLUMNS.values() for col in xy]
+    reduced_csv_path = config.SETTINGS.ons_pd.reduced.with_suffix(".csv")
+    unique_minified, unique_reduced = UniqueRows(), UniqueRows()
+    minified_chunks = []
+    reduced_chunks = []
+    index_builder = postcode_index.PostcodeIndexBuilder()
+    for i, chunk in enumerate(ons_pd_reader.stream_postcode_directory(ONS_PD, sorted(set(ons_fields) | ONS_PD.fields | set(coordinate_columns)))):
+        chunk = add_custom_boundaries(chunk, custom_shapes)
+        minified_chunks.append(unique_minified(chunk[fields + coordinate_columns]))
+        reduced_chunks.append(unique_reduced(chunk[fields]))
+        index_builder.add(chunk[[ONS_PD.index_column] + index_fields].set_index(ONS_PD.index_column))
+        # utf-8-sig only to force excel to use UTF-8, so only the first chunk (with the header) has the byte order mark
+        reduced_chunks[-1].to_csv(reduced_csv_path, mode="a" if i else "w", header=not i, index=False, encoding="utf-8" if i else "utf-8-sig")
+    logger.info("Loaded data, saved reduced csv")
 
-    # Add IMD Decile
-    data["imd_decile"] = deciles.calc_imd_decile(data["imd"], data["ctry"], ONS_PD).astype("UInt8")
-    logger.info("IMD Deciles added")
+    # Save the postcode index
+    index_builder.build(publication_date=ONS_PD.PUBLICATION_DATE)
+    logger.info("Postcode index saved")
 
     # Save minified full ONS Postcode Directory
-    reduced_data_with_coords = data[fields + ["lat", "long"]].copy()
+    # Chunks are indexed by row number in the full file, so the "index" column matches a whole-file read
+    reduced_data_with_coords = categoricals.concat(minified_chunks, sort_categories=True).reset_index()
+    del minified_chunks
     # reduced_data_with_coords[["lat", "long"]] = reduced_data_with_coords[["lat", "long"]].round(4)  # Limit to 3dp (~100m resolution)
-    reduced_data_with_coords = reduced_data_with_coords.drop_duplicates().reset_index()
-    reduced_data_with_geo = gpd.GeoDataFrame(
-        reduced_data_with_coords,
-        geometry=gpd.points_from_xy(reduced_data_with_coords.long, reduced_data_with_coords.lat),
-        crs=constants.WGS_84,
-    ).drop(columns=["lat", "long"])
+    ons_pd_coordinates.save_minified(reduced_data_with_coords)
     del reduced_data_with_coords
-    reduced_data_with_geo.to_feather(config.SETTINGS.ons_pd.minified)
-    del reduced_data_with_geo
     logger.info("Minified data saved")
 
-    # Get needed columns and delete duplicate rows
-    reduced_data = data[fields].drop_duplicates().reset_index(drop=True)
-    del data
-    logger.info("Reduced data")
+    reduced_data = categoricals.concat(reduced_chunks, sort_categories=True).reset_index(drop=True)
+    del reduced_chunks
 
-    logger.info("Saving data")
-    reduced_data.to_csv(config.SETTINGS.ons_pd.reduced.with_suffix(".csv"), index=False, encoding="utf-8-sig")
-    reduced_data.to_feather(config.SETTINGS.ons_pd.reduced.with_suffix(".feather"))
+    # Add new codes to the shared ONS code dictionary, then save the reduced data with codes as IDs in the dictionary
+    code_columns = [col for col in fields if isinstance(reduced_data[col].dtype, pd.CategoricalDtype)]
+    release_codes = [reduced_data[col].cat.categories.to_series() for col in code_columns]
+    for boundary in config.SETTINGS.ons2020.values():
+        if archives.exists(boundary.codes.path):
+            with archives.open_file(boundary.codes.path) as codes_file:
+                release_codes.append(pd.read_csv(codes_file, usecols=[boundary.codes.key], dtype={boundary.codes.key: boundary.codes.key_type})[boundary.codes.key])
+        else:
+            logger.warning(f"Codes file {boundary.codes.path} not found, its codes are not added to the ONS code dictionary")
+    code_dictionary = ons_codes.load_dictionary().extended(pd.concat(release_codes), ONS_PD.PUBLICATION_DATE)
+    code_dictionary.save()
+    ons_pd_reduced.save_reduced(reduced_data, config.SETTINGS.ons_pd.reduced.with_suffix(".feather"), code_columns, code_dictionary)
     logger.info("Done")
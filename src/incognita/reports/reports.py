@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import pandas as pd
 
+from incognita.data import ons_codes
+from incognita.data import ons_pd_reduced
 from incognita.data.ons_pd import ONS_POSTCODE_DIRECTORY_MAY_20 as ONS_PD
 from incognita.data.scout_census import column_labels
 from incognita.data.scout_census import DEFAULT_VALUE
@@ -71,6 +73,9 @@ class Reports:
         census_data = self.census_data
         boundary_codes = self.geography.boundary_codes
         geog_name = self.geography.metadata.key  # e.g oslaua osward pcon lsoa11
+        if geog_name in ONS_GEOG_NAMES:
+            # group and join on IDs in the shared code dictionary (as in boundary_codes) instead of code strings, on a copy so the shared census data isn't changed
+            census_data = census_data.assign(**{geog_name: ons_codes.load_dictionary().categorical(census_data[geog_name])})
         logger.info(f"Creating report by {geog_name} with {', '.join(options)} from {len(census_data.index)} records")
 
         census_dates = sorted(set(census_data["Census Date"].dropna()))
@@ -90,7 +95,7 @@ class Reports:
             logger.debug(f"Adding group data")
             groups = census_data[[geog_name, column_labels.name.GROUP]].copy()
             groups[column_labels.name.GROUP] = groups[column_labels.name.GROUP].str.strip()
-            grouped_rgn = groups.drop_duplicates().dropna().groupby([geog_name], dropna=False)[column_labels.name.GROUP]
+            grouped_rgn = groups.drop_duplicates().dropna().groupby([geog_name], dropna=False, observed=True)[column_labels.name.GROUP]
             dataframes.append(pd.DataFrame({"Groups": grouped_rgn.unique().apply("\n".join), "Number of Groups": grouped_rgn.nunique(dropna=True)}))
 
         if opt_section_numbers or opt_number_of_sections or opt_6_to_17_numbers or opt_waiting_list_totals or opt_adult_numbers:
@@ -115,7 +120,7 @@ class Reports:
                 metric_cols += ["Waiting List"]
             if opt_adult_numbers:
                 metric_cols += ["Adults"]
-            agg = census_data.groupby([geog_name, "Census_ID"], dropna=False)[metric_cols].sum().unstack().sort_index()
+            agg = census_data.groupby([geog_name, "Census_ID"], dropna=False, observed=True)[metric_cols].sum().unstack().sort_index()
             agg.columns = [f"{rename.get(key, key)}-{census_year}".replace("_total", "") for key, census_year in agg.columns]
             dataframes.append(agg)
 
@@ -143,7 +148,7 @@ class Reports:
 
             # Check that our pivot keeps the total membership constant
             yp_cols = ["Beavers_total", "Cubs_total", "Scouts_total", "Explorers_total"]
-            grouped_rgn = census_data.groupby([geog_name], dropna=False)
+            grouped_rgn = census_data.groupby([geog_name], dropna=False, observed=True)
             assert int(census_data[yp_cols].sum().sum()) == int(grouped_rgn[yp_cols].sum().sum().sum())
 
             logger.debug(f"Adding awards data")
@@ -182,7 +187,7 @@ class Reports:
 
         if geog_name == "lsoa11":
             logger.debug(f"Loading ONS postcode data & Adding IMD deciles.")
-            ons_pd_data = pd.read_feather(config.SETTINGS.ons_pd.reduced, columns=["lsoa11", "imd_decile"]).drop_duplicates()
+            ons_pd_data = ons_pd_reduced.reduced_ons_pd().columns(["lsoa11", "imd_decile"]).drop_duplicates()
             output_data = output_data.merge(ons_pd_data, how="left", left_on="codes", right_on="lsoa11").drop(columns="lsoa11")
 
         if report_name:
@@ -236,10 +241,11 @@ class Reports:
         pivot_key = metadata.age_profile.pivot_key
         if pivot_key and pivot_key != geog_key:
             logger.debug(f"Loading ONS postcode data.")
-            ons_pd_data = pd.read_feather(config.SETTINGS.ons_pd.reduced, columns=[geog_key, pivot_key])
+            ons_pd_data = ons_pd_reduced.reduced_ons_pd().columns([geog_key, pivot_key])
+            reduced_age_profile_pd = reduced_age_profile_pd.assign(**{age_profile_key: ons_codes.load_dictionary().categorical(reduced_age_profile_pd[age_profile_key])})
             merged_age_profile = reduced_age_profile_pd.merge(ons_pd_data, how="left", left_on=age_profile_key, right_on=pivot_key).drop(pivot_key, axis=1)
             merged_age_profile_no_na = merged_age_profile.dropna(subset=[geog_key])
-            pivoted_age_profile = merged_age_profile_no_na.groupby(geog_key).sum().astype("UInt32")
+            pivoted_age_profile = merged_age_profile_no_na.groupby(geog_key, observed=True).sum().astype("UInt32")
 
             # Check we did not accidentally expand the population!
             # assert merged_age_profile["Pop_All"].sum() == reduced_age_profile_pd["Pop_All"].sum()  # this will fail
@@ -0,0 +1,63 @@
+"""Paths to files inside zip archives
+
+Data files can be read straight from the zip archives they are distributed in
+(e.g. the ONS Postcode Directory release), without extracting them first. A
+file in an archive is addressed by the archive's path followed by the file's
+path within it, e.g. "data/ONSPD_MAY_2020_UK.zip/Data/ONSPD_MAY_2020_UK.csv".
+
+Files in archives are decompressed as they are read, so reading is
+incremental, like reading an extracted file.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import BinaryIO, Optional
+import zipfile
+
+ARCHIVE_SUFFIX = ".zip"
+
+
+def split_archive_path(path: Path) -> Optional[tuple[Path, str]]:
+    """Splits a path within a zip archive into the archive's path and the member name.
+
+    Returns None if the path is not within an archive (no parent is an existing zip file).
+    """
+    path = Path(path)
+    for archive in path.parents:
+        if archive.suffix.lower() == ARCHIVE_SUFFIX and archive.is_file():
+            return archive, path.relative_to(archive).as_posix()
+    return None
+
+
+def exists(path: Path) -> bool:
+    """If the file or directory exists, either on disk or in an archive."""
+    if Path(path).exists():
+        return True
+    archive_path = split_archive_path(path)
+    if archive_path is None:
+        return False
+    archive, member = archive_path
+    with zipfile.ZipFile(archive) as zip_file:
+        return any(name == member or name.startswith(member.rstrip("/") + "/") for name in zip_file.namelist())
+
+
+def open_file(path: Path) -> BinaryIO:
+    """Opens a file for binary reading, either on disk or in an archive.
+
+    Args:
+        path: Path to the file, which may be within a zip archive
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+
+    """
+    archive_path = None if Path(path).is_file() else split_archive_path(path)
+    if archive_path is None:
+        return open(path, "rb")
+    archive, member = archive_path
+    with zipfile.ZipFile(archive) as zip_file:
+        try:
+            return zip_file.open(member)  # the archive stays open until the member is closed
+        except KeyError:
+            raise FileNotFoundError(f"{member} not found in {archive}") from None
@@ -0,0 +1,210 @@
+"""On-disk cache for the outputs of pipeline stages
+
+A stage is a function producing a DataFrame. Its output is cached on disk,
+keyed by a fingerprint of everything the output depends on:
+- the stage's name and the source code of its function (and of any other
+  modules passed as its code)
+- the installed incognita version
+- its other inputs, e.g. file fingerprints, settings and column lists
+- the keys of its upstream stages
+
+Stages are lazy: calling a stage loads its output from the cache if the key
+matches, otherwise it calls its upstream stages (which may themselves be
+cached) and then its function. A rerun where nothing changed therefore only
+loads the output of the last stage.
+
+Cached outputs are feather files, written atomically so an interrupted run
+never leaves a partial file. Only the latest output of each stage is kept.
+
+`BoundedCache` is a simpler cache of DataFrames keyed by a fingerprint of
+their inputs (e.g. spatial joins, see `incognita.data.add_shape_data`),
+where many entries are kept up to a total size, and the least recently used
+entries are removed beyond that.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Callable
+from collections.abc import Iterable
+import functools
+import hashlib
+import importlib.metadata
+import inspect
+import json
+import os
+from pathlib import Path
+from types import ModuleType
+
+import pandas as pd
+from pyarrow import feather
+
+from incognita.logger import logger
+
+_READ_BLOCK_SIZE = 2**20
+
+
+def fingerprint(*parts: object) -> str:
+    """Hex digest of the passed parts, which must be JSON serialisable (sets are sorted)."""
+    serialised = json.dumps(parts, sort_keys=True, default=lambda obj: sorted(obj) if isinstance(obj, (set, frozenset)) else str(obj))
+    return hashlib.sha256(serialised.encode("utf-8")).hexdigest()
+
+
+def frame_fingerprint(data: pd.DataFrame) -> str:
+    """Hex digest of a DataFrame's values and index (vectorised, so much faster than comparing frames)."""
+    digest = hashlib.sha256(json.dumps([list(map(str, data.columns)), list(map(str, data.dtypes))]).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: Path) -> str:
+    """Hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(_READ_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def code_fingerprint(func: Callable, modules: Iterable[ModuleType] = ()) -> str:
+    """Hex digest of the source code of `func` and `modules`, and the incognita version."""
+    while isinstance(func, functools.partial):
+        func = func.func
+    try:
+        version = importlib.metadata.version("incognita")
+    except importlib.metadata.PackageNotFoundError:
+        version = "unknown"
+    return fingerprint(version, inspect.getsource(func), *(inspect.getsource(module) for module in modules))
+
+
+class Stage:
+    """A cached pipeline stage. Call it to get its output."""
+
+    def __init__(self, cache: StageCache, name: str, func: Callable[..., pd.DataFrame], upstream: tuple[Stage, ...], key: str):
+        self.cache = cache
+        self.name = name
+        self.func = func
+        self.upstream = upstream
+        self.key = key
+
+    def __call__(self) -> pd.DataFrame:
+        return self.cache.get_or_compute(self)
+
+
+class StageCache:
+    """Cache of stage outputs in a directory.
+
+    Attributes:
+        reused: Names of stages loaded from the cache in this run
+        computed: Names of stages computed in this run
+
+    """
+
+    def __init__(self, directory: Path, enabled: bool = True):
+        """Creates a stage cache.
+
+        Args:
+            directory: Directory for cached outputs, created if needed
+            enabled: If False, every stage is computed and nothing is cached
+
+        """
+        self.directory = Path(directory)
+        self.enabled = enabled
+        self.reused: list[str] = []
+        self.computed: list[str] = []
+
+    def stage(self, name: str, func: Callable[..., pd.DataFrame], *upstream: Stage, inputs: Iterable[object] = (), code: Iterable[ModuleType] = ()) -> Stage:
+        """Defines a stage.
+
+        Args:
+            name: Name of the stage, unique within the cache
+            func: Function computing the stage's output, called with the outputs of `upstream`
+            upstream: Stages whose outputs are passed to `func`
+            inputs: Other inputs the output depends on, e.g. settings or file fingerprints
+            code: Modules `func` depends on, beyond its own source code
+
+        """
+        key = fingerprint(name, code_fingerprint(func, code), [stage.key for stage in upstream], list(inputs))
+        return Stage(self, name, func, upstream, key)
+
+    def get_or_compute(self, stage: Stage) -> pd.DataFrame:
+        """Loads the output of a stage from the cache, or computes (and caches) it."""
+        path = self.directory / f"{_file_name(stage.name)}-{stage.key[:16]}.feather"
+        if self.enabled and path.is_file():
+            logger.info(f"Reusing cached {stage.name} stage ({path.name})")
+            self.reused.append(stage.name)
+            return feather.read_feather(path)
+
+        data = stage.func(*(upstream() for upstream in stage.upstream))
+        self.computed.append(stage.name)
+        if self.enabled:
+            self._write(data, path, stage.name)
+        return data
+
+    def report(self) -> str:
+        """Summary of the stages reused and computed in this run."""
+        return f"Stages reused from cache: {', '.join(self.reused) or 'none'}. Stages computed: {', '.join(self.computed) or 'none'}."
+
+    def _write(self, data: pd.DataFrame, path: Path, name: str) -> None:
+        _write_atomic(data, path)
+        for stale_path in self.directory.glob(f"{_file_name(name)}-*.feather"):
+            if stale_path != path:
+                stale_path.unlink(missing_ok=True)
+
+
+class BoundedCache:
+    """Cache of DataFrames in a directory, keyed by fingerprint, bounded in total size.
+
+    Entries are feather files named by their key. Reading an entry marks it
+    as recently used (by its modification time), and writing an entry removes
+    the least recently used entries until the directory is within `max_bytes`.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, enabled: bool = True):
+        """Creates a bounded cache.
+
+        Args:
+            directory: Directory for cached entries, created if needed
+            max_bytes: Total size of entries kept
+            enabled: If False, nothing is read from or written to the cache
+
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        """Loads the entry for `key`, or None if there isn't one."""
+        path = self._path(key)
+        if not self.enabled or not path.is_file():
+            return None
+        logger.info(f"Reusing cached {path.name}")
+        path.touch()  # most recently used
+        return feather.read_feather(path)
+
+    def put(self, key: str, data: pd.DataFrame) -> None:
+        """Saves the entry for `key`, then removes the least recently used entries beyond the size bound."""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        _write_atomic(data, path)
+        entries = sorted(((entry.stat(), entry) for entry in self.directory.glob("*.feather")), key=lambda stat_entry: stat_entry[0].st_mtime_ns, reverse=True)
+        total_bytes = 0
+        for stat, entry in entries:
+            total_bytes += stat.st_size
+            if total_bytes > self.max_bytes and entry != path:
+                logger.debug(f"Removing least recently used cache entry {entry.name}")
+                entry.unlink(missing_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key[:32]}.feather"
+
+
+def _write_atomic(data: pd.DataFrame, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f"{path.name}.tmp")
+    feather.write_feather(data, temporary_path)
+    os.replace(temporary_path, path)  # atomic, so readers never see a partial file
+
+
+def _file_name(name: str) -> str:
+    return name.replace(" ", "_")
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import functools
+
+import numpy as np
+import pandas as pd
+
+
+def concat(frames: list[pd.DataFrame], sort_categories: bool = False) -> pd.DataFrame:
+    """Concatenates frames, keeping categorical columns categorical.
+
+    `pd.concat` falls back to object dtype when the categories of a column
+    differ between frames, so the categories are unified first. Integer
+    columns typed differently between frames (e.g. int8 and nullable Int16)
+    are cast to their common type first too, which `pd.concat` does slowly
+    through object values.
+
+    Args:
+        frames: DataFrames with the same columns
+        sort_categories: If True, sort the unified categories lexically
+
+    """
+    if not frames:
+        return pd.DataFrame()
+    frames = [frame.copy(deep=False) for frame in frames]  # don't modify the passed frames
+    for col, dtype in frames[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            unified = functools.reduce(lambda left, right: left.union(right, sort=False), [frame[col].cat.categories for frame in frames])
+            unified = unified.sort_values() if sort_categories else unified
+            for frame in frames:
+                frame[col] = frame[col].cat.set_categories(unified)
+        elif all(pd.api.types.is_integer_dtype(frame[col].dtype) for frame in frames) and len({frame[col].dtype for frame in frames}) > 1:
+            common_type = _common_integer_type([frame[col].dtype for frame in frames])
+            for frame in frames:
+                frame[col] = _as_integer_type(frame[col], common_type)
+    return pd.concat(frames)
+
+
+def _common_integer_type(dtypes: list) -> object:
+    """Integer type holding the values of all `dtypes`, nullable if any of them are."""
+    common_type = np.result_type(*[getattr(dtype, "numpy_dtype", dtype) for dtype in dtypes])
+    if common_type.kind not in "iu":  # e.g. int64 and uint64
+        return np.dtype(np.float64)
+    if any(isinstance(dtype, pd.api.extensions.ExtensionDtype) for dtype in dtypes):
+        return pd.api.types.pandas_dtype(f"{'UInt' if common_type.kind == 'u' else 'Int'}{common_type.itemsize * 8}")
+    return common_type
+
+
+def _as_integer_type(series: pd.Series, dtype: object) -> pd.Series:
+    """Casts integer `series` to `dtype`, building nullable arrays directly (`astype` checks each value for NA)."""
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and not isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        values = series.to_numpy(dtype=dtype.numpy_dtype)
+        return pd.Series(dtype.construct_array_type()(values, np.zeros(len(values), dtype=bool)), index=series.index, name=series.name)
+    return series.astype(dtype)
+
+
+def sort_categories(data: pd.DataFrame) -> pd.DataFrame:
+    """Sorts the categories of every categorical column lexically (as `pd.read_csv` would)."""
+    for col, dtype in data.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            data[col] = data[col].cat.reorder_categories(sorted(dtype.categories))
+    return data
+
+
+def tidy_categories(data: pd.DataFrame) -> pd.DataFrame:
+    """Removes unused categories and sorts categories, so they don't depend on the order records were read in."""
+    for col, dtype in data.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            data[col] = data[col].cat.remove_unused_categories()
+    return sort_categories(data)
@@ -9,6 +9,7 @@ import pydantic
 import pydantic.validators
 import toml
 
+from incognita.utility import archives
 from incognita.utility import root
 
 if TYPE_CHECKING:
@@ -43,6 +44,24 @@ class ProjectGeneratedPath(pydantic.FilePath):
             yield concretise_path  # does not check existence
 
 
+def path_exists_or_archived(value: Path) -> Path:
+    """Check the path exists, either on disk or within a zip archive (see incognita.utility.archives)."""
+    if not archives.exists(value):
+        raise pydantic.errors.PathNotExistsError(path=value)
+    return value
+
+
+# For files or directories that can be read from the zip archive they are distributed in
+class ProjectArchivePath(Path):
+    @classmethod
+    def __get_validators__(cls) -> pydantic.typing.CallableGenerator:
+        if os.getenv("CI"):  # CI doesn't have files in incognita-config.toml
+            yield pydantic.validators.path_validator
+        else:
+            yield concretise_path
+            yield path_exists_or_archived
+
+
 class ProjectDirectoryPath(pydantic.DirectoryPath):
     @classmethod
     def __get_validators__(cls) -> pydantic.typing.CallableGenerator:
@@ -56,20 +75,24 @@ class ProjectDirectoryPath(pydantic.DirectoryPath):
 class CensusPaths(pydantic.BaseModel):
     original: ProjectFilePath
     merged: ProjectGeneratedPath
+    memory_mapped: ProjectGeneratedPath  # uncompressed Arrow copy of the merged data, for memory-mapping
 
 
 class ONSPostcodeDirectoryPaths(pydantic.BaseModel):
-    full: ProjectFilePath
+    full: ProjectArchivePath  # csv file, or the csv file within the release zip archive
     reduced: ProjectGeneratedPath
     minified: ProjectGeneratedPath
+    index: ProjectGeneratedPath  # postcode index, see incognita.data.postcode_index
+    codes: ProjectGeneratedPath  # shared ONS code dictionary, see incognita.data.ons_codes
     # reduced_nystest: ProjectFilePath
 
 
 class FolderPaths(pydantic.BaseModel):
-    ons_pd_names_codes: ProjectDirectoryPath  # Folder within the ONS Postcode Directory archive holding names and codes files
+    ons_pd_names_codes: ProjectArchivePath  # Folder within the ONS Postcode Directory archive holding names and codes files
     national_statistical: ProjectDirectoryPath  # Folder for national statistical data (age profiles etc)
     boundaries: ProjectDirectoryPath  # Folder with all shapefiles
     output: ProjectDirectoryPath  # Folder for generated files
+    cache: ProjectGeneratedPath  # Folder for cached pipeline stage outputs, see incognita.utility.cache
 
 
 class BoundaryCodes(pydantic.BaseModel):
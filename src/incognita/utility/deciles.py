@@ -24,7 +24,8 @@ def calc_imd_decile(imd_ranks: pd.Series, country_codes: pd.Series, ons_object:
 
     # One of the two series must be of a 'normal' int dtype - excluding the new ones that can deal with NAs
     imd_max = _try_downcast(imd_max)
-    imd_ranks = _try_downcast(imd_ranks)
+    # Ranks are cast to a signed type first, as negating unsigned (e.g. UInt16) ranks overflows
+    imd_ranks = _try_downcast(imd_ranks.astype("Int32"))
 
     if not imd_max.empty:
         # upside down floor division to get ceiling
@@ -0,0 +1,123 @@
+"""Data type planning
+
+Picks the narrowest data type that holds every value of each column of a
+DataFrame, from a profile of the column's values:
+- integers take the smallest signed integer type covering their range (e.g.
+  int8 for counts below 128), nullable only if there are missing values.
+  Unsigned types are never used, as differences of them wrap round
+- floats are stored as float32 if every value is exactly representable
+- text columns of ISO dates (YYYY-MM-DD) are stored as dates, and other text
+  columns with few distinct values as categorical columns
+- booleans are only nullable if there are missing values
+
+Categorical columns are kept as they are, as are columns of other types.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+CATEGORY_MAX_RATIO = 0.5  # text columns with at most this many distinct values per value are categorical
+DATE_FORMAT = "%Y-%m-%d"
+
+# Integer types, narrowest first
+_INTEGER_TYPES = [np.dtype(dtype) for dtype in ("int8", "int16", "int32", "int64")]
+_NULLABLE_TYPES = {np.dtype("int8"): pd.Int8Dtype(), np.dtype("int16"): pd.Int16Dtype(), np.dtype("int32"): pd.Int32Dtype(), np.dtype("int64"): pd.Int64Dtype()}
+
+
+def plan_data_types(data: pd.DataFrame) -> dict[str, object]:
+    """Finds the narrowest data type for each column of `data`.
+
+    Args:
+        data: Data to profile
+
+    Returns:
+        Mapping of column name to planned data type, for every column
+
+    """
+    return {col: _plan_column(data[col]) for col in data.columns}
+
+
+def apply_data_types(data: pd.DataFrame, plan: dict[str, object]) -> pd.DataFrame:
+    """Converts columns of `data` to their planned data types (see `plan_data_types`)."""
+    for col, dtype in plan.items():
+        if data[col].dtype == dtype:
+            continue
+        if pd.api.types.is_datetime64_dtype(dtype) and not pd.api.types.is_datetime64_dtype(data[col].dtype):
+            data[col] = pd.to_datetime(data[col], format=DATE_FORMAT)
+        else:
+            data[col] = data[col].astype(dtype)
+    return data
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """Compares the data types and memory use of each column.
+
+    Args:
+        before: Data before converting data types
+        after: Data after converting data types
+
+    Returns:
+        DataFrame indexed by column, with data types and memory use (bytes) before and after, and a total row
+
+    """
+    report = pd.DataFrame(
+        {
+            "type before": before.dtypes.astype(str),
+            "type after": after.dtypes.astype(str),
+            "bytes before": before.memory_usage(index=False, deep=True),
+            "bytes after": after.memory_usage(index=False, deep=True),
+        }
+    )
+    report.loc["Total"] = ["", "", report["bytes before"].sum(), report["bytes after"].sum()]
+    return report
+
+
+def _plan_column(series: pd.Series) -> object:
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return dtype
+    has_missing = bool(series.isna().any())
+    if pd.api.types.is_bool_dtype(dtype):
+        return pd.BooleanDtype() if has_missing else np.dtype(bool)
+    if pd.api.types.is_integer_dtype(dtype):
+        return _plan_integer(series, has_missing)
+    if pd.api.types.is_float_dtype(dtype):
+        return _plan_float(series)
+    if pd.api.types.is_object_dtype(dtype):
+        return _plan_text(series)
+    return dtype
+
+
+def _plan_integer(series: pd.Series, has_missing: bool) -> object:
+    if series.notna().any():
+        low, high = int(series.min()), int(series.max())
+    else:
+        low = high = 0
+    for dtype in _INTEGER_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return _NULLABLE_TYPES[dtype] if has_missing else dtype
+    return series.dtype
+
+
+def _plan_float(series: pd.Series) -> object:
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    narrowed = values.astype(np.float32)
+    exact = (narrowed == values) | np.isnan(values)  # overflow to inf is not exact
+    return np.dtype(np.float32) if exact.all() else series.dtype
+
+
+def _plan_text(series: pd.Series) -> object:
+    codes, uniques = pd.factorize(series)  # each distinct value is only profiled once
+    if uniques.size == 0:
+        return series.dtype
+    # Text dates, or a mix of text dates and dates (e.g. from concatenating planned and unplanned data)
+    if all(isinstance(value, (str, pd.Timestamp)) for value in uniques):
+        dates = pd.to_datetime(pd.Series(uniques, dtype=object), format=DATE_FORMAT, errors="coerce")
+        if dates.notna().all():
+            return np.dtype("datetime64[ns]")
+    if uniques.size <= CATEGORY_MAX_RATIO * (codes != -1).sum():
+        return pd.CategoricalDtype()
+    return series.dtype
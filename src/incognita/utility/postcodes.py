@@ -0,0 +1,169 @@
+"""Postcode normalisation
+
+Normalises free-text postcodes to the seven character format used as the
+index of the ONS Postcode Directory (e.g. "AB1 2CD", "AB12 3CD", "AB123CD").
+
+The normalisation is a single vectorised kernel over the unique postcodes,
+which are held as a matrix of unicode code points:
+- characters are mapped through a lookup table, which upper-cases letters,
+  maps shifted digits (e.g. "!" -> "1") to their digits, and marks everything
+  else (whitespace, punctuation etc.) for removal
+- kept characters are compacted to the left of each row
+- five and six character postcodes are padded to seven characters by
+  inserting spaces before the inward code (the last three characters)
+
+Normalised postcodes are packed into integer keys (`encode`) for joining,
+sorting and grouping. Each of the seven characters is a base 37 digit (space,
+then digits, then letters), so keys sort in the same order as the postcodes.
+`decode` unpacks keys to postcodes.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+POSTCODE_LENGTH = 7  # Length of postcodes in the ONS Postcode Directory 'pcd' field
+INWARD_CODE_LENGTH = 3  # e.g. "2CD" in "AB1 2CD"
+_SHIFTED_DIGITS = {'"': "2", "£": "3", "$": "4", "%": "5", "^": "6", "&": "7", "*": "8", "(": "9", ")": "0", "!": "1"}
+# TODO: add macOS shift -> numbers conversion
+
+KEY_ALPHABET = " 0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"  # in code point order, so keys sort as postcodes do
+KEY_TYPE = np.dtype(np.uint64)
+INVALID_KEY = np.iinfo(KEY_TYPE).max  # key of values which are not seven character normalised postcodes
+_KEY_BASE = len(KEY_ALPHABET)
+_KEY_PLACES = KEY_TYPE.type(_KEY_BASE) ** np.arange(POSTCODE_LENGTH - 1, -1, -1, dtype=KEY_TYPE)  # 37**6 ... 37**0
+_INVALID_DIGIT = 255
+
+
+def _build_character_map() -> np.ndarray:
+    """Lookup table from code point (< 256) to normalised code point. Zero marks characters to remove."""
+    character_map = np.zeros(256, dtype=np.uint32)
+    for char in "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ":
+        character_map[ord(char)] = ord(char)
+    for char in "abcdefghijklmnopqrstuvwxyz":
+        character_map[ord(char)] = ord(char.upper())
+    for shifted, digit in _SHIFTED_DIGITS.items():
+        character_map[ord(shifted)] = ord(digit)
+    return character_map
+
+
+def _build_digit_map() -> np.ndarray:
+    """Lookup table from code point (< 256) to base 37 key digit, `_INVALID_DIGIT` for characters not in postcodes."""
+    digit_map = np.full(256, _INVALID_DIGIT, dtype=np.uint8)
+    digit_map[[ord(char) for char in KEY_ALPHABET]] = np.arange(_KEY_BASE)
+    return digit_map
+
+
+_CHARACTER_MAP = _build_character_map()
+_DIGIT_MAP = _build_digit_map()
+
+
+def normalise(postcodes: pd.Series) -> pd.Series:
+    """Normalises postcodes to the ONS Postcode Directory format.
+
+    Removes whitespace and non-alphanumeric characters (keeping shifted
+    numbers, which are replaced with their number equivalents), converts to
+    upper case, and pads five and six character postcodes to seven.
+
+    Args:
+        postcodes: pandas series of postcodes (object or categorical)
+
+    Returns:
+        Series of normalised postcodes (object dtype), missing values are kept
+
+    """
+    codes, uniques = pd.factorize(postcodes, sort=False)
+    normalised_uniques = _normalise_unique(np.asarray(uniques, dtype=object))
+    normalised = np.full(codes.size, np.nan, dtype=object)
+    normalised[codes != -1] = normalised_uniques[codes[codes != -1]]
+    return pd.Series(normalised, index=postcodes.index, name=postcodes.name, dtype=object)
+
+
+def _normalise_unique(values: np.ndarray) -> np.ndarray:
+    """Normalisation kernel. Takes and returns object arrays, with non-strings returned as NaN."""
+    if pd.api.types.infer_dtype(values, skipna=False) == "string":
+        is_str = np.ones(values.size, dtype=bool)
+    else:
+        is_str = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=values.size)
+    out = np.full(values.size, np.nan, dtype=object)
+    if not is_str.any():
+        return out
+
+    # Unicode strings as a (n, width) matrix of code points, with unused positions zero
+    strings = values[is_str].astype(str)
+    width = max(strings.dtype.itemsize // 4, 1)
+    code_points = strings.astype(f"<U{width}").view(np.uint32).reshape(strings.size, width)
+
+    # Map characters. Non-ASCII decimal digits are kept unchanged to match `re`'s `\d`
+    mapped = _CHARACTER_MAP[np.minimum(code_points, 255)]
+    wide = code_points > 255
+    if wide.any():
+        wide_chars = np.unique(code_points[wide])
+        decimals = wide_chars[[chr(code_point).isdecimal() for code_point in wide_chars]]
+        mapped[wide] = np.where(np.isin(code_points[wide], decimals), code_points[wide], 0)
+
+    # Remove characters by compacting kept characters to the left
+    keep = mapped != 0
+    lengths = keep.sum(axis=1)
+    rows, cols = np.nonzero(keep)
+    compacted = np.zeros((strings.size, max(width, POSTCODE_LENGTH)), dtype=np.uint32)
+    compacted[rows, np.cumsum(keep, axis=1)[rows, cols] - 1] = mapped[rows, cols]
+
+    # Pad to seven characters by moving the inward code to the end and filling the gap with spaces
+    for length in (POSTCODE_LENGTH - 1, POSTCODE_LENGTH - 2):
+        to_pad = lengths == length
+        outward_length = length - INWARD_CODE_LENGTH
+        compacted[to_pad, POSTCODE_LENGTH - INWARD_CODE_LENGTH : POSTCODE_LENGTH] = compacted[to_pad, outward_length:length]
+        compacted[to_pad, outward_length : POSTCODE_LENGTH - INWARD_CODE_LENGTH] = ord(" ")
+
+    out[is_str] = compacted.view(f"<U{compacted.shape[1]}").ravel().astype(object)
+    return out
+
+
+def encode(postcodes: pd.Series | pd.Index | np.ndarray) -> np.ndarray:
+    """Packs normalised postcodes into integer keys.
+
+    Args:
+        postcodes: Normalised postcodes (see `normalise`), object or categorical
+
+    Returns:
+        uint64 array of keys, `INVALID_KEY` where a value isn't a seven
+        character postcode of spaces, digits and upper case letters (including
+        missing values)
+
+    """
+    codes, uniques = pd.factorize(postcodes, sort=False)  # each distinct postcode is packed once
+    unique_keys = np.append(_encode_unique(np.asarray(uniques, dtype=object)), INVALID_KEY)  # missing values have code -1
+    return unique_keys[codes]
+
+
+def decode(keys: np.ndarray) -> np.ndarray:
+    """Unpacks integer keys (see `encode`) to postcodes.
+
+    Args:
+        keys: Postcode keys
+
+    Returns:
+        Object array of postcodes, NaN for `INVALID_KEY`
+
+    """
+    keys = np.asarray(keys, dtype=KEY_TYPE)
+    is_key = keys != INVALID_KEY
+    digits = (keys[is_key, np.newaxis] // _KEY_PLACES) % KEY_TYPE.type(_KEY_BASE)
+    code_points = np.frombuffer(KEY_ALPHABET.encode("ascii"), dtype=np.uint8).astype(np.uint32)[digits]
+    out = np.full(keys.size, np.nan, dtype=object)
+    out[is_key] = np.ascontiguousarray(code_points).view(f"<U{POSTCODE_LENGTH}").ravel().astype(object)
+    return out
+
+
+def _encode_unique(values: np.ndarray) -> np.ndarray:
+    """Packing kernel. Takes an object array, returns a uint64 array."""
+    is_key = np.fromiter((isinstance(value, str) and len(value) == POSTCODE_LENGTH for value in values), dtype=bool, count=values.size)
+    code_points = values[is_key].astype(f"<U{POSTCODE_LENGTH}").view(np.uint32).reshape(-1, POSTCODE_LENGTH)
+    digits = _DIGIT_MAP[np.minimum(code_points, 255)]
+    in_alphabet = (code_points < 256).all(axis=1) & (digits != _INVALID_DIGIT).all(axis=1)
+
+    keys = np.full(values.size, INVALID_KEY, dtype=KEY_TYPE)
+    keys[np.flatnonzero(is_key)[in_alphabet]] = digits[in_alphabet].astype(KEY_TYPE) @ _KEY_PLACES
+    return keys
@@ -27,3 +27,39 @@ def test_add_shape_data_merge(blank_geo_data_frame: gpd.GeoDataFrame, data: pd.D
     joined = gpd.sjoin(points_data, blank_geo_data_frame, how="left", op="intersects")
     merged = data.merge(joined[["id"]], how="left", left_index=True, right_index=True)
     assert new_data.equals(merged)
+
+
+def test_add_shape_data_projected_shapes():
+    shapes = gpd.GeoDataFrame(
+        {"id": ["A", "B"]},
+        geometry=gpd.GeoSeries.from_wkt(["POLYGON ((0 0, 10 0, 10 10, 0 10, 0 0))", "POLYGON ((10 0, 20 0, 20 10, 10 10, 10 0))"], crs=constants.WGS_84).to_crs(constants.BNG),
+        crs=constants.BNG,
+    )
+    census_data = pd.DataFrame({"long": [5.0, 15.0, 5.0, 25.0, 15.0], "lat": [5.0, 5.0, 5.0, 5.0, 5.0]}, index=[10, 11, 12, 13, 14])
+    new_data, new_points = add_shape_data.add_shape_data(census_data, "id", gdf=shapes)
+
+    assert new_data.index.equals(census_data.index)
+    assert new_data["id"].fillna("").tolist() == ["A", "B", "A", "", "B"]
+    assert new_points.crs == constants.WGS_84 and new_points["object_index"].tolist() == [10, 11, 12, 13, 14]
+
+
+def test_boundary_codes_use_coordinates_in_shapes_crs():
+    shapes = gpd.GeoDataFrame(
+        {"id": ["A", "B"]},
+        geometry=gpd.GeoSeries.from_wkt(
+            [
+                "POLYGON ((400000 100000, 410000 100000, 410000 110000, 400000 110000, 400000 100000))",
+                "POLYGON ((410000 100000, 420000 100000, 420000 110000, 410000 110000, 410000 100000))",
+            ]
+        ),
+        crs=constants.BNG,
+    )
+    bng = pd.DataFrame({"oseast1m": [405000.0, 415000.0, 425000.0, 405000.0], "osnrth1m": [105000.0, 105000.0, 105000.0, 105000.0]}, index=[3, 5, 7, 9])
+    wgs_84 = gpd.GeoSeries(gpd.points_from_xy(bng["oseast1m"], bng["osnrth1m"]), index=bng.index, crs=constants.BNG).to_crs(constants.WGS_84)
+    located = bng.assign(long=wgs_84.x, lat=wgs_84.y)
+
+    from_bng = add_shape_data.boundary_codes(located, shapes, "id")
+    from_wgs_84 = add_shape_data.boundary_codes(located[["lat", "long"]], shapes, "id")
+    assert from_bng.index.equals(bng.index)
+    assert from_bng.fillna("").tolist() == ["A", "B", "", "A"]
+    pd.testing.assert_series_equal(from_bng, from_wgs_84)
@@ -0,0 +1,39 @@
+import zipfile
+
+import pandas as pd
+import pytest
+
+from incognita.data import ons_pd_reader
+from incognita.data.ons_pd import ONS_POSTCODE_DIRECTORY_MAY_20 as ONS_PD
+from incognita.utility import archives
+
+CSV = "pcd,ctry,imd,unused\nAB1 0AA,S92000003,100,x\nM1  1AA,E92000001,20000,y\nCF101AA,W92000004,,z\n"
+
+
+@pytest.fixture
+def release(tmp_path):
+    (tmp_path / "ONSPD.csv").write_text(CSV)
+    with zipfile.ZipFile(tmp_path / "ONSPD.zip", "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("Data/ONSPD.csv", CSV)
+    return tmp_path
+
+
+def test_paths_in_archive(release):
+    archive = release / "ONSPD.zip"
+    assert archives.split_archive_path(archive / "Data/ONSPD.csv") == (archive, "Data/ONSPD.csv")
+    assert archives.split_archive_path(release / "ONSPD.csv") is None
+    assert archives.exists(archive / "Data") and archives.exists(archive / "Data/ONSPD.csv")
+    assert not archives.exists(archive / "Documents")
+
+    with archives.open_file(archive / "Data/ONSPD.csv") as file:
+        assert file.read().decode() == CSV
+    with pytest.raises(FileNotFoundError):
+        archives.open_file(archive / "Data/missing.csv")
+
+
+def test_stream_postcode_directory_from_archive(release):
+    columns = ["pcd", "ctry", "imd_decile"]
+    extracted = pd.concat(ons_pd_reader.stream_postcode_directory(ONS_PD, columns, release / "ONSPD.csv", block_size=32))
+    archived = pd.concat(ons_pd_reader.stream_postcode_directory(ONS_PD, columns, release / "ONSPD.zip/Data/ONSPD.csv", block_size=32))
+    pd.testing.assert_frame_equal(archived, extracted)
+    assert archived["pcd"].tolist() == ["AB1 0AA", "M1  1AA", "CF101AA"]
@@ -0,0 +1,84 @@
+import numpy as np
+import pygeos
+import pytest
+
+from incognita.geographies.boundary_simplification import simplify_coverage
+
+# a wiggly edge shared by two areas, with a hole in the first area filled by a third
+SHARED_EDGE = [(10 + (0.3 if i % 2 else 0), y) for i, y in enumerate(range(0, 101, 5))]
+AREAS = np.array(
+    [
+        pygeos.polygons([(0, 0), *SHARED_EDGE, (0, 100), (0, 0)], holes=[[(3, 40), (3, 60), (6, 60), (6, 40), (3, 40)]]),
+        pygeos.polygons([*SHARED_EDGE, (20, 100), (20, 0), SHARED_EDGE[0]]),
+        pygeos.polygons([(3, 40), (6, 40), (6, 60), (3, 60), (3, 40)]),
+        pygeos.multipolygons([pygeos.polygons([(30, 0), (31, 0), (31, 1), (30, 0)]), pygeos.polygons([(40, 0), (50, 0), (50, 10), (45, 10.2), (40, 10), (40, 0)])]),
+    ]
+)
+
+# an edge which a coarse tolerance straightens through a hole (and the enclave filling it) in the area below it
+SPIKED_EDGE = [(0, 0), (25, -1), (45, -8), (50, 10), (55, -8), (75, 1), (100, 0)]
+ENCLAVE = [(49, -1), (51, -1), (51, 1), (49, 1), (49, -1)]
+SPIKED_AREAS = np.array(
+    [
+        pygeos.polygons([*SPIKED_EDGE, (100, -20), (0, -20), (0, 0)], holes=[ENCLAVE]),
+        pygeos.polygons([*SPIKED_EDGE, (100, 20), (0, 20), (0, 0)]),
+        pygeos.polygons(ENCLAVE),
+    ]
+)
+
+# an edge which a coarse tolerance straightens past an enclave, without touching it
+PEAKED_EDGE = [(0, 0), (40, 0), (50, 10), (60, 0), (100, 0)]
+PASSED_ENCLAVE = [(49, 3), (51, 3), (51, 5), (49, 5), (49, 3)]
+PEAKED_AREAS = np.array(
+    [
+        pygeos.polygons([*PEAKED_EDGE, (100, -20), (0, -20), (0, 0)], holes=[PASSED_ENCLAVE]),
+        pygeos.polygons([*PEAKED_EDGE, (100, 20), (0, 20), (0, 0)]),
+        pygeos.polygons(PASSED_ENCLAVE),
+    ]
+)
+
+
+def test_shared_edges_stay_shared():
+    simplified = simplify_coverage(AREAS, 1.0)
+    assert pygeos.is_valid(simplified).all()
+    assert (pygeos.get_type_id(simplified) == pygeos.get_type_id(AREAS)).all()
+    assert pygeos.get_num_coordinates(simplified)[1] < pygeos.get_num_coordinates(AREAS)[1]
+
+    # no gaps or overlaps between the neighbouring areas
+    assert pygeos.area(pygeos.union_all(simplified[:3])) == pygeos.area(pygeos.union_all(AREAS[:3]))
+    assert pygeos.area(pygeos.intersection(simplified[0], simplified[1])) == 0
+    assert pygeos.area(pygeos.intersection(simplified[0], simplified[2])) == 0
+
+
+def test_small_rings_are_kept():
+    simplified = simplify_coverage(AREAS, 1.0)
+    assert pygeos.get_num_geometries(simplified[3]) == 2
+    assert pygeos.equals(pygeos.get_geometry(simplified[3], 0), pygeos.get_geometry(AREAS[3], 0))
+    assert pygeos.equals(simplified[2], AREAS[2])
+
+
+def test_simplified_arcs_do_not_cross():
+    simplified = simplify_coverage(SPIKED_AREAS, 12.0)
+    assert pygeos.is_valid(simplified).all()
+    assert pygeos.get_num_coordinates(simplified[0]) < pygeos.get_num_coordinates(SPIKED_AREAS[0])
+
+    assert pygeos.area(pygeos.union_all(simplified)) == pygeos.area(pygeos.union_all(SPIKED_AREAS))
+    for first, second in [(0, 1), (0, 2), (1, 2)]:
+        assert pygeos.area(pygeos.intersection(simplified[first], simplified[second])) == 0
+
+
+def test_areas_do_not_overlap_after_passing_an_enclave():
+    simplified = simplify_coverage(PEAKED_AREAS, 12.0)
+    assert pygeos.is_valid(simplified).all()
+    assert pygeos.area(pygeos.union_all(simplified)) == pygeos.area(pygeos.union_all(PEAKED_AREAS))
+    for first, second in [(0, 1), (0, 2), (1, 2)]:
+        assert pygeos.area(pygeos.intersection(simplified[first], simplified[second])) == 0
+
+
+@pytest.mark.parametrize("missing", [pygeos.Geometry("POLYGON EMPTY"), None])
+def test_empty_and_missing_geometries_are_kept(missing):
+    areas = np.array([AREAS[0], missing, AREAS[1]], dtype=object)
+    simplified = simplify_coverage(areas, 1.0)
+
+    assert pygeos.equals(simplified[[0, 2]], simplify_coverage(AREAS[:2], 1.0)).all()
+    assert simplified[1] is None if missing is None else pygeos.is_empty(simplified[1])
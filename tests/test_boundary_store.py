@@ -0,0 +1,55 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+
+from incognita.data import boundary_store
+from incognita.utility import config
+from incognita.utility import constants
+
+
+@pytest.fixture
+def boundary_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(config.SETTINGS.folders, "cache", tmp_path / "cache")
+    path = tmp_path / "areas.geojson"
+    path.write_text("{}")  # only the file's size and modification time key the store
+    shapes = gpd.GeoDataFrame(
+        {"code": ["A", "B"]},
+        geometry=gpd.GeoSeries.from_wkt(["POLYGON ((-1 51, -1 52, 0 52, 0 51, -1 51))", "POLYGON ((0 51, 1 52, 1 51, 0 52, 0 51))"]),  # B is a bowtie, so invalid
+        crs=constants.WGS_84,
+    )
+    boundary_store.save_boundary(shapes, path)
+    return path
+
+
+def test_boundaries_are_stored_projected_and_repaired(boundary_path):
+    wgs_84 = boundary_store.load_boundary(boundary_path)
+    bng = boundary_store.load_boundary(boundary_path, crs=constants.BNG)
+    assert wgs_84.crs.to_epsg() == constants.WGS_84 and bng.crs.to_epsg() == constants.BNG
+    assert wgs_84["code"].tolist() == bng["code"].tolist() == ["A", "B"]
+    assert wgs_84.is_valid.all() and bng.is_valid.all()
+    assert bng.geometry.iloc[0].bounds[0] > 100_000  # eastings, not degrees
+
+    hits = boundary_store._read_store.cache_info().hits
+    again = boundary_store.load_boundary(boundary_path).rename(columns={"code": "renamed"})
+    assert boundary_store._read_store.cache_info().hits == hits + 1  # memoised, not read again
+    assert "code" in boundary_store.load_boundary(boundary_path) and again.geometry.equals(wgs_84.geometry)
+    with pytest.raises(ValueError):
+        boundary_store.load_boundary(boundary_path, crs=3857)
+
+
+def test_changed_boundary_files_are_stored_again(boundary_path):
+    first_paths = boundary_store._store_paths(boundary_path)
+    boundary_path.write_text('{"changed": true}')
+    second_paths = boundary_store._store_paths(boundary_path)
+    assert first_paths.keys() == second_paths.keys() and all(first_paths[level] != second_paths[level] for level in first_paths)
+
+    boundary_store.save_boundary(gpd.read_parquet(first_paths[constants.WGS_84, 0]), boundary_path)
+    assert sorted(path.name for path in second_paths[constants.WGS_84, 0].parent.iterdir()) == sorted(path.name for path in second_paths.values())
+
+
+def test_simplified_levels_are_chosen_by_precision(boundary_path):
+    full = boundary_store.load_boundary(boundary_path, crs=constants.BNG)
+    coarsest = boundary_store.load_boundary(boundary_path, crs=constants.BNG, precision=10_000)
+    assert boundary_store.load_boundary(boundary_path, crs=constants.BNG, precision=5).geometry.equals(full.geometry)
+    assert coarsest.is_valid.all() and coarsest["code"].tolist() == ["A", "B"]
+    assert np.allclose(coarsest.area, full.area, rtol=0.01)  # straight edges aren't moved
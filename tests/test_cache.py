@@ -0,0 +1,87 @@
+import functools
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from incognita.utility.cache import BoundedCache
+from incognita.utility.cache import file_fingerprint
+from incognita.utility.cache import fingerprint
+from incognita.utility.cache import StageCache
+
+
+def _load(calls: list[str], start: int) -> pd.DataFrame:
+    calls.append("load")
+    return pd.DataFrame({"count": pd.array([start, start + 1, None], dtype="Int16"), "name": pd.Categorical(["a", "b", "a"])})
+
+
+def _double(calls: list[str], data: pd.DataFrame) -> pd.DataFrame:
+    calls.append("double")
+    return data.assign(count=data["count"] * 2)
+
+
+def _stages(stage_cache: StageCache, calls: list[str], start: int = 1, setting: str = "x"):
+    loaded = stage_cache.stage("load", functools.partial(_load, calls, start), inputs=[start])
+    return stage_cache.stage("double", functools.partial(_double, calls), loaded, inputs=[setting])
+
+
+def test_stage_cache_reuses_unchanged_stages(tmp_path):
+    calls = []
+    first = _stages(StageCache(tmp_path), calls)()
+    assert calls == ["load", "double"]
+
+    stage_cache = StageCache(tmp_path)
+    second = _stages(stage_cache, calls)()
+    assert calls == ["load", "double"]  # nothing recomputed
+    assert stage_cache.reused == ["double"]
+    assert_frame_equal(second, first)
+
+
+def test_stage_cache_recomputes_changed_stages(tmp_path):
+    calls = []
+    _stages(StageCache(tmp_path), calls)()
+
+    calls.clear()
+    stage_cache = StageCache(tmp_path)
+    _stages(stage_cache, calls, setting="y")()
+    assert calls == ["double"]
+    assert stage_cache.reused == ["load"]
+
+    calls.clear()
+    data = _stages(StageCache(tmp_path), calls, start=5, setting="y")()
+    assert calls == ["load", "double"]  # upstream inputs change downstream keys
+    assert data["count"].tolist() == [10, 12, pd.NA]
+    assert len(list(tmp_path.glob("double-*.feather"))) == 1  # stale outputs are removed
+
+
+def test_stage_cache_disabled(tmp_path):
+    calls = []
+    _stages(StageCache(tmp_path, enabled=False), calls)()
+    _stages(StageCache(tmp_path, enabled=False), calls)()
+    assert calls == ["load", "double"] * 2
+    assert not any(tmp_path.iterdir())
+
+
+def test_file_fingerprint(tmp_path):
+    path = tmp_path / "extract.csv"
+    path.write_text("a,b\n1,2\n")
+    before = file_fingerprint(path)
+    assert file_fingerprint(path) == before
+    path.write_text("a,b\n1,3\n")
+    assert file_fingerprint(path) != before
+
+
+def test_bounded_cache_removes_least_recently_used(tmp_path):
+    data = pd.DataFrame({"code": ["a", "b", None] * 100})
+    first, second, third = fingerprint("first"), fingerprint("second"), fingerprint("third")
+    bounded_cache = BoundedCache(tmp_path, max_bytes=2**30)
+    assert bounded_cache.get(first) is None
+    bounded_cache.put(first, data)
+    entry_bytes = sum(path.stat().st_size for path in tmp_path.iterdir())
+
+    bounded_cache = BoundedCache(tmp_path, max_bytes=2 * entry_bytes)
+    bounded_cache.put(second, data)
+    assert_frame_equal(bounded_cache.get(first), data)  # first is now more recently used than second
+    bounded_cache.put(third, data)
+    assert bounded_cache.get(second) is None
+    assert bounded_cache.get(first) is not None and bounded_cache.get(third) is not None
+    assert not list(tmp_path.glob("*.tmp"))
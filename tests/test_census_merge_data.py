@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from incognita.data.postcode_index import build_postcode_index
+from incognita.data.postcode_index import PostcodeIndex
+from incognita.preprocessing import census_merge_data
+
+
+@pytest.fixture
+def postcode_index(tmp_path) -> PostcodeIndex:
+    valid_postcodes = ["AB1 0AA", "AB1 0AB", "AB1 0AC", "AB1 0AD", "AB1 0AE"]
+    build_postcode_index(pd.DataFrame({"lat": np.zeros(5, dtype=np.float32)}, index=valid_postcodes), tmp_path / "postcode index.arrow")
+    return PostcodeIndex(tmp_path / "postcode index.arrow")
+
+
+def test_try_fix_invalid_postcodes(postcode_index: PostcodeIndex):
+    # fmt: off
+    census_data = pd.DataFrame([
+        # type, compass, G_ID, D_ID, Census_ID, clean_postcode
+        ("Colony", "S1", 1, 1, 1, "INVALID"),  # section: from S1's latest valid postcode
+        ("Colony", "S1", 1, 1, 2, "AB1 0AA"),
+        ("Colony", "S1", 1, 1, 3, "AB1 0AB"),
+        ("Pack", "S2", 1, 1, 3, np.nan),  # group-section: from the first section in group 1
+        ("Unit", "S3", pd.NA, 1, 3, "INVALID"),  # district-section: from the first district section in district 1
+        ("Network", "S4", pd.NA, 1, 3, "AB1 0AC"),
+        ("Group", "G1", 1, 1, 1, "INVALID"),  # pre 2017: from the group's later valid postcode
+        ("Group", "G1", 1, 1, 2, "AB1 0AD"),
+        ("District", "D1", pd.NA, 1, 1, "INVALID"),  # no valid postcodes for D1, not fixed
+        ("Other", "O1", 1, 1, 1, "INVALID"),  # type not fixed
+    ], columns=["type", "compass", "G_ID", "D_ID", "Census_ID", "clean_postcode"])
+    # fmt: on
+    census_data = census_data.astype({"type": "category", "compass": "category", "G_ID": "Int32", "D_ID": "Int32", "Census_ID": "Int16"})
+
+    fixed_data, summary = census_merge_data._try_fix_invalid_postcodes(census_data, postcode_index)
+
+    expected = ["AB1 0AB", "AB1 0AA", "AB1 0AB", "AB1 0AB", "AB1 0AC", "AB1 0AC", "AB1 0AD", "AB1 0AD", "INVALID", "INVALID"]
+    assert fixed_data["clean_postcode"].tolist() == expected
+    assert fixed_data["postcode_is_valid"].tolist() == [True] * 8 + [False] * 2
+    assert summary.repaired == {"section": 1, "group-section": 1, "district-section": 1, "pre 2017": 1}
+    assert (summary.valid_before, summary.valid_after) == (4, 8)
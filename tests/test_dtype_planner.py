@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from incognita.utility import dtype_planner
+
+
+def test_plan_data_types():
+    data = pd.DataFrame(
+        {
+            "count": pd.array([0, 3, 255], dtype="Int16"),
+            "small_count": pd.array([0, 3, 127], dtype="Int16"),
+            "missing_count": pd.array([0, None, 256], dtype="Int32"),
+            "change": np.array([-1, 0, 1], dtype=np.int64),
+            "id": pd.array([1, 2, 70_000], dtype="Int32"),
+            "valid": [True, False, True],
+            "coordinate": np.array([0.5, 1.25, np.nan]),
+            "precise": np.array([0.1, 0.2, 0.3]),
+            "date": ["2020-01-31", "2021-01-31", "2020-01-31"],
+            "code": ["E01", "E01", "E01"],
+            "name": ["a", "b", "c"],
+            "ctry": pd.Categorical(["E92000001", "W92000004", "E92000001"]),
+        }
+    )
+    plan = dtype_planner.plan_data_types(data)
+
+    assert plan == {
+        "count": np.dtype("int16"),
+        "small_count": np.dtype("int8"),
+        "missing_count": pd.Int16Dtype(),
+        "change": np.dtype("int8"),
+        "id": np.dtype("int32"),
+        "valid": np.dtype(bool),
+        "coordinate": np.dtype("float32"),
+        "precise": np.dtype("float64"),
+        "date": np.dtype("datetime64[ns]"),
+        "code": pd.CategoricalDtype(),
+        "name": np.dtype(object),
+        "ctry": data["ctry"].dtype,
+    }
+
+
+def test_apply_data_types_keeps_values():
+    data = pd.DataFrame({"count": pd.array([1, None, 200], dtype="Int64"), "date": ["2020-01-31", None, "2021-01-31"]})
+    planned = dtype_planner.apply_data_types(data.copy(), dtype_planner.plan_data_types(data))
+
+    assert planned["count"].dtype == pd.Int16Dtype()  # nullable, as a value is missing
+    assert planned["count"].astype("Int64").equals(data["count"])
+    assert planned["date"].dt.strftime(dtype_planner.DATE_FORMAT).tolist() == ["2020-01-31", np.nan, "2021-01-31"]
+
+    report = dtype_planner.memory_report(data, planned)
+    assert report.loc["Total", "bytes after"] < report.loc["Total", "bytes before"]
+
+
+def test_planned_integers_do_not_wrap():
+    data = pd.DataFrame({"members": np.array([0, 3, 200], dtype=np.int64)})
+    planned = dtype_planner.apply_data_types(data.copy(), dtype_planner.plan_data_types(data))
+
+    assert planned["members"].iloc[:2].sum() - planned["members"].iloc[2:].sum() == -197
+    assert (planned["members"] - 250).min() == -250
@@ -0,0 +1,52 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from incognita.data.postcode_index import build_postcode_index
+from incognita.data.postcode_index import PostcodeIndex
+from incognita.maps import map as incognita_map
+from incognita.maps.map import Map
+
+
+def _sections(clean_postcodes: list[str]) -> pd.DataFrame:
+    size = len(clean_postcodes)
+    return pd.DataFrame(
+        {
+            "Object_ID": range(size),
+            "D_ID": [1] * size,
+            "G_ID": [10 + i for i in range(size)],
+            "postcode": [postcode.lower() for postcode in clean_postcodes],
+            "clean_postcode": clean_postcodes,
+            "postcode_is_valid": [postcode not in {"error", "ZZ99 9ZZ"} for postcode in clean_postcodes],
+            "lat": [51.0 + i for i in range(size)],
+            "long": [-1.0 - i for i in range(size)],
+            "name": [f"Section {i}" for i in range(size)],
+            "C_name": ["County"] * size,
+            "D_name": ["District"] * size,
+            "G_name": [f"Group {i}" for i in range(size)],
+        }
+    )
+
+
+def test_meeting_places_skip_invalid_postcodes():
+    mapper = Map("test map", "Test map")
+    # two different postcodes that can't be cleaned, which must not be merged into one marker
+    mapper.add_meeting_places_to_map(_sections(["AB1 0XY", "error", "ZZ99 9ZZ", "AB2 0XY"]), "red", set(), layer_name="Sections")
+    markers = mapper.map["Sections"]
+    assert markers.count("'lat'") == 2
+    assert "Group 0" in markers and "Group 3" in markers
+    assert "Group 1" not in markers and "Group 2" not in markers
+
+
+def test_custom_data_keeps_csv_fields(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    build_postcode_index(pd.DataFrame({"lat": [51.5, 52.5], "long": [-1.5, -2.5]}, index=["AB1 0XY", "AB2 0XY"]), tmp_path / "postcode index.arrow")
+    monkeypatch.setattr(incognita_map, "PostcodeIndex", lambda: PostcodeIndex(tmp_path / "postcode index.arrow"))
+    # the CSV's own clean_postcode field must not be replaced by the normalised lookup keys
+    pd.DataFrame({"Postcodes": ["ab1 0xy", "AB20XY"], "clean_postcode": ["first", "second"]}).to_csv(tmp_path / "custom.csv", index=False)
+
+    mapper = Map("test map", "Test map")
+    mapper.add_custom_data(tmp_path / "custom.csv", "Custom", "Postcodes", marker_data=["clean_postcode"])
+    markers = mapper.map["Custom"]
+    assert "51.5" in markers and "52.5" in markers
+    assert "first" in markers and "second" in markers
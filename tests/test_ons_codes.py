@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from incognita.data import ons_codes
+from incognita.data import scout_census
+
+
+def test_extended_keeps_ids_stable():
+    first = ons_codes.ONSCodeDictionary.empty().extended(pd.Series(["E02", "E01", None, "E01"]), "May 2020")
+    assert first.version == 1
+    assert first.encode(np.array([scout_census.DEFAULT_VALUE, "E01", "E02", "E03", None], dtype=object)).tolist() == [0, 1, 2, -1, -1]
+
+    second = first.extended(pd.Index(["E03", "E02"]), "Nov 2020")
+    assert second.version == 2
+    assert second.releases == ("May 2020", "Nov 2020")
+    assert second.encode(np.array(["E01", "E02", "E03"], dtype=object)).tolist() == [1, 2, 3]
+    assert second.extended(["E01"], "Feb 2021") is second  # no new codes, same version
+
+
+def test_categorical_uses_ids_as_codes():
+    dictionary = ons_codes.ONSCodeDictionary(pd.Index(["error", "E01", "E02", "W01"]))
+    values = pd.Series(pd.Categorical(["W01", None, "E01", "W01"]), index=[3, 4, 5, 6], name="ctry")
+
+    encoded = dictionary.categorical(values)
+    assert dictionary.is_encoded(encoded)
+    assert encoded.cat.codes.tolist() == [3, -1, 1, 3]
+    pd.testing.assert_series_equal(encoded.astype(object), values.astype(object))
+
+    unknown = pd.Series(["E01", "S01"], name="ctry")
+    assert dictionary.categorical(unknown) is unknown  # not all codes are in the dictionary
+
+
+def test_encoded_file_round_trip(tmp_path):
+    dictionary = ons_codes.ONSCodeDictionary.empty().extended(["E01", "E02", "W01"], "May 2020")
+    dictionary.save(tmp_path / "codes.feather")
+    loaded_dictionary = ons_codes.load_dictionary(tmp_path / "codes.feather")
+    assert loaded_dictionary.codes.equals(dictionary.codes)
+    assert loaded_dictionary.version == 1
+
+    data = pd.DataFrame({"lsoa11": pd.Categorical(["E02", "W01", None]), "ctry": ["E01", "W01", "E01"], "imd_decile": pd.array([1, 10, None], dtype="UInt8")})
+    ons_codes.save_encoded(data, tmp_path / "reduced.feather", ["lsoa11", "ctry"], dictionary)
+
+    loaded = ons_codes.load_encoded(tmp_path / "reduced.feather", dictionary=loaded_dictionary)
+    assert loaded.columns.tolist() == ["lsoa11", "ctry", "imd_decile"]
+    assert loaded_dictionary.is_encoded(loaded["lsoa11"]) and loaded_dictionary.is_encoded(loaded["ctry"])
+    pd.testing.assert_frame_equal(loaded.astype({"lsoa11": object, "ctry": object}), data.astype({"lsoa11": object}))
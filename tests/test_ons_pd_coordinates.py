@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from incognita.data import ons_pd_coordinates
+from incognita.utility import constants
+
+
+def test_minified_round_trip_and_points(tmp_path):
+    data = pd.DataFrame(
+        {
+            "ctry": pd.Categorical(["E92000001", "W92000004"]),
+            "long": np.array([-0.1276, -3.1791], dtype=np.float32),
+            "lat": np.array([51.5072, 51.4816], dtype=np.float32),
+            "oseast1m": np.array([530034, 318229], dtype=np.float32),
+            "osnrth1m": np.array([180381, 176489], dtype=np.float32),
+        }
+    )
+    ons_pd_coordinates.save_minified(data, tmp_path / "minified.feather")
+    loaded = ons_pd_coordinates.load_minified(path=tmp_path / "minified.feather")
+    pd.testing.assert_frame_equal(loaded, data)
+
+    wgs_84_points = ons_pd_coordinates.points(loaded)
+    bng_points = ons_pd_coordinates.points(loaded, crs=constants.BNG)
+    assert wgs_84_points.crs.to_epsg() == constants.WGS_84
+    assert bng_points.crs.to_epsg() == constants.BNG
+    np.testing.assert_array_equal(bng_points.x, data["oseast1m"])
+    np.testing.assert_array_equal(wgs_84_points.y, data["lat"])
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from incognita.data import ons_codes
+from incognita.data import ons_pd_reduced
+from incognita.data.ons_pd_reduced import ReducedONSPD
+from incognita.utility import config
+
+
+@pytest.fixture
+def reduced_path(tmp_path, monkeypatch):
+    dictionary = ons_codes.ONSCodeDictionary.empty().extended(["E01", "E02", "W01", "E92", "W92"], "May 2020")
+    monkeypatch.setattr(config.SETTINGS.ons_pd, "codes", tmp_path / "codes.feather")
+    dictionary.save()
+
+    data = pd.DataFrame(
+        {
+            "lsoa11": pd.Categorical(["E01", "E02", "W01", None]),
+            "ctry": pd.Categorical(["E92", "E92", "W92", "W92"]),
+            "imd": np.array([10, 20, 30, 40], dtype=np.uint16),
+        }
+    )
+    ons_codes.save_encoded(data, tmp_path / "reduced.feather", ["lsoa11", "ctry"], dictionary)
+    return tmp_path / "reduced.feather"
+
+
+def test_columns_are_memoised(reduced_path):
+    ons_pd = ReducedONSPD(reduced_path)
+    first = ons_pd.columns(["lsoa11", "imd"])
+    assert first["lsoa11"].astype(object).tolist() == ["E01", "E02", "W01", np.nan]
+    assert ons_codes.load_dictionary().is_encoded(first["lsoa11"])
+
+    second = ons_pd.columns(["imd", "lsoa11", "ctry"])
+    assert np.shares_memory(first["imd"].to_numpy(), second["imd"].to_numpy())
+    assert np.shares_memory(first["lsoa11"].cat.codes.to_numpy(), second["lsoa11"].cat.codes.to_numpy())
+    assert second["ctry"].astype(object).tolist() == ["E92", "E92", "W92", "W92"]
+
+    with pytest.raises(KeyError):
+        ons_pd.columns(["pcon"])
+
+
+def test_least_recently_used_columns_are_released(reduced_path):
+    ons_pd = ReducedONSPD(reduced_path, max_cached_bytes=12)
+    ons_pd.columns(["lsoa11"])
+    ons_pd.columns(["imd"])
+    ons_pd.columns(["ctry"])
+    assert [name for name, _ in ons_pd._cached] == ["imd", "ctry"]
+    assert ons_pd.cached_bytes == 12
+
+
+def test_partitions_are_read_selectively(reduced_path):
+    data = pd.DataFrame(
+        {
+            "lsoa11": pd.Categorical(["W01", "E01", "E02", None]),
+            "ctry": pd.Categorical(["W92", "E92", "E92", "W92"]),
+            "imd": np.array([30, 10, 20, 40], dtype=np.uint16),
+        }
+    )
+    ons_pd_reduced.save_reduced(data, reduced_path, ["lsoa11", "ctry"], ons_codes.load_dictionary(), partition_by=("ctry",))
+    ons_pd = ReducedONSPD(reduced_path)
+    assert ons_pd.partition_by == ["ctry"]
+    assert len(ons_pd._select_batches({"ctry": {"W92"}})) == 1
+
+    wales = ons_pd.columns(["lsoa11", "imd"], where={"ctry": {"W92"}})
+    assert wales["lsoa11"].astype(object).tolist() == ["W01", np.nan]
+    assert wales["imd"].tolist() == [30, 40]
+    assert ons_pd.columns(["imd"], where={"ctry": {"S92"}}).empty
+
+    english_lsoa = ons_pd.columns(["imd"], where={"ctry": {"E92"}, "lsoa11": {"E02"}})
+    assert english_lsoa["imd"].tolist() == [20]
+    assert sorted(ons_pd.columns(["imd"])["imd"].tolist()) == [10, 20, 30, 40]
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from incognita.data.postcode_index import build_postcode_index
+from incognita.data.postcode_index import PostcodeIndex
+from incognita.data.postcode_index import PostcodeIndexBuilder
+
+
+@pytest.fixture
+def ons_pd_data() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "ctry": pd.Categorical(["E92000001", "W92000004", "E92000001", "S92000003"]),
+            "lat": np.array([51.5, 52.1, 53.0, 55.9], dtype=np.float32),
+            "imd": pd.array([10, 20, pd.NA, 40], dtype="UInt16"),
+        },
+        index=pd.Index(["ZE1 0AA", "AB1 0AA", "AB101AA", "M1  1AA"], name="pcd"),
+    )
+
+
+@pytest.fixture
+def postcode_index(ons_pd_data: pd.DataFrame, tmp_path) -> PostcodeIndex:
+    build_postcode_index(ons_pd_data, tmp_path / "postcode index.arrow")
+    return PostcodeIndex(tmp_path / "postcode index.arrow")
+
+
+def test_is_valid(postcode_index: PostcodeIndex):
+    postcodes = pd.Series(["AB1 0AA", "AB1 0AB", "M1  1AA", np.nan, "ZE1 0AA", "AB1 0AA ", "", "ZZZZZZZ", "AB1 0AÁ", "AB101AA"])
+    expected = np.array([True, False, True, False, True, False, False, False, False, True])
+    np.testing.assert_array_equal(postcode_index.is_valid(postcodes), expected)
+
+
+def test_lookup(postcode_index: PostcodeIndex, ons_pd_data: pd.DataFrame):
+    postcodes = pd.Series(["M1  1AA", "not valid", "AB101AA", "M1  1AA"], index=[5, 6, 7, 8])
+    expected = ons_pd_data.reindex(postcodes).set_axis(postcodes.index).rename_axis(None)
+    pd.testing.assert_frame_equal(postcode_index.lookup(postcodes), expected, check_categorical=False)
+
+
+def test_rows_and_attributes(postcode_index: PostcodeIndex):
+    assert len(postcode_index) == 4
+    rows = postcode_index.rows(pd.Series(["AB1 0AA", "ZE1 0AA", "ZZ9 9ZZ"]))
+    np.testing.assert_array_equal(rows, [0, 3, -1])  # sorted by postcode
+    assert postcode_index.attributes(rows, ["ctry"])["ctry"].tolist() == ["W92000004", "E92000001", np.nan]
+
+
+def test_lookup_fill_values(postcode_index: PostcodeIndex):
+    postcodes = pd.Series(["AB101AA", "not valid", "ZE1 0AA"])
+    looked_up = postcode_index.lookup(postcodes, ["ctry", "lat", "imd"], fill_values={"ctry": "error", "lat": 0, "imd": 0})
+
+    assert looked_up["ctry"].dtype == "category"
+    assert looked_up["ctry"].tolist() == ["E92000001", "error", "E92000001"]
+    assert looked_up["lat"].tolist() == [53.0, 0.0, 51.5]
+    assert looked_up["imd"].tolist() == [pd.NA, 0, 10]  # only missing rows are filled, not missing values
+
+
+def test_build_rejects_malformed_postcodes(ons_pd_data: pd.DataFrame, tmp_path):
+    with pytest.raises(ValueError):
+        build_postcode_index(ons_pd_data.set_axis(["AB1 0AA", "AB10AA", "AB101AA", "M1  1AA"]), tmp_path / "postcode index.arrow")
+
+
+def test_all_missing(postcode_index: PostcodeIndex):
+    assert not postcode_index.is_valid(pd.Series([np.nan, None], dtype=object)).any()
+
+
+def test_builder_matches_whole_build(ons_pd_data: pd.DataFrame, tmp_path):
+    duplicate = ons_pd_data.iloc[[1]].assign(lat=np.float32(0))  # later rows of a postcode are dropped
+    chunks = [ons_pd_data.iloc[:2], pd.concat([duplicate, ons_pd_data.iloc[2:]])]
+    builder = PostcodeIndexBuilder()
+    for chunk in chunks:
+        builder.add(chunk.assign(ctry=chunk["ctry"].cat.remove_unused_categories()))  # chunks have different categories
+    builder.build(tmp_path / "built.arrow", publication_date="May 2020")
+
+    build_postcode_index(ons_pd_data, tmp_path / "whole.arrow")
+    built, whole = PostcodeIndex(tmp_path / "built.arrow"), PostcodeIndex(tmp_path / "whole.arrow")
+    postcodes = pd.Series(ons_pd_data.index)
+    pd.testing.assert_frame_equal(built.lookup(postcodes), whole.lookup(postcodes))
+    assert len(built) == len(whole)
+    assert built.publication_date == "May 2020"
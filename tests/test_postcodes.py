@@ -0,0 +1,61 @@
+import re
+
+import hypothesis
+import hypothesis.strategies as st
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_series_equal
+
+from incognita.utility import postcodes
+
+POSTCODE_CHARACTERS = st.sampled_from(list('abcXYZ019 !"£$%^&*()-+\t.٣ß'))
+PostcodeSeries = st.lists(st.one_of(st.just(np.nan), st.text(POSTCODE_CHARACTERS, max_size=10)), min_size=1).map(lambda values: pd.Series(values + ["AB1 2CD"], dtype=object))
+
+
+def _regex_postcode_cleaner(postcode: pd.Series) -> pd.Series:
+    """Reference implementation (regex replace, upper-case, pad, then replace shifted numbers)."""
+
+    def pad_to_seven(single_postcode):
+        if single_postcode == single_postcode and len(single_postcode) in {5, 6}:
+            single_postcode = single_postcode[:-3] + " " * (7 - len(single_postcode)) + single_postcode[-3:]
+        return single_postcode
+
+    postcode = postcode.str.replace(re.compile(r'[\s+]|[^a-zA-Z\d!"£$%^&*()]'), "", regex=True).str.upper().apply(pad_to_seven)
+    for shifted, number in zip('!"£$%^&*()', "1234567890"):
+        postcode = postcode.str.replace(shifted, number, regex=False)
+    return postcode
+
+
+@hypothesis.given(PostcodeSeries)
+def test_normalise_matches_reference(data: pd.Series):
+    assert_series_equal(postcodes.normalise(data), _regex_postcode_cleaner(data))
+
+
+@hypothesis.given(PostcodeSeries)
+def test_normalise_categorical(data: pd.Series):
+    assert_series_equal(postcodes.normalise(data.astype("category")), _regex_postcode_cleaner(data))
+
+
+def test_normalise_examples():
+    data = pd.Series(["ab1 2cd", "AB12 3CD", " ab123cd ", "AB!  @CD", "sw1a1aa", np.nan, "x"], index=list("abcdefg"), name="postcode")
+    expected = pd.Series(["AB1 2CD", "AB123CD", "AB123CD", "AB  1CD", "SW1A1AA", np.nan, "X"], index=list("abcdefg"), name="postcode", dtype=object)
+
+    assert_series_equal(postcodes.normalise(data), expected)
+
+
+@hypothesis.given(st.lists(st.text(st.sampled_from(list(postcodes.KEY_ALPHABET)), min_size=7, max_size=7), min_size=1))
+def test_keys_round_trip_and_sort_as_postcodes(values: list[str]):
+    keys = postcodes.encode(np.array(values, dtype=object))
+    assert keys.dtype == np.uint64
+    assert postcodes.decode(keys).tolist() == values
+    np.testing.assert_array_equal(np.sort(keys), postcodes.encode(np.array(sorted(values), dtype=object)))
+
+
+def test_encode_invalid_postcodes():
+    keys = postcodes.encode(pd.Series(["AB1 2CD", np.nan, "ab1 2cd", "AB12CD", "AB1 2CÁ", "AB1-2CD", 1234567], dtype=object))
+    assert keys[0] != postcodes.INVALID_KEY
+    assert (keys[1:] == postcodes.INVALID_KEY).all()
+    decoded = postcodes.decode(keys)
+    assert decoded[0] == "AB1 2CD"
+    assert pd.isna(decoded[1:]).all()
+    assert postcodes.encode(pd.Series([], dtype=object)).size == 0
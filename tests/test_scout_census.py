@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+from incognita.data import scout_census
+from incognita.utility import categoricals
+from incognita.utility import config
+
+
+@pytest.fixture
+def census_data() -> pd.DataFrame:
+    data = pd.DataFrame(
+        {
+            "compass": pd.Categorical(["S1", "S2", "S3", "S1", "S2", "S4"]),
+            "Census_ID": pd.array([1, 1, 2, 2, 10, 10], dtype="Int16"),
+            "Beavers_total": pd.array([5, None, 7, 8, 9, 10], dtype="Int32"),
+            "X_name": pd.Categorical(["England", "Wales", "England", "Wales", "Scotland", "Wales"]),
+            "postcode_is_valid": [True, False, True, True, True, False],
+        }
+    )
+    return data
+
+
+@pytest.fixture(params=[False, True], ids=["by census", "by census and country"])
+def saved_census_data(census_data: pd.DataFrame, tmp_path, monkeypatch, request) -> pd.DataFrame:
+    scout_census.save_census_data(census_data, tmp_path / "census", partition_by_country=request.param)
+    monkeypatch.setattr(config.SETTINGS.census_extract, "merged", tmp_path / "census")
+    return census_data
+
+
+def test_load_census_data(saved_census_data: pd.DataFrame):
+    pd.testing.assert_frame_equal(scout_census.load_census_data(), saved_census_data)
+
+
+@pytest.mark.parametrize("partition_by_country", [False, True])
+@pytest.mark.parametrize("census_id_type", ["Int16", "int16", "int8"])
+def test_load_census_data_keeps_partition_types(census_data: pd.DataFrame, census_id_type: str, partition_by_country: bool, tmp_path, monkeypatch):
+    census_data["Census_ID"] = census_data["Census_ID"].astype(census_id_type)
+    scout_census.save_census_data(census_data, tmp_path / "census", partition_by_country=partition_by_country)
+    monkeypatch.setattr(config.SETTINGS.census_extract, "merged", tmp_path / "census")
+
+    loaded = scout_census.load_census_data()
+    pd.testing.assert_series_equal(loaded.dtypes, census_data.dtypes)
+    assert loaded["Census_ID"].dtype == census_id_type
+
+
+def test_save_census_data_replaces_dataset(census_data: pd.DataFrame, tmp_path, monkeypatch):
+    scout_census.save_census_data(census_data, tmp_path / "census", partition_by_country=True)
+    scout_census.save_census_data(census_data.iloc[:2], tmp_path / "census")
+    monkeypatch.setattr(config.SETTINGS.census_extract, "merged", tmp_path / "census")
+
+    loaded = scout_census.load_census_data()
+    pd.testing.assert_frame_equal(loaded, categoricals.tidy_categories(census_data.iloc[:2].copy()))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["census"]  # no temporary or previous directories left
+
+
+def test_save_census_data_keeps_other_directories(census_data: pd.DataFrame, tmp_path):
+    (tmp_path / "census").mkdir()
+    (tmp_path / "census" / "notes.txt").write_text("not census data")
+
+    with pytest.raises(ValueError):
+        scout_census.save_census_data(census_data, tmp_path / "census")
+    assert (tmp_path / "census" / "notes.txt").read_text() == "not census data"
+
+
+def test_load_census_data_filters(saved_census_data: pd.DataFrame):
+    loaded = scout_census.load_census_data(census_ids={2, 10}, countries={"Wales"}, columns=["X_name", "compass"])
+    expected = saved_census_data.loc[[3, 5], ["X_name", "compass"]].reset_index(drop=True)
+    expected = expected.apply(lambda col: col.cat.remove_unused_categories())
+    pd.testing.assert_frame_equal(loaded, expected)
+
+
+@pytest.fixture
+def memory_mapped_census_data(census_data: pd.DataFrame, tmp_path, monkeypatch) -> pd.DataFrame:
+    scout_census.save_memory_mapped_census_data(census_data, tmp_path / "census.arrow")
+    monkeypatch.setattr(config.SETTINGS.census_extract, "memory_mapped", tmp_path / "census.arrow")
+    return census_data
+
+
+def test_load_memory_mapped_census_data(memory_mapped_census_data: pd.DataFrame):
+    loaded = scout_census.load_census_data(memory_map=True)
+    pd.testing.assert_frame_equal(loaded, memory_mapped_census_data)
+    assert not loaded["Beavers_total"].array._data.flags.writeable  # a view on the memory map
+
+
+@pytest.mark.parametrize("census_ids", [{1, 2}, {2, 10}, {1, 10}, {3}])
+def test_load_memory_mapped_census_data_filters(memory_mapped_census_data: pd.DataFrame, census_ids: set[int]):
+    loaded = scout_census.load_census_data(census_ids=census_ids, countries={"Wales", "England"}, columns=["compass", "Census_ID"], memory_map=True)
+    expected = memory_mapped_census_data.loc[lambda df: df["Census_ID"].isin(census_ids) & df["X_name"].isin({"Wales", "England"}), ["compass", "Census_ID"]]
+    expected = expected.reset_index(drop=True)
+    pd.testing.assert_frame_equal(loaded, expected)
@@ -0,0 +1,189 @@
+import inspect
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+import pytest
+
+from incognita.data import postcode_index as postcode_index_module
+from incognita.data import scout_census
+from incognita.data.postcode_index import build_postcode_index
+from incognita.data.postcode_index import PostcodeIndex
+from incognita.preprocessing import census_merge_data
+from incognita.preprocessing import setup_data_file
+from incognita.utility import cache
+from incognita.utility import config
+from incognita.utility import postcodes
+
+VALID_POSTCODES = [f"AB{district}{' ' if district < 10 else ''}{sector}XY" for district in range(1, 13) for sector in range(10)]
+INVALID_POSTCODES = ["ZZ9 9ZZ", "not a postcode", np.nan]
+
+
+def _postcode_directory() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    size = len(VALID_POSTCODES)
+    data = {field: pd.Categorical(rng.choice([f"{field}_{i}" for i in range(5)], size)) for field in setup_data_file.ons_fields_data_types["categorical"]}
+    data["ctry"] = pd.Categorical(rng.choice(["E92000001", "W92000004"], size))
+    data |= {"lat": rng.random(size, dtype=np.float32), "long": rng.random(size, dtype=np.float32), "imd": pd.array(rng.integers(1, 1909, size), dtype="UInt16")}
+    return pd.DataFrame(data, index=pd.Index(VALID_POSTCODES, name="pcd"))
+
+
+def _raw_census(census_ids: list[int], districts: list[int], seed: int) -> pd.DataFrame:
+    """Synthetic raw census records, with some invalid postcodes and a section that moves between groups."""
+    rng = np.random.default_rng(seed)
+    records = []
+    for census_id in census_ids:
+        for district_id in districts:
+            records.append({"compass": f"D{district_id}", "type": "District", "G_ID": pd.NA, "D_ID": district_id})
+            records += [{"compass": f"D{district_id}-{unit}", "type": unit, "G_ID": pd.NA, "D_ID": district_id} for unit in ("Unit", "Network")]
+            for group in range(2):
+                group_id = district_id * 10 + group
+                records.append({"compass": f"G{group_id}", "type": "Group", "G_ID": group_id, "D_ID": district_id})
+                for section in ("Colony", "Pack", "Troop"):
+                    moved = section == "Troop" and group == 0 and census_id > 1  # moves to the district's second group
+                    records.append({"compass": f"G{group_id}-{section}", "type": section, "G_ID": group_id + moved, "D_ID": district_id})
+    data = pd.DataFrame(records)
+    data["Census_ID"] = np.repeat(census_ids, len(data.index) // len(census_ids))
+    data["Census Date"] = data["Census_ID"].map(lambda census_id: f"20{census_id + 10}-01-31")
+    postcodes = pd.Series(rng.choice(VALID_POSTCODES, len(data.index)))
+    data["postcode"] = postcodes.where(rng.random(len(data.index)) > 0.4, pd.Series(rng.choice(INVALID_POSTCODES, len(data.index))).str.lower())
+
+    for col in setup_data_file.cols_int_16:
+        if col not in data.columns and col != "Census_ID":
+            data[col] = rng.integers(0, 20, len(data.index))
+    for col in setup_data_file.cols_int_32:
+        if col not in data.columns and col != "imd":
+            data[col] = rng.integers(0, 20, len(data.index))
+    for col in setup_data_file.cols_categorical:
+        if col not in data.columns and col != "clean_postcode":
+            data[col] = rng.choice(["a", "b", "c"], len(data.index))
+    data = data.astype({col: "Int16" for col in setup_data_file.cols_int_16} | {col: "Int32" for col in setup_data_file.cols_int_32 if col != "imd"})
+    return data.astype({col: "category" for col in setup_data_file.cols_categorical if col != "clean_postcode"})
+
+
+@pytest.fixture
+def postcode_index(tmp_path) -> PostcodeIndex:
+    build_postcode_index(_postcode_directory(), tmp_path / "postcode index.arrow")
+    return PostcodeIndex(tmp_path / "postcode index.arrow")
+
+
+def test_append_census_data_matches_full_merge(postcode_index: PostcodeIndex):
+    existing_census = _raw_census([1, 2], districts=[1, 2, 3], seed=1)
+    new_census = _raw_census([3], districts=[1, 2], seed=2)
+
+    full = setup_data_file.merge_census_data(pd.concat([existing_census, new_census], ignore_index=True), postcode_index)
+    existing_merged = setup_data_file.merge_census_data(existing_census.copy(), postcode_index)
+    appended = setup_data_file.append_census_data(existing_merged, new_census.copy(), postcode_index)
+
+    assert_frame_equal(appended, full)
+
+
+def test_append_links_only_records_sharing_entities_with_invalid_postcodes(postcode_index: PostcodeIndex):
+    existing_census = _raw_census([1, 2], districts=[1, 2, 3], seed=1)
+    new_census = _raw_census([3], districts=[1], seed=2)
+    new_census["postcode"] = pd.Categorical(np.resize(VALID_POSTCODES, len(new_census.index)))
+    new_census.loc[new_census["compass"] == "G10-Pack", "postcode"] = np.nan
+
+    linked = census_merge_data.rows_linked_by_entity(existing_census, new_census, postcode_index)
+    existing_invalid = ~postcode_index.is_valid(postcodes.normalise(existing_census["postcode"]))
+    assert not linked[existing_census["D_ID"] != 1].any()
+    assert linked[(existing_census["D_ID"] == 1) & existing_invalid].all()
+    assert linked[existing_census["compass"] == "G10-Pack"].all()  # sources for the new invalid record
+    assert not linked.all()
+
+    full = setup_data_file.merge_census_data(pd.concat([existing_census, new_census], ignore_index=True), postcode_index)
+    appended = setup_data_file.append_census_data(setup_data_file.merge_census_data(existing_census.copy(), postcode_index), new_census.copy(), postcode_index)
+    assert_frame_equal(appended, full)
+
+
+@pytest.fixture
+def output_paths(tmp_path, monkeypatch) -> Path:
+    output_path = tmp_path / "output"
+    output_path.mkdir()
+    monkeypatch.setattr(config.SETTINGS.census_extract, "original", output_path / "extract.csv")
+    monkeypatch.setattr(config.SETTINGS.folders, "output", output_path)
+    return output_path
+
+
+def test_save_merged_data_selected_formats(postcode_index: PostcodeIndex, output_paths: Path):
+    merged = setup_data_file.merge_census_data(_raw_census([1, 2], districts=[1, 2], seed=1), postcode_index)
+
+    assert setup_data_file.save_merged_data(merged, "May 2020", output_formats=["errors", "arrow"]) is None
+    assert sorted(path.name for path in output_paths.iterdir()) == ["error_file.csv", "extract with May 2020 fields.arrow"]
+
+    csv_write = setup_data_file.save_merged_data(merged, "May 2020", output_formats=["csv", "parquet"], defer_csv=True)
+    csv_write.result()
+    assert (output_paths / "extract with May 2020 fields").is_dir()
+    assert len(pd.read_csv(output_paths / "extract with May 2020 fields.csv").index) == len(merged.index)
+
+
+def test_save_merged_data_unknown_format(output_paths: Path):
+    with pytest.raises(ValueError):
+        setup_data_file.save_merged_data(pd.DataFrame(), "May 2020", output_formats=["xlsx"])
+
+
+def test_update_census_data_matches_full_merge(postcode_index: PostcodeIndex, tmp_path):
+    # New release: a new postcode (only used by one district in the census), and re-assigned wards
+    new_release = _postcode_directory()
+    new_release = pd.concat([new_release, new_release.iloc[:1].set_axis(pd.Index(["AB1 9NW"], name="pcd"))])
+    new_release["osward"] = new_release["osward"].cat.add_categories("osward_new")
+    new_release.loc[VALID_POSTCODES[5:15], "osward"] = "osward_new"
+    build_postcode_index(new_release, tmp_path / "new postcode index.arrow")
+    new_index = PostcodeIndex(tmp_path / "new postcode index.arrow")
+
+    release_diff = postcode_index_module.diff_indexes(postcode_index, new_index, setup_data_file.ons_fields_data_types["categorical"])
+    assert release_diff["status"].value_counts().to_dict() == {"added": 1, "removed": 0, "changed": 10}
+    assert release_diff.loc[release_diff["status"] == "changed", "osward"].all()
+    assert not release_diff.loc[release_diff["status"] == "changed", "lsoa11"].any()
+
+    raw_census = _raw_census([1, 2], districts=[1, 2, 3], seed=1)
+    raw_census["postcode"] = raw_census["postcode"].cat.add_categories("ab1 9nw")
+    raw_census.loc[(raw_census["D_ID"] == 1) & (raw_census["type"] == "Group"), "postcode"] = "ab1 9nw"
+    merged = setup_data_file.merge_census_data(raw_census.copy(), postcode_index)
+    updated = setup_data_file.update_census_data(merged, release_diff, new_index)
+
+    assert_frame_equal(updated, setup_data_file.merge_census_data(raw_census.copy(), new_index))
+
+
+def test_update_census_extract_labels_outputs_with_new_release(postcode_index: PostcodeIndex, output_paths: Path, tmp_path, monkeypatch):
+    setup_data_file.save_merged_data(setup_data_file.merge_census_data(_raw_census([1, 2], districts=[1, 2], seed=1), postcode_index), "May 2020", output_formats=["parquet"])
+    build_postcode_index(_postcode_directory().iloc[1:], tmp_path / "new postcode index.arrow", publication_date="May 2021")
+    monkeypatch.setattr(config.SETTINGS.census_extract, "merged", output_paths / "extract with May 2020 fields")
+    monkeypatch.setattr(config.SETTINGS.ons_pd, "index", tmp_path / "new postcode index.arrow")
+
+    assert PostcodeIndex(tmp_path / "new postcode index.arrow").publication_date == "May 2021"
+    assert postcode_index.publication_date is None
+    setup_data_file.update_census_extract(postcode_index.path, output_formats=["parquet"])
+    assert (output_paths / "ONS PD changes in May 2021.csv").is_file()
+    assert (output_paths / "extract with May 2021 fields").is_dir()
+
+    monkeypatch.setattr(config.SETTINGS.ons_pd, "index", postcode_index.path)
+    with pytest.raises(ValueError):
+        setup_data_file.update_census_extract(postcode_index.path, output_formats=["parquet"])
+
+
+def test_census_stages_are_keyed_by_module_code(postcode_index: PostcodeIndex, tmp_path, monkeypatch):
+    extract_path = tmp_path / "extract.csv"
+    extract_path.write_text("compass\n1\n")
+
+    def stage_keys() -> list[str]:
+        stage = setup_data_file.census_stages(cache.StageCache(tmp_path / "cache"), extract_path, postcode_index.path)
+        keys = []
+        while stage.upstream:
+            keys.append(stage.key)
+            stage = stage.upstream[0]
+        return [stage.key, *reversed(keys)]  # load, merge, IMD deciles, data types
+
+    before = stage_keys()
+    source = inspect.getsource
+
+    # an edit to a helper of this module (e.g. `_set_column`) or to the census labels invalidates the load and data types stages
+    for module in (setup_data_file, scout_census):
+        monkeypatch.setattr(inspect, "getsource", lambda obj, edited=module: source(obj) + "# edited" if obj is edited else source(obj))
+        after = stage_keys()
+        assert after[0] != before[0]
+        monkeypatch.setattr(inspect, "getsource", source)
+    assert stage_keys() == before
+    monkeypatch.setattr(inspect, "getsource", lambda obj: source(obj) + "# edited" if obj is setup_data_file else source(obj))
+    assert stage_keys()[3] != before[3]
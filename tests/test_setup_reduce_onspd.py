@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from incognita.preprocessing.setup_reduce_onspd import UniqueRows
+
+
+def test_unique_rows_across_chunks():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame({"cat": pd.Categorical(rng.choice(["a", "b", None], 1000)), "imd": pd.array(rng.choice([1, 2, None], 1000), dtype="UInt16")})
+    chunks = [data.iloc[i : i + 100].copy() for i in range(0, 1000, 100)]
+    for chunk in chunks[::2]:
+        chunk["cat"] = chunk["cat"].cat.reorder_categories(["b", "a"])  # categories differ between chunks
+
+    unique_rows = UniqueRows()
+    result = pd.concat([unique_rows(chunk) for chunk in chunks])
+    pd.testing.assert_frame_equal(result, data.drop_duplicates(), check_categorical=False)
+
+
+def test_unique_rows_are_exact():
+    # rows differing only in one value, missing values or text values are told apart exactly
+    data = pd.DataFrame(
+        {
+            "lat": np.array([51.5, 51.5, np.nan, 0.0, 0.0, 51.5], dtype=np.float32),
+            "code": ["a", "a", "a", None, None, "b"],
+            "imd": pd.array([1, 1, 1, 0, 0, None], dtype="UInt16"),
+        }
+    )
+    unique_rows = UniqueRows()
+    result = pd.concat([unique_rows(data.iloc[:3]), unique_rows(data.iloc[3:]), unique_rows(data)])
+    pd.testing.assert_frame_equal(result, data.iloc[[0, 2, 3, 5]])
+
+
+def test_unique_rows_keep_rows_with_colliding_hashes(monkeypatch):
+    data = pd.DataFrame({"code": ["a", "b", "a", "c"], "imd": pd.array([1, 2, 1, 3], dtype="UInt16")})
+    monkeypatch.setattr(pd.util, "hash_pandas_object", lambda chunk, index: pd.Series(np.zeros(len(chunk.index), dtype=np.uint64)))
+
+    unique_rows = UniqueRows()
+    result = pd.concat([unique_rows(data.iloc[:2]), unique_rows(data.iloc[2:])])
+    pd.testing.assert_frame_equal(result, data.iloc[[0, 1, 3]])
@@ -8,6 +8,7 @@ import toml
 
 from incognita.data import ons_pd
 from incognita.logger import logger
+from incognita.utility import categoricals
 from incognita.utility import config
 from incognita.utility import deciles
 from incognita.utility import root
@@ -38,6 +39,19 @@ def test_calc_imd_decile():
     assert_series_equal(imd_decile_data, predicted_result, check_dtype=False)
 
 
+@pytest.mark.parametrize(
+    "dtypes, expected",
+    [(("int8", "Int16"), "Int16"), (("int8", "int16"), "int16"), (("Int8", "Int32"), "Int32"), (("int16", "uint8"), "int16"), (("int64", "uint64"), "float64")],
+)
+def test_concat_aligns_integer_types(dtypes: tuple[str, str], expected: str):
+    frames = [pd.DataFrame({"count": pd.Series([1, 2], dtype=dtype)}) for dtype in dtypes]
+    result = categoricals.concat(frames)
+
+    assert str(result["count"].dtype) == expected
+    assert result["count"].tolist() == [1, 2, 1, 2]
+    assert [str(frame["count"].dtype) for frame in frames] == list(dtypes)  # passed frames are unchanged
+
+
 def test_settings_are_accurate():
     with open(root.PROJECT_ROOT.joinpath("incognita-config.toml"), "r") as read_file:
         settings = toml.load(read_file)